@@ -1,5 +1,5 @@
 import os
-import json
+import copy
 import time
 import numpy as np
 import cv2
@@ -62,7 +62,8 @@ class AchievementCertificate:
             },
             "optional": {
                 "custom_image": ("IMAGE",),
-                "fun_quote": ("STRING", {"default": "", "multiline": True})
+                "fun_quote": ("STRING", {"default": "", "multiline": True}),
+                "user_id": ("STRING", {"default": "", "multiline": False, "description": "学习中心用户ID（ComfyUI多用户模式下的用户），留空为默认用户"})
             }
         }
     
@@ -72,11 +73,11 @@ class AchievementCertificate:
     FUNCTION = "generate_certificate"
     CATEGORY = "学习中心/成就"
     
-    def generate_certificate(self, user_name, certificate_style, achievement_title, font_size, text_color, bg_color, show_mascot, mascot_style, border_style, custom_image=None, fun_quote="", override_level=False, manual_level="初学者"):
+    def generate_certificate(self, user_name, certificate_style, achievement_title, font_size, text_color, bg_color, show_mascot, mascot_style, border_style, custom_image=None, fun_quote="", override_level=False, manual_level="初学者", user_id=""):
         """生成成就证书图像"""
         try:
-            # 从progress.json获取完成的章节数
-            completed_count = self.get_completed_chapters_count()
+            # 从该用户的学习进度获取完成的章节数
+            completed_count = self.get_completed_chapters_count(user_id)
             print(f"[成就系统] 从进度文件读取到已完成章节数: {completed_count}")
             
             # 根据完成的章节数确定成就级别，除非在高级选项中被覆盖
@@ -88,7 +89,7 @@ class AchievementCertificate:
                 print(f"[成就系统] 根据完成章节数({completed_count})自动确定成就级别: {level}")
             
             # 检查隐藏成就
-            hidden_achievements = self.check_hidden_achievements(mascot_style)
+            hidden_achievements = self.check_hidden_achievements(mascot_style, user_id)
             
             # 根据输入的级别和完成章节数生成证书
             certificate_image = self.create_certificate(
@@ -151,17 +152,13 @@ class AchievementCertificate:
                 return (torch.from_numpy(error_img),)
             return (error_img,)
     
-    def get_completed_chapters_count(self):
+    def get_completed_chapters_count(self, user_id=""):
         """获取用户完成的章节数"""
-        progress_file = os.path.join(current_dir, "user_progress", "progress.json")
-        if not os.path.exists(progress_file):
-            return 0
-        
+        # 通过学习中心读取该用户已加载到内存中的进度
+        from .learningcenter import get_user_progress
+        from .user_progress import normalize_namespace
         try:
-            with open(progress_file, "r", encoding="utf-8-sig") as f:
-                progress_data = json.load(f)
-                completed_chapters = progress_data.get("completed_chapters", {})
-                return len(completed_chapters)
+            return get_user_progress(normalize_namespace(user_id)).completed_count()
         except Exception as e:
             print(f"[成就系统] 无法读取用户进度: {e}")
             return 0
@@ -199,37 +196,21 @@ class AchievementCertificate:
         
         return next_level, chapters_needed
     
-    def check_hidden_achievements(self, current_mascot_style):
+    def check_hidden_achievements(self, current_mascot_style, user_id=""):
         """检查隐藏成就是否达成"""
-        # 获取用户的Opai风格使用历史
-        hidden_achievements = dict(HIDDEN_ACHIEVEMENTS)
-        try:
-            # 读取隐藏成就记录文件
-            achievements_file = os.path.join(current_dir, "user_progress", "hidden_achievements.json")
-            if not os.path.exists(achievements_file):
-                # 初始化文件
-                os.makedirs(os.path.dirname(achievements_file), exist_ok=True)
-                with open(achievements_file, "w", encoding="utf-8") as f:
-                    json.dump({
-                        "opai_styles_used": [],
-                        "unlocked_achievements": []
-                    }, f, ensure_ascii=False, indent=2)
-            
-            # 读取当前成就状态
-            with open(achievements_file, "r", encoding="utf-8") as f:
-                achievements_data = json.load(f)
-                
+        # 每次返回独立的副本，解锁状态不会写回全局定义，也不会串到其他用户
+        hidden_achievements = copy.deepcopy(HIDDEN_ACHIEVEMENTS)
+        from .learningcenter import get_user_progress
+        from .user_progress import normalize_namespace
+        
+        def record_style(achievements_data):
             # 获取已使用的Opai风格
-            opai_styles_used = achievements_data.get("opai_styles_used", [])
-            unlocked_achievements = achievements_data.get("unlocked_achievements", [])
+            opai_styles_used = achievements_data.setdefault("opai_styles_used", [])
+            unlocked_achievements = achievements_data.setdefault("unlocked_achievements", [])
             
             # 添加当前使用的风格
             if current_mascot_style not in opai_styles_used:
                 opai_styles_used.append(current_mascot_style)
-                # 更新文件
-                achievements_data["opai_styles_used"] = opai_styles_used
-                with open(achievements_file, "w", encoding="utf-8") as f:
-                    json.dump(achievements_data, f, ensure_ascii=False, indent=2)
                 print(f"[成就系统] 记录新的Opai风格使用: {current_mascot_style}，当前已使用: {opai_styles_used}")
             
             # 检查是否解锁"Opai粉丝"成就
@@ -239,12 +220,14 @@ class AchievementCertificate:
             if is_opai_fan and "opai_fan" not in unlocked_achievements:
                 # 解锁成就
                 unlocked_achievements.append("opai_fan")
-                achievements_data["unlocked_achievements"] = unlocked_achievements
-                with open(achievements_file, "w", encoding="utf-8") as f:
-                    json.dump(achievements_data, f, ensure_ascii=False, indent=2)
                 print("[成就系统] 解锁隐藏成就: Opai粉丝！已尝试所有Opai风格")
-                hidden_achievements["opai_fan"]["unlocked"] = True
-            elif "opai_fan" in unlocked_achievements:
+        
+        try:
+            # 在该用户的锁内读取、更新并保存隐藏成就记录，多个节点同时执行时不会丢失记录
+            # （json后端为hidden_achievements.json，sqlite后端为achievements表）
+            user_progress = get_user_progress(normalize_namespace(user_id))
+            achievements_data = user_progress.update_achievements(record_style)
+            if "opai_fan" in achievements_data.get("unlocked_achievements", []):
                 hidden_achievements["opai_fan"]["unlocked"] = True
                 
         except Exception as e:
@@ -915,25 +898,25 @@ class AchievementInfo:
     def INPUT_TYPES(cls):
         return {
             "required": {},
+            "optional": {
+                "user_id": ("STRING", {"default": "", "multiline": False, "description": "学习中心用户ID（ComfyUI多用户模式下的用户），留空为默认用户"})
+            }
         }
     
     RETURN_TYPES = ("STRING",)
     FUNCTION = "get_achievement_info"
     CATEGORY = "学习中心/成就"
     
-    def get_achievement_info(self):
+    def get_achievement_info(self, user_id=""):
         # 获取用户进度
-        progress_file = os.path.join(current_dir, "user_progress", "progress.json")
+        from .learningcenter import get_user_progress
+        from .user_progress import normalize_namespace
         completed_count = 0
         
-        if os.path.exists(progress_file):
-            try:
-                with open(progress_file, "r", encoding="utf-8-sig") as f:
-                    progress_data = json.load(f)
-                    completed_chapters = progress_data.get("completed_chapters", {})
-                    completed_count = len(completed_chapters)
-            except Exception as e:
-                print(f"[成就系统] 无法读取用户进度: {e}")
+        try:
+            completed_count = get_user_progress(normalize_namespace(user_id)).completed_count()
+        except Exception as e:
+            print(f"[成就系统] 无法读取用户进度: {e}")
         
         # 确定成就级别
         level = "初学者"  # 默认级别
@@ -0,0 +1,178 @@
+import os
+import threading
+import time
+
+# 尝试导入watchdog（Linux上使用inotify），如果失败则退回到轮询线程
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+    WATCHDOG_AVAILABLE = True
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+    WATCHDOG_AVAILABLE = False
+
+# 监视模式: off(默认) / auto / inotify / poll
+CATALOG_WATCH_MODE = os.environ.get("LEARNINGCENTER_WATCH", "off").lower()
+# 轮询模式的检查间隔（秒）
+CATALOG_POLL_INTERVAL = float(os.environ.get("LEARNINGCENTER_WATCH_INTERVAL", "5"))
+# 合并事件的等待时间（秒），批量拷贝模板时避免对同一章节重复解析
+CATALOG_EVENT_DELAY = 0.5
+
+# 会影响章节索引的文件
+WATCHED_FILES = ("metadata.json", "exercise.json", "answer.json")
+
+
+def is_watched_file(file_name):
+    """判断文件变化是否需要更新章节索引"""
+    return file_name in WATCHED_FILES or file_name.startswith("preview.")
+
+
+class _CatalogEventHandler(FileSystemEventHandler):
+    """把文件系统事件转交给CatalogWatcher"""
+
+    def __init__(self, watcher):
+        super().__init__()
+        self.watcher = watcher
+
+    def on_any_event(self, event):
+        if event.event_type in ("opened", "closed", "closed_no_write"):
+            return
+        for path in (event.src_path, getattr(event, "dest_path", None)):
+            if not path:
+                continue
+            if isinstance(path, bytes):
+                path = os.fsdecode(path)
+            if event.is_directory or is_watched_file(os.path.basename(path)):
+                self.watcher.notify(path)
+
+
+class CatalogWatcher:
+    """后台监视templates目录并增量更新章节索引"""
+
+    def __init__(self, catalog, mode="auto", poll_interval=CATALOG_POLL_INTERVAL):
+        self.catalog = catalog
+        self.mode = mode
+        self.poll_interval = poll_interval
+        self._observer = None
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+        self._pending_event = threading.Event()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """启动监视器；返回实际使用的模式"""
+        if self.running:
+            return self.mode
+
+        use_inotify = self.mode in ("auto", "inotify") and WATCHDOG_AVAILABLE
+        if self.mode == "inotify" and not WATCHDOG_AVAILABLE:
+            print("[LearningCenter] 警告: 未安装watchdog，模板监视退回到轮询模式")
+
+        self._stop_event.clear()
+        if use_inotify:
+            try:
+                self._observer = Observer()
+                self._observer.schedule(_CatalogEventHandler(self), self.catalog.templates_dir, recursive=True)
+                self._observer.start()
+                self.mode = "inotify"
+                self._thread = threading.Thread(target=self._event_loop, name="LearningCenterCatalogWatcher", daemon=True)
+            except Exception as e:
+                print(f"[LearningCenter] 启动文件监视失败，退回到轮询模式: {e}")
+                self._observer = None
+                use_inotify = False
+
+        if not use_inotify:
+            self.mode = "poll"
+            self._thread = threading.Thread(target=self._poll_loop, name="LearningCenterCatalogPoller", daemon=True)
+
+        # 启动前做一次完整检查，之后请求路径上不再检查mtime
+        self.catalog.refresh(force=True)
+        self.catalog.watched = True
+        self._thread.start()
+        print(f"[LearningCenter] 模板目录监视已启动，模式: {self.mode}")
+        return self.mode
+
+    def stop(self):
+        self._stop_event.set()
+        self._pending_event.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join(timeout=5)
+            self._observer = None
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.catalog.watched = False
+
+    def notify(self, path):
+        """记录发生变化的路径，由后台线程合并处理"""
+        with self._pending_lock:
+            self._pending.add(path)
+        self._pending_event.set()
+
+    def _drain(self):
+        with self._pending_lock:
+            paths = self._pending
+            self._pending = set()
+            self._pending_event.clear()
+        return paths
+
+    def _event_loop(self):
+        while not self._stop_event.is_set():
+            self._pending_event.wait()
+            if self._stop_event.is_set():
+                break
+            # 稍作等待，合并同一批文件操作产生的事件
+            time.sleep(CATALOG_EVENT_DELAY)
+            paths = self._drain()
+            changed = 0
+            # 先处理浅层路径，目录的增删会覆盖其下的文件事件
+            for path in sorted(paths, key=lambda p: p.count(os.sep)):
+                try:
+                    if self.catalog.apply_change(path):
+                        changed += 1
+                except Exception as e:
+                    print(f"[LearningCenter] 更新章节索引出错 {path}: {e}")
+            if changed:
+                print(f"[LearningCenter] 模板目录发生变化，已增量更新 {changed} 处")
+
+    def _poll_loop(self):
+        while not self._stop_event.wait(self.poll_interval):
+            try:
+                if self.catalog.refresh(force=True):
+                    print("[LearningCenter] 轮询检测到模板目录变化，章节索引已更新")
+            except Exception as e:
+                print(f"[LearningCenter] 轮询模板目录出错: {e}")
+
+
+# 进程内唯一的监视器
+_watcher = None
+
+
+def start_catalog_watcher(catalog, mode=None, poll_interval=None):
+    """按配置启动模板目录监视器，mode为off时不启动"""
+    global _watcher
+    mode = (mode or CATALOG_WATCH_MODE).lower()
+    if mode in ("off", "0", "false", "no", ""):
+        return None
+    if mode not in ("auto", "inotify", "poll"):
+        print(f"[LearningCenter] 未知的监视模式 {mode}，使用auto")
+        mode = "auto"
+    if _watcher is not None and _watcher.running:
+        return _watcher
+    _watcher = CatalogWatcher(catalog, mode, poll_interval or CATALOG_POLL_INTERVAL)
+    _watcher.start()
+    return _watcher
+
+
+def stop_catalog_watcher():
+    global _watcher
+    if _watcher is not None:
+        _watcher.stop()
+        _watcher = None
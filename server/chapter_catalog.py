@@ -0,0 +1,613 @@
+import base64
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from .chapter_search import ChapterSearchIndex
+
+# 目录检查的最小间隔（秒），避免每个请求都对所有章节执行stat
+CATALOG_CHECK_INTERVAL = float(os.environ.get("LEARNINGCENTER_CATALOG_CHECK_INTERVAL", "2"))
+
+# 支持过滤和计数的元数据字段
+FACET_FIELDS = ("difficulty", "purpose", "model")
+
+# 教程难度分类（同时作为按难度排序的顺序）
+CHAPTER_DIFFICULTIES = ["beginner", "intermediate", "advanced"]
+
+# 章节列表支持的排序方式，relevance仅在搜索时可用
+SORT_KEYS = ("order", "created_at", "difficulty", "relevance")
+
+
+# 安全读取JSON文件，先尝试utf-8-sig（兼容BOM），失败后尝试gbk
+def safe_read_json(file_path, default=None):
+    try:
+        with open(file_path, "r", encoding="utf-8-sig") as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"[LearningCenter] 读取文件出错 {file_path}: {e}")
+        try:
+            with open(file_path, "r", encoding="gbk") as f:
+                return json.load(f)
+        except Exception as e2:
+            print(f"[LearningCenter] 第二次尝试读取文件也失败 {file_path}: {e2}")
+            return {} if default is None else default
+
+
+# 旧式章节目录的排序键：chapter12_xxx -> 12
+def chapter_sort_key(dir_name):
+    number = dir_name.replace("chapter", "").split("_")[0]
+    return int(number) if number.isdigit() else 999
+
+
+# 目录版本号：章节或用户进度发生变化时递增，用于生成ETag
+_generation = 0
+_generation_lock = threading.Lock()
+
+
+def bump_generation():
+    """递增目录版本号并返回新值"""
+    global _generation
+    with _generation_lock:
+        _generation += 1
+        return _generation
+
+
+def get_generation():
+    return _generation
+
+
+def encode_cursor(sort, key):
+    """把分页位置编码为不透明的游标字符串"""
+    raw = json.dumps([sort, list(key)], ensure_ascii=False, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+# 排序键中各元素的类型，与ChapterCatalog._sort_key一致：
+# 目录顺序为 (旧式/模型章节, 章节编号, 章节ID)，其他排序方式在前面加一个元素
+_ORDER_KEY_TYPES = (int, int, str)
+_SORT_KEY_TYPES = {
+    "order": _ORDER_KEY_TYPES,
+    "created_at": ((int, float),) + _ORDER_KEY_TYPES,
+    "difficulty": (int,) + _ORDER_KEY_TYPES,
+    "relevance": ((int, float),) + _ORDER_KEY_TYPES,
+}
+
+
+def _valid_sort_key(sort, key):
+    types = _SORT_KEY_TYPES.get(sort)
+    if types is None or len(key) != len(types):
+        return False
+    return all(isinstance(value, t) and not isinstance(value, bool) for value, t in zip(key, types))
+
+
+def decode_cursor(cursor):
+    """解析游标，返回 (sort, key)；格式错误或排序键与排序方式不匹配时抛出ValueError"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        sort, key = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8"))
+        key = tuple(key)
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(sort, str) or not _valid_sort_key(sort.lstrip("-"), key):
+        raise ValueError("Invalid cursor")
+    return sort, key
+
+
+def project_fields(chapters, fields):
+    """只保留指定字段，id字段始终保留"""
+    if not fields:
+        return chapters
+    keep = ["id"] + [f for f in fields if f != "id"]
+    return [{f: chapter[f] for f in keep if f in chapter} for chapter in chapters]
+
+
+def facet_values(value):
+    """把元数据字段转换为小写的分面取值集合"""
+    if isinstance(value, str):
+        value = value.strip().lower()
+        return {value} if value else set()
+    if isinstance(value, (list, tuple)):
+        return {v.strip().lower() for v in value if isinstance(v, str) and v.strip()}
+    return set()
+
+
+def _stat_or_none(path):
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
+
+def _list_subdirs(path):
+    """列出目录下的所有子目录名称"""
+    try:
+        with os.scandir(path) as it:
+            return sorted(entry.name for entry in it if entry.is_dir())
+    except OSError:
+        return []
+
+
+def _list_files(path):
+    """列出目录下的所有文件及其大小和修改时间"""
+    files = {}
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_file():
+                    st = entry.stat()
+                    files[entry.name] = {"size": st.st_size, "mtime": st.st_mtime, "mtime_ns": st.st_mtime_ns}
+    except OSError as e:
+        print(f"[LearningCenter] 读取章节目录出错 {path}: {e}")
+    return files
+
+
+# 可以作为预览图的图片格式
+PREVIEW_EXTS = (".png", ".jpg", ".jpeg", ".webp", ".gif")
+
+
+def find_preview_file(files):
+    """按 preview.png、其他格式的 preview.*、目录中任意图片的顺序选择预览图，没有时返回None"""
+    for ext in PREVIEW_EXTS:
+        if f"preview{ext}" in files:
+            return f"preview{ext}"
+    for name in files:
+        if os.path.splitext(name.lower())[1] in PREVIEW_EXTS:
+            return name
+    return None
+
+
+class _CatalogView:
+    """发布给读取方的不可变快照：章节记录、分面索引和目录顺序"""
+
+    __slots__ = ("records", "facets", "sorted_ids")
+
+    def __init__(self, records, facets, sorted_ids):
+        self.records = records
+        self.facets = facets
+        self.sorted_ids = sorted_ids
+
+
+class ChapterCatalog:
+    """章节目录的内存索引
+
+    启动时扫描一次templates目录，之后按目录和metadata.json的mtime判断是否需要
+    重新读取，只有发生变化的章节才会重新解析。
+
+    扫描和解析在写入锁内进行，完成后把结果作为不可变快照发布；读取方法只读取
+    当前快照，不获取写入锁，扫描再慢也不会阻塞请求（包括事件循环中的调用）。
+    """
+
+    def __init__(self, templates_dir):
+        self.templates_dir = templates_dir
+        self._lock = threading.RLock()
+        # chapter_id -> 章节记录
+        self._records = {}
+        # 章节搜索的倒排索引，随章节记录增量更新
+        self.search_index = ChapterSearchIndex()
+        # 分面索引: 字段 -> 小写取值 -> 章节ID集合
+        self._facets = {field: {} for field in FACET_FIELDS}
+        # 目录路径 -> 子目录列表对应的mtime
+        self._dir_mtimes = {}
+        # 顶层目录 -> 子目录名称列表
+        self._layout = {}
+        self._top_dirs = []
+        self._last_check = 0.0
+        self._built = False
+        # 读取方使用的快照，写入操作结束后重新发布
+        self._view = _CatalogView({}, {field: {} for field in FACET_FIELDS}, ())
+        self._unpublished = False
+        # 有文件监视器维护索引时，请求路径上不再检查mtime
+        self.watched = False
+
+    def __len__(self):
+        return len(self._view.records)
+
+    @property
+    def built(self):
+        return self._built
+
+    @contextmanager
+    def _writing(self):
+        """写入操作：持有写入锁，结束时发布新的快照"""
+        with self._lock:
+            try:
+                yield
+            finally:
+                self._publish_locked()
+
+    def _publish_locked(self):
+        if not self._unpublished:
+            return
+        records = dict(self._records)
+        facets = {field: {value: frozenset(ids) for value, ids in values.items()}
+                  for field, values in self._facets.items()}
+        sorted_ids = tuple(sorted(records, key=lambda cid: self._order_key(records[cid])))
+        # 替换引用是原子的，读取方拿到的要么是旧快照要么是新快照
+        self._view = _CatalogView(records, facets, sorted_ids)
+        self._unpublished = False
+
+    def ensure_built(self):
+        """首次使用时全量扫描；并发调用时只扫描一次"""
+        if self._built:
+            return
+        with self._writing():
+            if not self._built:
+                self.build()
+
+    def build(self):
+        """全量扫描templates目录"""
+        with self._writing():
+            start = time.time()
+            self._records = {}
+            self.search_index.clear()
+            self._facets = {field: {} for field in FACET_FIELDS}
+            self._dir_mtimes = {}
+            self._layout = {}
+            self._top_dirs = []
+            self._unpublished = True
+            self._refresh_locked()
+            self._built = True
+            print(f"[LearningCenter] 章节索引构建完成，共 {len(self._records)} 个章节，耗时 {(time.time() - start) * 1000:.1f}ms")
+
+    def refresh(self, force=False):
+        """检查目录mtime，重新读取发生变化的章节；返回是否有变化"""
+        with self._writing():
+            if not self._built:
+                self.build()
+                return True
+            if not force and self.watched:
+                return False
+            now = time.monotonic()
+            if not force and now - self._last_check < CATALOG_CHECK_INTERVAL:
+                return False
+            return self._refresh_locked()
+
+    def apply_change(self, path):
+        """根据文件系统事件增量更新索引；返回是否有变化"""
+        with self._writing():
+            if not self._built:
+                self.build()
+                return True
+            rel_path = os.path.relpath(path, self.templates_dir)
+            if rel_path.startswith(os.pardir):
+                return False
+            parts = [] if rel_path == os.curdir else rel_path.split(os.sep)
+            if not parts:
+                # templates目录本身发生变化，重新整理目录列表
+                return self._refresh_locked()
+
+            top_dir = parts[0]
+            top_path = os.path.join(self.templates_dir, top_dir)
+            if len(parts) == 1:
+                if top_dir not in self._top_dirs or not os.path.isdir(top_path):
+                    # 顶层目录的增删，只处理该目录
+                    return self._sync_top_dir(top_dir)
+                if top_dir.startswith("chapter"):
+                    return self._update_record(top_dir, top_path, None, force=True)
+                # 模型目录下新增或删除了工作流目录
+                return self._refresh_model_dir(top_dir)
+            if top_dir.startswith("chapter"):
+                return self._update_record(top_dir, top_path, None, force=True)
+            if len(parts) == 2:
+                # 模型目录下工作流目录的增删
+                return self._refresh_model_dir(top_dir)
+            chapter_id = f"{top_dir}/{parts[1]}"
+            return self._update_record(chapter_id, os.path.join(top_path, parts[1]), top_dir, force=True)
+
+    def reload(self, chapter_id):
+        """重新读取单个章节（例如请求了索引中还没有的新章节）；返回是否有变化"""
+        with self._writing():
+            if not self._built:
+                self.build()
+                return True
+            model_dir, _, workflow_dir = chapter_id.rpartition("/")
+            if model_dir:
+                chapter_dir = os.path.join(self.templates_dir, model_dir, workflow_dir)
+                return self._update_record(chapter_id, chapter_dir, model_dir)
+            if not chapter_id.startswith("chapter"):
+                return False
+            return self._update_record(chapter_id, os.path.join(self.templates_dir, chapter_id), None)
+
+    def _sync_top_dir(self, top_dir):
+        """顶层目录新增或删除后，更新目录列表并只处理该目录下的章节"""
+        # 只列出templates目录本身，不检查其他顶层目录
+        self._listing_changed(self.templates_dir)
+        self._top_dirs = _list_subdirs(self.templates_dir)
+        if top_dir not in self._top_dirs:
+            changed = False
+            for chapter_id, record in list(self._records.items()):
+                if chapter_id == top_dir or record["model_dir"] == top_dir:
+                    self._drop_record(chapter_id)
+                    changed = True
+            self._layout.pop(top_dir, None)
+            self._dir_mtimes.pop(os.path.join(self.templates_dir, top_dir), None)
+            return changed
+        if top_dir.startswith("chapter"):
+            return self._update_record(top_dir, os.path.join(self.templates_dir, top_dir), None, force=True)
+        return self._refresh_model_dir(top_dir)
+
+    def _refresh_model_dir(self, model_dir):
+        model_path = os.path.join(self.templates_dir, model_dir)
+        if model_dir not in self._top_dirs:
+            return self._sync_top_dir(model_dir)
+        self._dir_mtimes.pop(model_path, None)
+        self._listing_changed(model_path)
+        self._layout[model_dir] = _list_subdirs(model_path)
+        workflow_dirs = set(self._layout[model_dir])
+        changed = False
+        for chapter_id, record in list(self._records.items()):
+            if record["model_dir"] == model_dir and chapter_id.split("/", 1)[1] not in workflow_dirs:
+                self._drop_record(chapter_id)
+                changed = True
+        for workflow_dir in workflow_dirs:
+            chapter_id = f"{model_dir}/{workflow_dir}"
+            if self._update_record(chapter_id, os.path.join(model_path, workflow_dir), model_dir):
+                changed = True
+        return changed
+
+    def _listing_changed(self, path):
+        st = _stat_or_none(path)
+        mtime = st.st_mtime_ns if st else None
+        if self._dir_mtimes.get(path) != mtime or path not in self._dir_mtimes:
+            self._dir_mtimes[path] = mtime
+            return True
+        return False
+
+    def _refresh_locked(self):
+        self._last_check = time.monotonic()
+        changed = False
+
+        # 顶层目录列表（旧式章节 + 模型目录）
+        if self._listing_changed(self.templates_dir):
+            self._top_dirs = _list_subdirs(self.templates_dir)
+            changed = True
+
+        seen = set()
+        for top_dir in self._top_dirs:
+            top_path = os.path.join(self.templates_dir, top_dir)
+            if top_dir.startswith("chapter"):
+                # 旧式章节结构: templates/chapter*
+                if self._update_record(top_dir, top_path, None):
+                    changed = True
+                seen.add(top_dir)
+                continue
+
+            # 模型目录结构: templates/model/workflow_type
+            if self._listing_changed(top_path) or top_dir not in self._layout:
+                self._layout[top_dir] = _list_subdirs(top_path)
+                changed = True
+            for workflow_dir in self._layout[top_dir]:
+                chapter_id = f"{top_dir}/{workflow_dir}"
+                if self._update_record(chapter_id, os.path.join(top_path, workflow_dir), top_dir):
+                    changed = True
+                seen.add(chapter_id)
+
+        # 清理已删除的章节和模型目录
+        for chapter_id in [cid for cid in self._records if cid not in seen]:
+            self._drop_record(chapter_id)
+            changed = True
+        for top_dir in [d for d in self._layout if d not in self._top_dirs]:
+            del self._layout[top_dir]
+            self._dir_mtimes.pop(os.path.join(self.templates_dir, top_dir), None)
+
+        return changed
+
+    def _update_record(self, chapter_id, chapter_dir, model_dir, force=False):
+        """按章节目录和metadata.json的mtime判断是否需要重新读取；返回是否有变化"""
+        metadata_path = os.path.join(chapter_dir, "metadata.json")
+        dir_stat = _stat_or_none(chapter_dir)
+        metadata_stat = _stat_or_none(metadata_path)
+
+        if dir_stat is None or metadata_stat is None:
+            # 没有元数据文件的目录不算作章节
+            return self._drop_record(chapter_id)
+
+        # 练习、答案和预览图原地修改不会改变目录mtime，也需要计入签名
+        signature = (dir_stat.st_mtime_ns, metadata_stat.st_mtime_ns, metadata_stat.st_size)
+        for file_name in ("exercise.json", "answer.json", "preview.png"):
+            file_stat = _stat_or_none(os.path.join(chapter_dir, file_name))
+            signature += (file_stat.st_mtime_ns, file_stat.st_size) if file_stat else (None, None)
+        record = self._records.get(chapter_id)
+        if record is not None and record["signature"] == signature and not force:
+            return False
+
+        self._set_record(self._load_record(chapter_id, chapter_dir, model_dir, dir_stat, signature))
+        return True
+
+    def _set_record(self, record):
+        chapter_id = record["id"]
+        if chapter_id in self._records:
+            self._drop_record(chapter_id)
+        metadata = self.chapter_metadata(record, {})
+        record["facets"] = {field: facet_values(metadata.get(field)) for field in FACET_FIELDS}
+        self._records[chapter_id] = record
+        self._unpublished = True
+        self.search_index.update(chapter_id, metadata)
+        for field, values in record["facets"].items():
+            for value in values:
+                self._facets[field].setdefault(value, set()).add(chapter_id)
+        bump_generation()
+
+    def _drop_record(self, chapter_id):
+        record = self._records.pop(chapter_id, None)
+        if record is None:
+            return False
+        self._unpublished = True
+        self.search_index.remove(chapter_id)
+        for field, values in record["facets"].items():
+            for value in values:
+                chapter_ids = self._facets[field].get(value)
+                if chapter_ids is not None:
+                    chapter_ids.discard(chapter_id)
+                    if not chapter_ids:
+                        del self._facets[field][value]
+        bump_generation()
+        return True
+
+    def _load_record(self, chapter_id, chapter_dir, model_dir, dir_stat, signature):
+        metadata = safe_read_json(os.path.join(chapter_dir, "metadata.json"))
+        if not isinstance(metadata, dict):
+            metadata = {}
+        files = _list_files(chapter_dir)
+        return {
+            "id": chapter_id,
+            "dir": chapter_dir,
+            "model_dir": model_dir,
+            "metadata": metadata,
+            # 文件名 -> {"size", "mtime", "mtime_ns"}，按目录中的顺序保存
+            "files": files,
+            "has_exercise": "exercise.json" in files,
+            "has_answer": "answer.json" in files,
+            "has_preview": "preview.png" in files,
+            # 预览图来源在加载时确定一次，为None时使用默认预览图
+            "preview_file": find_preview_file(files),
+            "created_at": dir_stat.st_ctime,
+            "signature": signature,
+        }
+
+    @staticmethod
+    def _order_key(record):
+        # 旧式章节按编号排在前面，模型目录下的章节按ID排序
+        if record["model_dir"] is None:
+            return (0, chapter_sort_key(record["id"]), record["id"])
+        return (1, 0, record["id"])
+
+    def _sort_key(self, record, sort, scores=None):
+        order_key = self._order_key(record)
+        if sort == "created_at":
+            return (record["created_at"],) + order_key
+        if sort == "difficulty":
+            difficulty = record["metadata"].get("difficulty")
+            rank = CHAPTER_DIFFICULTIES.index(difficulty) if difficulty in CHAPTER_DIFFICULTIES else len(CHAPTER_DIFFICULTIES)
+            return (rank,) + order_key
+        if sort == "relevance":
+            return (-(scores or {}).get(record["id"], 0.0),) + order_key
+        return order_key
+
+    def page_ids(self, chapter_ids, sort="order", descending=False, scores=None, limit=None, after=None, offset=0):
+        """对章节排序并分页
+
+        after为上一页最后一个章节的排序键（来自游标），优先于offset。
+        返回 (本页章节ID, 本页最后一个章节的排序键, 是否还有更多)。
+        """
+        records = self._view.records
+        keyed = sorted(
+            (self._sort_key(records[cid], sort, scores), cid)
+            for cid in chapter_ids if cid in records
+        )
+        keys = [key for key, _ in keyed]
+        ids = [cid for _, cid in keyed]
+        if descending:
+            keys.reverse()
+            ids.reverse()
+
+        if after is not None:
+            if descending:
+                start = len(keys) - bisect.bisect_left(keys[::-1], after)
+            else:
+                start = bisect.bisect_right(keys, after)
+        else:
+            start = max(offset, 0)
+
+        end = len(ids) if limit is None else start + limit
+        page = ids[start:end]
+        last_key = keys[start + len(page) - 1] if page else None
+        return page, last_key, end < len(ids)
+
+    def get(self, chapter_id):
+        """获取单个章节记录，不存在时返回None"""
+        return self._view.records.get(chapter_id)
+
+    def search(self, query, with_scores=False):
+        """全文搜索章节，返回按相关度排序的章节ID列表（或 [(章节ID, 得分)]）"""
+        results = self.search_index.search(query)
+        if with_scores:
+            return results
+        return [chapter_id for chapter_id, _ in results]
+
+    def filter_ids(self, filters, chapter_ids=None):
+        """按分面过滤章节，filters为 {字段: 取值}，空值表示不过滤
+
+        返回的章节ID保持chapter_ids（默认为目录顺序）中的顺序。
+        """
+        view = self._view
+        if chapter_ids is None:
+            chapter_ids = view.sorted_ids
+        allowed = self._match_facets(view, filters)
+        if allowed is None:
+            return list(chapter_ids)
+        return [cid for cid in chapter_ids if cid in allowed]
+
+    @staticmethod
+    def _match_facets(view, filters, exclude=None):
+        allowed = None
+        for field, value in filters.items():
+            if field == exclude or field not in view.facets or not value:
+                continue
+            matched = view.facets[field].get(value.strip().lower(), frozenset())
+            allowed = set(matched) if allowed is None else allowed & matched
+        return allowed
+
+    def facet_counts(self, filters, chapter_ids=None):
+        """统计每个分面取值对应的章节数
+
+        统计某个字段时应用其他字段的过滤条件而忽略它自己的，便于侧边栏显示
+        切换到其他取值后的结果数量。chapter_ids用于限定范围（例如搜索结果）。
+        """
+        view = self._view
+        scope = set(view.records) if chapter_ids is None else set(chapter_ids)
+        counts = {}
+        for field in FACET_FIELDS:
+            allowed = self._match_facets(view, filters, exclude=field)
+            candidates = scope if allowed is None else scope & allowed
+            counts[field] = {value: len(ids & candidates)
+                             for value, ids in sorted(view.facets[field].items())
+                             if not ids.isdisjoint(candidates)}
+        return counts
+
+    def list_chapters(self, user_progress=None, chapter_ids=None):
+        """返回章节列表（与原接口相同的字典结构），可以指定章节ID及其顺序"""
+        completed_chapters = (user_progress or {}).get("completed_chapters", {})
+        records = self._view.records
+        if chapter_ids is None:
+            chapter_ids = self._view.sorted_ids
+        return [self.chapter_metadata(records[cid], completed_chapters)
+                for cid in chapter_ids if cid in records]
+
+    @staticmethod
+    def chapter_metadata(record, completed_chapters):
+        """根据章节记录生成对外的元数据字典"""
+        metadata = dict(record["metadata"])
+        metadata.update({
+            "id": record["id"],
+            "has_exercise": record["has_exercise"],
+            "has_answer": record["has_answer"],
+            "has_preview": record["has_preview"],
+            "completed": completed_chapters.get(record["id"], False),
+            "created_at": record["created_at"],
+        })
+        if record["model_dir"] is not None and "model" not in metadata:
+            metadata["model"] = record["model_dir"]
+        return metadata
+
+
+# 进程内唯一的章节索引
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_chapter_catalog(templates_dir=None):
+    """获取全局章节索引，首次调用时构建"""
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            if templates_dir is None:
+                current_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+                templates_dir = os.path.join(current_dir, "templates")
+            _catalog = ChapterCatalog(templates_dir)
+        catalog = _catalog
+    catalog.ensure_built()
+    return catalog
@@ -0,0 +1,145 @@
+import bisect
+import re
+import threading
+
+# 参与搜索的字段及其权重
+SEARCH_FIELDS = {
+    "title": 3.0,
+    "id": 2.0,
+    "model": 2.0,
+    "learning_objectives": 1.0,
+    "description": 1.0,
+}
+
+# 中日韩字符按字切分，其余按字母数字串切分
+_TOKEN_RE = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]+|[0-9a-z]+")
+_CJK_RE = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]")
+
+
+def _field_text(value):
+    if value is None:
+        return ""
+    if isinstance(value, (list, tuple)):
+        return " ".join(_field_text(v) for v in value)
+    return str(value)
+
+
+def tokenize(text, unigrams=True):
+    """把文本切分为搜索词：拉丁字母按单词，中文按二元组（bigram）
+
+    建索引时同时加入中文单字，以便单字查询也能命中。
+    """
+    tokens = []
+    for run in _TOKEN_RE.findall(_field_text(text).lower()):
+        if not _CJK_RE.match(run):
+            tokens.append(run)
+            continue
+        if len(run) == 1 or unigrams:
+            tokens.extend(run)
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def query_terms(query):
+    """把查询切分为搜索词；中文查询只使用bigram，单字查询使用单字"""
+    terms = []
+    for run in _TOKEN_RE.findall(query.lower()):
+        if _CJK_RE.match(run):
+            terms.extend(tokenize(run, unigrams=False))
+        else:
+            terms.append(run)
+    return list(dict.fromkeys(terms))
+
+
+class ChapterSearchIndex:
+    """章节搜索的倒排索引
+
+    词 -> {chapter_id: 权重}，章节变化时只更新对应章节的词条。拉丁字母的词支持
+    前缀匹配，多个词之间为AND关系，结果按权重之和排序。
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._postings = {}
+        # chapter_id -> 该章节的所有词，用于增量删除
+        self._doc_terms = {}
+        self._vocabulary = []
+        self._vocabulary_dirty = False
+
+    def __len__(self):
+        return len(self._doc_terms)
+
+    def update(self, chapter_id, metadata):
+        """添加或更新一个章节"""
+        weights = {}
+        for field, field_weight in SEARCH_FIELDS.items():
+            value = chapter_id if field == "id" else metadata.get(field)
+            for term in tokenize(value):
+                weights[term] = weights.get(term, 0.0) + field_weight
+
+        with self._lock:
+            self._remove_locked(chapter_id)
+            for term, weight in weights.items():
+                postings = self._postings.get(term)
+                if postings is None:
+                    postings = self._postings[term] = {}
+                    self._vocabulary_dirty = True
+                postings[chapter_id] = weight
+            self._doc_terms[chapter_id] = tuple(weights)
+
+    def remove(self, chapter_id):
+        with self._lock:
+            self._remove_locked(chapter_id)
+
+    def clear(self):
+        with self._lock:
+            self._postings = {}
+            self._doc_terms = {}
+            self._vocabulary = []
+            self._vocabulary_dirty = False
+
+    def _remove_locked(self, chapter_id):
+        for term in self._doc_terms.pop(chapter_id, ()):
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            postings.pop(chapter_id, None)
+            if not postings:
+                del self._postings[term]
+                self._vocabulary_dirty = True
+
+    def _expand(self, term, prefix):
+        """返回与查询词匹配的所有索引词"""
+        if not prefix or _CJK_RE.match(term):
+            return [term] if term in self._postings else []
+        if self._vocabulary_dirty:
+            self._vocabulary = sorted(self._postings)
+            self._vocabulary_dirty = False
+        vocabulary = self._vocabulary
+        start = bisect.bisect_left(vocabulary, term)
+        end = bisect.bisect_left(vocabulary, term + "\uffff", start)
+        return vocabulary[start:end]
+
+    def search(self, query, prefix=True):
+        """搜索章节，返回按相关度排序的 [(chapter_id, score)]"""
+        terms = query_terms(query)
+        if not terms:
+            return []
+
+        with self._lock:
+            scores = None
+            for term in terms:
+                term_scores = {}
+                for match in self._expand(term, prefix):
+                    # 完整匹配的词比前缀匹配得分更高
+                    boost = 1.0 if match == term else 0.5
+                    for chapter_id, weight in self._postings[match].items():
+                        term_scores[chapter_id] = max(term_scores.get(chapter_id, 0.0), weight * boost)
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {cid: score + term_scores[cid] for cid, score in scores.items() if cid in term_scores}
+                if not scores:
+                    return []
+
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
@@ -0,0 +1,164 @@
+import os
+import threading
+from collections import OrderedDict
+
+from .chapter_catalog import get_chapter_catalog
+
+# 工作流文本缓存的容量上限
+WORKFLOW_CACHE_MAX_BYTES = int(float(os.environ.get("LEARNINGCENTER_WORKFLOW_CACHE_MB", "64")) * 1024 * 1024)
+
+
+# 安全读取文本文件，先尝试utf-8-sig（兼容BOM），失败后尝试gbk
+def safe_read_text(file_path):
+    try:
+        with open(file_path, "r", encoding="utf-8-sig") as f:
+            return f.read()
+    except Exception as e:
+        print(f"[LearningCenter] 读取文件出错 {file_path}: {e}")
+        try:
+            with open(file_path, "r", encoding="gbk") as f:
+                return f.read()
+        except Exception as e2:
+            print(f"[LearningCenter] 第二次尝试读取文件也失败 {file_path}: {e2}")
+            return None
+
+
+def image_content_type(file_name):
+    """根据扩展名返回图片的Content-Type"""
+    ext = os.path.splitext(file_name.lower())[1]
+    return "image/jpeg" if ext in (".jpg", ".jpeg") else f"image/{ext[1:]}"
+
+
+def parse_chapter_id(chapter_id):
+    """解析章节ID，返回 (模型目录, 工作流目录)，旧式章节的模型目录为None
+
+    ID格式错误时抛出ValueError。
+    """
+    parts = chapter_id.split("/")
+    if len(parts) > 2 or any(part in ("", ".", "..") or "\\" in part for part in parts):
+        raise ValueError("Invalid chapter ID format")
+    if len(parts) == 2:
+        return parts[0], parts[1]
+    return None, parts[0]
+
+
+class ChapterStore:
+    """章节ID到章节记录的统一解析层
+
+    路由和节点都通过它获取章节的路径、元数据、文件信息和工作流内容。记录来自
+    内存中的章节索引，工作流文本按文件签名缓存，热路径上不访问磁盘。
+    """
+
+    def __init__(self, catalog, workflow_cache_bytes=WORKFLOW_CACHE_MAX_BYTES):
+        self.catalog = catalog
+        self._workflow_cache = OrderedDict()
+        self._workflow_cache_bytes = workflow_cache_bytes
+        self._workflow_cache_size = 0
+        self._lock = threading.Lock()
+
+    def resolve(self, chapter_id, reload_on_miss=True):
+        """返回章节记录，不存在时返回None；ID格式错误时抛出ValueError
+
+        索引中没有的章节（例如刚拷贝进来还没被检测到）会单独检查一次磁盘。
+        """
+        parse_chapter_id(chapter_id)
+        record = self.catalog.get(chapter_id)
+        if record is None and reload_on_miss:
+            self.catalog.reload(chapter_id)
+            record = self.catalog.get(chapter_id)
+        return record
+
+    def read_workflow(self, record, file_name):
+        """读取章节中的工作流文本（exercise.json/answer.json），结果按文件大小和mtime缓存"""
+        info = record["files"].get(file_name)
+        if info is None:
+            return None
+        key = (record["id"], file_name)
+        signature = (info["size"], info["mtime"])
+        with self._lock:
+            cached = self._workflow_cache.get(key)
+            if cached is not None and cached[0] == signature:
+                self._workflow_cache.move_to_end(key)
+                return cached[1]
+
+        text = safe_read_text(os.path.join(record["dir"], file_name))
+        if text is None:
+            return None
+        with self._lock:
+            old = self._workflow_cache.pop(key, None)
+            if old is not None:
+                self._workflow_cache_size -= len(old[1])
+            if len(text) <= self._workflow_cache_bytes:
+                self._workflow_cache[key] = (signature, text)
+                self._workflow_cache_size += len(text)
+                while self._workflow_cache_size > self._workflow_cache_bytes:
+                    _, (_, evicted) = self._workflow_cache.popitem(last=False)
+                    self._workflow_cache_size -= len(evicted)
+        return text
+
+    def forget(self, chapter_id):
+        """删除章节后清理缓存的工作流文本"""
+        with self._lock:
+            for key in [k for k in self._workflow_cache if k[0] == chapter_id]:
+                self._workflow_cache_size -= len(self._workflow_cache.pop(key)[1])
+
+    def chapter_metadata(self, record, user_progress):
+        """生成对外的章节元数据（包含完成状态）"""
+        return self.catalog.chapter_metadata(record, (user_progress or {}).get("completed_chapters", {}))
+
+    def is_completed(self, record, user_progress):
+        return bool((user_progress or {}).get("completed_chapters", {}).get(record["id"], False))
+
+    def chapter_details(self, record, user_progress, show_answer=False):
+        """生成章节详情：元数据、练习工作流和答案工作流
+
+        答案工作流只有在章节已完成或请求预览时才提供；元数据为空时返回None。
+        """
+        if not record["metadata"]:
+            return None
+        metadata = self.chapter_metadata(record, user_progress)
+        exercise_workflow = self.read_workflow(record, "exercise.json")
+        answer_workflow = None
+        if show_answer or metadata["completed"]:
+            answer_workflow = self.read_workflow(record, "answer.json")
+        metadata["has_exercise"] = exercise_workflow is not None
+        return {
+            "metadata": metadata,
+            "exercise_workflow": exercise_workflow,
+            "answer_workflow": answer_workflow
+        }
+
+    def preview_file(self, record):
+        """返回章节预览图的描述，没有预览图时返回None
+
+        预览图来源在章节索引加载时已经确定（preview.png、其他格式的 preview.*、
+        目录中的任意图片）。返回的字典包含路径、Content-Type、大小、mtime和ETag，
+        全部来自章节记录，不访问磁盘。
+        """
+        file_name = record["preview_file"]
+        if file_name is None:
+            return None
+        info = record["files"][file_name]
+        return {
+            "path": os.path.join(record["dir"], file_name),
+            "content_type": image_content_type(file_name),
+            "size": info["size"],
+            "mtime": info["mtime"],
+            "mtime_ns": info["mtime_ns"],
+            # 与aiohttp FileResponse生成的ETag格式一致
+            "etag": f'"{info["mtime_ns"]:x}-{info["size"]:x}"',
+        }
+
+
+# 进程内唯一的章节解析层
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_chapter_store():
+    """获取全局章节解析层"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ChapterStore(get_chapter_catalog())
+        return _store
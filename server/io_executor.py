@@ -0,0 +1,102 @@
+import asyncio
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# 学习中心文件I/O线程池的大小
+IO_MAX_WORKERS = int(os.environ.get("LEARNINGCENTER_IO_WORKERS", "4"))
+# 单个任务超过该耗时（秒）时打印警告
+IO_SLOW_THRESHOLD = float(os.environ.get("LEARNINGCENTER_IO_SLOW_SECONDS", "1"))
+
+
+class IOExecutor:
+    """学习中心专用的有界I/O线程池
+
+    路由处理函数通过它执行所有阻塞的文件操作，避免慢磁盘阻塞PromptServer的
+    事件循环；同时统计排队深度和耗时。
+    """
+
+    def __init__(self, max_workers=IO_MAX_WORKERS, name="LearningCenterIO"):
+        self.max_workers = max(1, max_workers)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.running = 0
+        self.max_queue_depth = 0
+        self.total_wait = 0.0
+        self.total_run = 0.0
+        self.max_run = 0.0
+
+    @property
+    def queue_depth(self):
+        """已提交但还没有开始执行的任务数"""
+        return self.submitted - self.completed - self.failed - self.running
+
+    def _call(self, func, submitted_at, args, kwargs):
+        started = time.perf_counter()
+        with self._lock:
+            self.running += 1
+            self.total_wait += started - submitted_at
+        ok = False
+        try:
+            result = func(*args, **kwargs)
+            ok = True
+            return result
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.running -= 1
+                if ok:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+                self.total_run += elapsed
+                self.max_run = max(self.max_run, elapsed)
+            if elapsed > IO_SLOW_THRESHOLD:
+                name = getattr(func, "__qualname__", repr(func))
+                print(f"[LearningCenter] 警告: I/O任务 {name} 耗时 {elapsed:.2f}s")
+
+    async def run(self, func, *args, **kwargs):
+        """在I/O线程池中执行func并等待结果"""
+        with self._lock:
+            self.submitted += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        loop = asyncio.get_running_loop()
+        call = functools.partial(self._call, func, time.perf_counter(), args, kwargs)
+        return await loop.run_in_executor(self._executor, call)
+
+    def submit(self, func, *args, **kwargs):
+        """从非异步代码提交任务，返回concurrent.futures.Future"""
+        with self._lock:
+            self.submitted += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        return self._executor.submit(self._call, func, time.perf_counter(), args, kwargs)
+
+    def stats(self):
+        with self._lock:
+            finished = self.completed + self.failed
+            return {
+                "workers": self.max_workers,
+                "running": self.running,
+                "queue_depth": self.queue_depth,
+                "max_queue_depth": self.max_queue_depth,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "avg_wait_ms": round(self.total_wait / finished * 1000, 3) if finished else 0.0,
+                "avg_run_ms": round(self.total_run / finished * 1000, 3) if finished else 0.0,
+                "max_run_ms": round(self.max_run * 1000, 3),
+            }
+
+
+# 学习中心共用的I/O线程池
+io_executor = IOExecutor()
+
+
+async def run_io(func, *args, **kwargs):
+    """在学习中心I/O线程池中执行阻塞的文件操作"""
+    return await io_executor.run(func, *args, **kwargs)
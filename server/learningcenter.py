@@ -1,12 +1,30 @@
 from server import PromptServer
 from aiohttp import web
-import json
+import atexit
 import os
 import shutil
-import time
 import uuid
+from email.utils import formatdate
 from pathlib import Path
 
+from .chapter_catalog import (
+    SORT_KEYS,
+    bump_generation,
+    decode_cursor,
+    encode_cursor,
+    get_chapter_catalog,
+    get_generation,
+    project_fields,
+)
+from .chapter_store import get_chapter_store
+from .catalog_watcher import start_catalog_watcher
+from .warmup import start_warmup
+from .response_cache import cache_key, response_cache
+from .io_executor import io_executor, run_io
+from .progress_store import create_progress_store
+from .user_progress import DEFAULT_NAMESPACE, UserProgressRegistry, normalize_namespace, request_namespace
+from .preview_cache import SPRITE_MAX_TILES, negotiate_format, parse_thumbnail_width, placeholder_cache, preview_cache
+
 # 确保目录存在
 def ensure_directory(directory):
     """确保目录存在"""
@@ -16,42 +34,160 @@ def ensure_directory(directory):
     return directory
 
 # 获取模板目录路径
+_template_directories = None
+
 def get_template_directories():
-    """获取模板和用户进度目录"""
-    current_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    templates_dir = ensure_directory(os.path.join(current_dir, "templates"))
-    user_progress_dir = ensure_directory(os.path.join(current_dir, "user_progress"))
-    return templates_dir, user_progress_dir
+    """获取模板和用户进度目录（首次调用时创建，之后不再访问磁盘）"""
+    global _template_directories
+    if _template_directories is None:
+        current_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        templates_dir = ensure_directory(os.path.join(current_dir, "templates"))
+        user_progress_dir = ensure_directory(os.path.join(current_dir, "user_progress"))
+        _template_directories = (templates_dir, user_progress_dir)
+    return _template_directories
+
+# 按用户划分的进度（每个用户首次访问时加载，之后在内存中读写）
+_user_registry = None
+
+def get_user_registry():
+    global _user_registry
+    if _user_registry is None:
+        _, user_progress_dir = get_template_directories()
+        _user_registry = UserProgressRegistry(lambda namespace: create_progress_store(user_progress_dir, namespace=namespace))
+        # 退出时写入尚未保存的进度
+        atexit.register(flush_user_progress)
+    return _user_registry
+
+# 立即写入所有用户尚未保存的进度，返回写入的用户数
+def flush_user_progress():
+    if _user_registry is None:
+        return 0
+    return _user_registry.flush()
 
-# 获取用户进度文件路径
-def get_user_progress_file():
-    _, user_progress_dir = get_template_directories()
-    return os.path.join(user_progress_dir, "progress.json")
+# 获取某个用户的进度，namespace为空时为默认用户
+def get_user_progress(namespace=DEFAULT_NAMESPACE):
+    return get_user_registry().get(namespace)
+
+# 默认用户的进度存储
+def get_progress_store():
+    return get_user_progress().store
 
 # 读取用户进度
-def load_user_progress():
-    progress_file = get_user_progress_file()
-    if os.path.exists(progress_file):
-        try:
-            with open(progress_file, "r", encoding="utf-8-sig") as f:
-                return json.load(f)
-        except Exception as e:
-            print(f"[LearningCenter] 读取用户进度出错: {e}")
+def load_user_progress(namespace=DEFAULT_NAMESPACE):
+    try:
+        return get_user_progress(namespace).progress()
+    except Exception as e:
+        print(f"[LearningCenter] 读取用户进度出错: {e}")
     
-    # 如果文件不存在或读取错误，返回空进度
+    # 如果读取错误，返回空进度
     return {"completed_chapters": {}}
 
-# 保存用户进度
-def save_user_progress(progress):
-    progress_file = get_user_progress_file()
+# 在请求处理中读取用户进度：已在内存中时直接返回，首次访问时在I/O线程池中加载
+async def load_request_progress(namespace):
+    user = get_user_registry().peek(namespace)
+    if user is not None and user.loaded:
+        return user.progress()
+    return await run_io(load_user_progress, namespace)
+
+# 记录一条进度变化（只追加日志，不重写整个进度文件）
+def record_progress_event(event, namespace=DEFAULT_NAMESPACE):
     try:
-        with open(progress_file, "w", encoding="utf-8-sig") as f:
-            json.dump(progress, f, ensure_ascii=False, indent=2)
+        get_user_progress(namespace).apply(event)
+        bump_generation()
         return True
     except Exception as e:
         print(f"[LearningCenter] 保存用户进度出错: {e}")
         return False
 
+# 刷新章节索引（在I/O线程池中调用），模板目录不存在时返回None
+def refresh_chapter_catalog(templates_dir=None):
+    if templates_dir is not None and not os.path.exists(templates_dir):
+        return None
+    catalog = get_chapter_catalog(templates_dir)
+    catalog.refresh()
+    return catalog
+
+# 把章节标记为已完成并保存进度（在I/O线程池中调用）
+def save_chapter_completed(record, namespace=DEFAULT_NAMESPACE):
+    chapter_id = record["id"]
+    
+    # 即使没有答案文件，也允许将章节标记为已完成
+    if not record["has_answer"]:
+        print(f"[LearningCenter] 章节没有答案文件 {chapter_id}，但仍允许标记为已完成")
+    
+    # 更新完成状态
+    return record_progress_event({"op": "complete", "chapter_id": chapter_id}, namespace)
+
+# 批量完成时单次请求的章节数上限
+MAX_BULK_CHAPTERS = 1000
+
+# 批量把章节标记为已完成（在I/O线程池中调用），所有章节在一次原子操作中写入
+# strict为True时，只要有章节不存在就不做任何修改
+def complete_chapters_bulk(chapter_ids, namespace=DEFAULT_NAMESPACE, strict=False):
+    store = get_chapter_store()
+    found, missing = [], []
+    for chapter_id in dict.fromkeys(chapter_ids):
+        # ID格式错误时抛出ValueError，由调用方返回400
+        record = store.resolve(chapter_id)
+        (found if record is not None else missing).append(chapter_id)
+    result = {"completed": [], "already_completed": [], "missing": missing}
+    if strict and missing:
+        return result
+    
+    user = get_user_progress(namespace)
+    # 判断已完成的章节和写入在同一把锁内，不会与其他请求交错
+    with user.lock:
+        completed = user.progress().get("completed_chapters", {})
+        for chapter_id in found:
+            (result["already_completed"] if completed.get(chapter_id) else result["completed"]).append(chapter_id)
+        if result["completed"]:
+            user.apply({"op": "complete_many", "chapter_ids": result["completed"]})
+    if result["completed"]:
+        bump_generation()
+    return result
+
+# 删除章节目录并更新索引和进度（在I/O线程池中调用）
+def delete_chapter_files(record):
+    chapter_id = record["id"]
+    # 删除章节目录及其所有内容
+    shutil.rmtree(record["dir"])
+    store = get_chapter_store()
+    store.catalog.reload(chapter_id)
+    store.forget(chapter_id)
+    
+    # 从所有用户的进度中移除该章节
+    try:
+        get_user_registry().forget_chapter(chapter_id)
+    except Exception as e:
+        print(f"[LearningCenter] 保存用户进度出错: {e}")
+        return False
+    bump_generation()
+    return True
+
+# 进程启动标识，避免重启后版本号重复导致ETag冲突
+_ETAG_PREFIX = uuid.uuid4().hex[:8]
+
+# 基于目录版本号的强ETag，模板或用户进度变化时失效；不同用户的完成状态不同，ETag也不同
+def get_catalog_etag(generation=None, namespace=DEFAULT_NAMESPACE):
+    if generation is None:
+        generation = get_generation()
+    if namespace:
+        return f'"{_ETAG_PREFIX}-{generation}-{namespace}"'
+    return f'"{_ETAG_PREFIX}-{generation}"'
+
+# 检查If-None-Match是否与当前ETag匹配
+def etag_matches(request, etag):
+    header = request.headers.get("If-None-Match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in header.split(","))
+
+# 内容未变化时返回的304响应
+def not_modified_response(etag):
+    return web.Response(status=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
 # 插件初始化时打印信息
 def init_LearningCenter():
     """初始化学习中心插件"""
@@ -59,38 +195,38 @@ def init_LearningCenter():
     print(f"[LearningCenter] 模板目录: {templates_dir}")
     print(f"[LearningCenter] 用户进度目录: {user_progress_dir}")
     
-    # 确保用户进度文件存在
-    progress_file = get_user_progress_file()
-    if not os.path.exists(progress_file):
-        # 创建空的进度文件
-        save_user_progress({"completed_chapters": {}, "favorites": []})
-        print(f"[LearningCenter] 创建空的用户进度文件: {progress_file}")
-    else:
-        # 验证进度文件格式
-        try:
-            progress = load_user_progress()
-            if not isinstance(progress, dict):
-                print(f"[LearningCenter] 警告: 用户进度文件格式不正确，重置为空")
-                save_user_progress({"completed_chapters": {}, "favorites": []})
-        except Exception as e:
-            print(f"[LearningCenter] 警告: 读取用户进度出错，重置为空: {e}")
-            save_user_progress({"completed_chapters": {}, "favorites": []})
+    # 初始化默认用户的进度：创建进度文件或合并上次运行留下的日志；sqlite后端首次启动时导入JSON进度
+    # 损坏的进度文件会被改名备份，不会被直接覆盖；其他用户在首次访问时加载
+    try:
+        store = get_progress_store()
+        bump_generation()
+        print(f"[LearningCenter] 用户进度存储: {store.backend}")
+    except Exception as e:
+        print(f"[LearningCenter] 初始化用户进度存储出错: {e}")
+    
+    # 构建章节索引（只在首次初始化时扫描一次），之后的章节列表请求直接从内存读取
+    catalog = get_chapter_catalog(templates_dir)
+    
+    # 可选：后台监视模板目录，增量更新章节索引
+    start_catalog_watcher(catalog)
+    
+    # 可选：预先生成缩略图、转码图片和默认预览图
+    start_warmup(get_chapter_store())
     
     return True
 
 # 初始化插件
 init_LearningCenter()
 
-# 教程难度分类
-CHAPTER_DIFFICULTIES = ["beginner", "intermediate", "advanced"]
+# 章节列表分页大小
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
 
 # API路由：获取所有章节
 @PromptServer.instance.routes.get("/api/learningcenter/chapters")
 async def get_chapters(request):
     try:
         templates_dir, _ = get_template_directories()
-        chapters = []
-        user_progress = load_user_progress()
         
         # 获取查询参数
         query_params = request.query
@@ -99,346 +235,280 @@ async def get_chapters(request):
         purpose_filter = query_params.get("purpose")
         model_filter = query_params.get("model")
         
-        print(f"[LearningCenter] 正在查询章节，过滤条件 search={search_term}, difficulty={difficulty_filter}, purpose={purpose_filter}, model={model_filter}")
-        print(f"[LearningCenter] 原始查询参数: {dict(query_params)}")
+        include_facets = query_params.get("facets", "").lower() in ("1", "true", "yes")
         
-        # 检查templates目录是否存在
-        if not os.path.exists(templates_dir):
-            print(f"[LearningCenter] 教程目录不存在 {templates_dir}")
-            return web.json_response([])
-                
-        print(f"[LearningCenter] 正在扫描目录: {templates_dir}")
+        # 排序方式，"-"前缀表示降序；搜索时默认按相关度排序
+        sort_param = query_params.get("sort", "").strip()
+        descending = sort_param.startswith("-")
+        sort = sort_param.lstrip("-") or ("relevance" if search_term else "order")
+        if sort not in SORT_KEYS:
+            return web.json_response({"error": f"Invalid sort: {sort_param}"}, status=400)
+        if sort == "relevance" and not search_term:
+            sort = "order"
         
-        # 遍历templates目录下的所有文件夹
-        model_dirs = [d for d in os.listdir(templates_dir) 
-                     if os.path.isdir(os.path.join(templates_dir, d))]
+        # 字段投影，例如 fields=id,title,difficulty,has_preview,completed
+        fields = [f.strip() for f in query_params.get("fields", "").split(",") if f.strip()]
         
-        # 临时存储所有章节的列表，用于计算过滤前后的数量
-        all_chapters = []
+        # 分页参数：limit + cursor（推荐）或 limit + page
+        paginated = any(k in query_params for k in ("limit", "cursor", "page"))
+        try:
+            limit = int(query_params.get("limit", DEFAULT_PAGE_SIZE)) if paginated else None
+            page = int(query_params.get("page", 1))
+            after = None
+            cursor = query_params.get("cursor")
+            if cursor:
+                cursor_sort, after = decode_cursor(cursor)
+                if cursor_sort != ("-" if descending else "") + sort:
+                    raise ValueError("Cursor does not match sort")
+        except ValueError as e:
+            return web.json_response({"error": str(e)}, status=400)
+        if limit is not None:
+            limit = min(max(limit, 1), MAX_PAGE_SIZE)
+        
+        # 从内存索引中获取章节，只有发生变化的章节才会重新读取
+        catalog = await run_io(refresh_chapter_catalog, templates_dir)
         
-        # 简单安全的读取JSON文件的辅助函数
-        def safe_read_json(file_path):
-            try:
-                # 尝试以utf-8-sig方式读取，可以处理含BOM的文件
-                with open(file_path, "r", encoding="utf-8-sig") as f:
-                    return json.load(f)
-            except Exception as e:
-                print(f"[LearningCenter] 读取文件出错 {file_path}: {e}")
-                # 尝试不同的编码方式
-                try:
-                    with open(file_path, "r", encoding="gbk") as f:
-                        return json.load(f)
-                except Exception as e2:
-                    print(f"[LearningCenter] 第二次尝试读取文件也失败 {file_path}: {e2}")
-                    return {}
+        # 检查templates目录是否存在
+        if catalog is None:
+            print(f"[LearningCenter] 教程目录不存在 {templates_dir}")
+            return web.json_response([])
         
-        # 扫描两种目录结构:
-        # 1. 传统的章节结构: templates/chapter*/*
-        # 2. 新的模型结构: templates/model/workflow_type/*
+        # 模板和用户进度都没有变化时直接返回304
+        namespace = request_namespace(request)
+        generation = get_generation()
+        etag = get_catalog_etag(generation, namespace)
+        if etag_matches(request, etag):
+            return not_modified_response(etag)
+        etag_headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        
+        # 相同用户的相同查询在同一版本下直接返回已序列化（已压缩）的响应
+        key = cache_key("chapters", request, generation, namespace)
+        entry = response_cache.get(key)
+        if entry is not None:
+            return await response_cache.respond(request, entry, etag_headers)
+        
+        user_progress = await load_request_progress(namespace)
+        
+        # 搜索词通过倒排索引匹配
+        scores = None
+        candidate_ids = None
+        if search_term:
+            scores = dict(catalog.search(search_term, with_scores=True))
+            candidate_ids = list(scores)
+        
+        # 难度、用途、模型过滤通过预先计算的分面索引求交集
+        facet_filters = {
+            "difficulty": difficulty_filter,
+            "purpose": purpose_filter,
+            "model": model_filter
+        }
+        chapter_ids = catalog.filter_ids(facet_filters, candidate_ids)
+        total = len(chapter_ids)
         
-        # 扫描旧式章节目录结构
-        chapter_dirs = [d for d in model_dirs if d.startswith("chapter")]
-        chapter_dirs.sort(key=lambda x: int(x.replace("chapter", "").split("_")[0]) if x.replace("chapter", "").split("_")[0].isdigit() else 999)
+        # 排序并分页，只为当前页生成章节数据
+        offset = (max(page, 1) - 1) * limit if limit and after is None else 0
+        page_ids, last_key, has_more = catalog.page_ids(
+            chapter_ids, sort, descending, scores, limit=limit, after=after, offset=offset
+        )
+        chapters = project_fields(catalog.list_chapters(user_progress, page_ids), fields)
         
-        for chapter_dir in chapter_dirs:
-            chapter_path = os.path.join(templates_dir, chapter_dir)
-            
-            # 检查是否有metadata.json文件
-            metadata_path = os.path.join(chapter_path, "metadata.json")
-            if not os.path.exists(metadata_path):
-                print(f"[LearningCenter] 章节目录中没有元数据文件，跳过 {chapter_path}")
-                continue
-            
-            # 读取章节元数据
-            metadata = safe_read_json(metadata_path)
-            
-            # 章节ID就是目录名
-            chapter_id = chapter_dir
-            
-            # 检查练习和答案工作流是否存在
-            exercise_path = os.path.join(chapter_path, "exercise.json")
-            answer_path = os.path.join(chapter_path, "answer.json")
-            
-            has_exercise = os.path.exists(exercise_path)
-            has_answer = os.path.exists(answer_path)
-            
-            # 检查是否有预览图
-            preview_path = os.path.join(chapter_path, "preview.png")
-            has_preview = os.path.exists(preview_path)
-            
-            # 获取用户完成状态
-            is_completed = user_progress.get("completed_chapters", {}).get(chapter_id, False)
-            
-            # 补充元数据
-            metadata.update({
-                "id": chapter_id,
-                "has_exercise": has_exercise,
-                "has_answer": has_answer,
-                "has_preview": has_preview,
-                "completed": is_completed,
-                "created_at": os.path.getctime(chapter_path)
-            })
-            
-            # 添加到临时列表
-            all_chapters.append(metadata)
+        print(f"[LearningCenter] 查询章节 search={search_term}, difficulty={difficulty_filter}, purpose={purpose_filter}, model={model_filter}，结果 {total} 个，返回 {len(chapters)} 个")
         
-        # 扫描新的模型目录结构
-        for model_dir in model_dirs:
-            if model_dir.startswith("chapter"):
-                continue  # 已经处理过的旧式目录结构，跳过
-                
-            model_path = os.path.join(templates_dir, model_dir)
-            # 检查是否为目录
-            if not os.path.isdir(model_path):
-                continue
-                
-            print(f"[LearningCenter] 扫描模型目录: {model_dir}")
-            
-            # 检查模型目录中的元数据文件
-            model_metadata_path = os.path.join(model_path, "metadata.json")
-            model_metadata = safe_read_json(model_metadata_path)
-            
-            # 遍历模型下的所有工作流类型目录
-            workflow_dirs = [d for d in os.listdir(model_path) 
-                           if os.path.isdir(os.path.join(model_path, d))]
-            
-            for workflow_dir in workflow_dirs:
-                workflow_path = os.path.join(model_path, workflow_dir)
-                print(f"[LearningCenter] 扫描工作流目录: {workflow_dir}")
-                
-                # 检查工作流类型目录中的元数据文件
-                workflow_metadata_path = os.path.join(workflow_path, "metadata.json")
-                if not os.path.exists(workflow_metadata_path):
-                    print(f"[LearningCenter] 工作流目录中没有元数据文件，跳过 {workflow_path}")
-                    continue
-                
-                # 读取工作流元数据
-                workflow_metadata = safe_read_json(workflow_metadata_path)
-                
-                # 构建章节ID
-                chapter_id = f"{model_dir}/{workflow_dir}"
-                
-                # 检查练习和答案工作流是否存在
-                exercise_path = os.path.join(workflow_path, "exercise.json")
-                answer_path = os.path.join(workflow_path, "answer.json")
-                
-                has_exercise = os.path.exists(exercise_path)
-                has_answer = os.path.exists(answer_path)
-                
-                # 检查是否有预览图
-                preview_path = os.path.join(workflow_path, "preview.png")
-                has_preview = os.path.exists(preview_path)
-                
-                # 获取用户完成状态
-                is_completed = user_progress.get("completed_chapters", {}).get(chapter_id, False)
-                
-                # 补充元数据
-                combined_metadata = workflow_metadata.copy()
-                combined_metadata.update({
-                    "id": chapter_id,
-                    "has_exercise": has_exercise,
-                    "has_answer": has_answer,
-                    "has_preview": has_preview,
-                    "completed": is_completed,
-                    "created_at": os.path.getctime(workflow_path),
-                    "model": model_dir if "model" not in combined_metadata else combined_metadata["model"]
-                })
-                
-                # 添加到临时列表
-                all_chapters.append(combined_metadata)
-                print(f"[LearningCenter] 添加章节: {chapter_id}")
-            
-        # 简化过滤逻辑，确保过滤器正确工作
-        # 在应用过滤器前打印总章节数
-        print(f"[LearningCenter] 过滤前总章节数: {len(all_chapters)}")
-            
-        # 应用过滤器
-        filtered_chapters = []
-        for metadata in all_chapters:
-            should_include = True  # 假设初始条件为包含此章节
-            
-            # 搜索词过滤
-            if search_term:
-                if not (
-                    search_term in metadata.get("title", "").lower() or
-                    search_term in metadata.get("description", "").lower() or
-                    search_term in metadata.get("id", "").lower()
-                ):
-                    print(f"[LearningCenter] 章节 {metadata.get('id')} 因搜索词不匹配而被过滤掉")
-                    should_include = False
-            
-            # 难度过滤
-            if difficulty_filter and should_include:
-                chapter_difficulty = metadata.get("difficulty", "").lower()
-                if chapter_difficulty != difficulty_filter.lower():
-                    print(f"[LearningCenter] 章节 {metadata.get('id')} 因难度不匹配而被过滤掉：章节难度={chapter_difficulty}, 过滤条件={difficulty_filter.lower()}")
-                    should_include = False
-                
-            # 用途过滤
-            if purpose_filter and purpose_filter.lower() != "" and should_include:
-                chapter_purpose = metadata.get("purpose", "").lower()
-                print(f"[LearningCenter] 比较用途 章节用途{chapter_purpose}, 过滤条件={purpose_filter.lower()}")
-                if chapter_purpose != purpose_filter.lower():
-                    print(f"[LearningCenter] 章节 {metadata.get('id')} 因用途不匹配而被过滤掉：章节用途{chapter_purpose}, 过滤条件={purpose_filter.lower()}")
-                    should_include = False
-                else:
-                    print(f"[LearningCenter] 章节 {metadata.get('id')} 通过用途过滤")
-                
-            # 模型过滤
-            if model_filter and model_filter.lower() != "" and should_include:
-                chapter_model = metadata.get("model", "").lower()
-                print(f"[LearningCenter] 比较模型: 章节模型={chapter_model}, 过滤条件={model_filter.lower()}")
-                if chapter_model != model_filter.lower():
-                    print(f"[LearningCenter] 章节 {metadata.get('id')} 因模型不匹配而被过滤掉：章节模型={chapter_model}, 过滤条件={model_filter.lower()}")
-                    should_include = False
-                else:
-                    print(f"[LearningCenter] 章节 {metadata.get('id')} 通过模型过滤")
-            
-            # 如果通过所有过滤条件，添加到结果列表
-            if should_include:
-                print(f"[LearningCenter] 章节 {metadata.get('id')} 通过了所有过滤条件")
-                filtered_chapters.append(metadata)
-            
-        # 在应用过滤器后打印章节数
-        print(f"[LearningCenter] 过滤后章节数: {len(filtered_chapters)}")
+        if not paginated and not include_facets:
+            entry = await run_io(response_cache.put, key, generation, chapters)
+            return await response_cache.respond(request, entry, etag_headers)
         
-        # 返回过滤后的章节
-        return web.json_response(filtered_chapters)
+        result = {"templates": chapters}
+        if paginated:
+            result["pagination"] = {
+                "total": total,
+                "limit": limit,
+                "has_more": has_more,
+                "next_cursor": encode_cursor(("-" if descending else "") + sort, last_key) if has_more else None
+            }
+        # 需要时返回各分面取值的章节数，供侧边栏显示
+        if include_facets:
+            result["facets"] = catalog.facet_counts(facet_filters, candidate_ids)
+        entry = await run_io(response_cache.put, key, generation, result)
+        return await response_cache.respond(request, entry, etag_headers)
     except Exception as e:
         print(f"[LearningCenter] 获取章节列表错误: {e}")
         import traceback
         traceback.print_exc()
         return web.json_response({"error": str(e)}, status=500)
 
+# 解析请求中的章节ID；索引中没有时在I/O线程池中检查一次磁盘
+# 章节不存在时返回None，ID格式错误时抛出ValueError
+async def resolve_chapter(chapter_id):
+    store = get_chapter_store()
+    record = store.resolve(chapter_id, reload_on_miss=False)
+    if record is None:
+        record = await run_io(store.resolve, chapter_id)
+    return record
+
+# 章节详情（两种路由共用）
+async def chapter_details_response(request, chapter_id):
+    try:
+        await run_io(refresh_chapter_catalog)
+        record = await resolve_chapter(chapter_id)
+    except ValueError:
+        print(f"[LearningCenter] 章节ID格式错误: {chapter_id}, 应为'model/workflow'格式")
+        return web.json_response({"error": "Invalid chapter ID format"}, status=400)
+    if record is None:
+        print(f"[LearningCenter] 未找到章节 {chapter_id}")
+        return web.json_response({"error": "Chapter not found"}, status=404)
+    
+    # 模板和用户进度都没有变化时直接返回304
+    namespace = request_namespace(request)
+    generation = get_generation()
+    etag = get_catalog_etag(generation, namespace)
+    if etag_matches(request, etag):
+        return not_modified_response(etag)
+    etag_headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    
+    # 相同用户的相同章节在同一版本下直接返回已序列化（已压缩）的响应
+    key = cache_key("chapter_details", request, generation, chapter_id, namespace)
+    entry = response_cache.get(key)
+    if entry is not None:
+        return await response_cache.respond(request, entry, etag_headers)
+    
+    # 答案工作流只有已完成的章节或请求预览（preview_answer=true）时才提供
+    show_answer = request.query.get("preview_answer") == "true"
+    user_progress = await load_request_progress(namespace)
+    response = await run_io(get_chapter_store().chapter_details, record, user_progress, show_answer)
+    if response is None:
+        print(f"[LearningCenter] 元数据读取失败或为空: {chapter_id}")
+        return web.json_response({"error": "Failed to read chapter metadata"}, status=500)
+    
+    entry = await run_io(response_cache.put, key, generation, response)
+    return await response_cache.respond(request, entry, etag_headers)
+
+# 根据If-None-Match/If-Modified-Since判断预览图是否未变化
+def preview_not_modified(request, preview):
+    if request.headers.get("If-None-Match"):
+        return etag_matches(request, preview["etag"])
+    try:
+        since = request.if_modified_since
+    except ValueError:
+        since = None
+    return since is not None and int(preview["mtime"]) <= since.timestamp()
+
+# 章节预览图（两种路由共用），allow_default为True时没有预览图则生成默认预览图
+async def chapter_preview_response(request, chapter_id, allow_default=False):
+    try:
+        record = await resolve_chapter(chapter_id)
+    except ValueError:
+        print(f"[LearningCenter] 章节ID格式错误: {chapter_id}, 应为'model/workflow'格式")
+        return web.Response(status=400, text="Invalid chapter ID format", content_type="text/plain")
+    if record is None:
+        print(f"[LearningCenter] 未找到章节目录: {chapter_id}")
+        return web.Response(status=404, text="Chapter directory not found", content_type="text/plain")
+    
+    # 缩略图宽度：?w=256 或 ?size=small/medium/large
+    try:
+        width = parse_thumbnail_width(request.query)
+    except ValueError as e:
+        return web.Response(status=400, text=str(e), content_type="text/plain")
+    
+    # 按 preview.png、其他格式的 preview.*、目录中任意图片的顺序查找
+    preview = get_chapter_store().preview_file(record)
+    if preview is not None:
+        # 缩略图和WebP/AVIF变体只生成一次，之后从磁盘缓存读取
+        fmt = negotiate_format(request.headers.get("Accept"), preview["content_type"])
+        if width or fmt:
+            preview = await preview_cache.variant(preview, width, fmt)
+        headers = {
+            "Cache-Control": "max-age=3600",
+            "Vary": "Accept",
+            "ETag": preview["etag"],
+            "Last-Modified": formatdate(preview["mtime"], usegmt=True)
+        }
+        # 浏览器缓存仍然有效时直接返回304，不访问磁盘
+        if preview_not_modified(request, preview):
+            return web.Response(status=304, headers=headers)
+        # FileResponse使用sendfile发送文件，并处理Range请求
+        headers["Content-Type"] = preview["content_type"]
+        return web.FileResponse(preview["path"], headers=headers)
+    
+    if allow_default:
+        # 默认预览图按章节缓存，重复请求不再重新绘制和编码
+        try:
+            placeholder = placeholder_cache.lookup(chapter_id)
+            if placeholder is None:
+                placeholder = await run_io(placeholder_cache.render, chapter_id)
+                print(f"[LearningCenter] 已创建默认预览图: {chapter_id}")
+        except Exception as e:
+            print(f"[LearningCenter] 创建默认预览图时出错: {e}")
+            return web.Response(
+                status=404,
+                text="Preview image not found and failed to create default preview",
+                content_type="text/plain"
+            )
+        body, etag = placeholder
+        headers = {"Cache-Control": "max-age=60", "ETag": etag}  # 短缓存时间，章节添加预览图后尽快生效
+        if etag_matches(request, etag):
+            return web.Response(status=304, headers=headers)
+        return web.Response(body=body, content_type="image/png", headers=headers)
+    
+    print(f"[LearningCenter] 未找到任何预览图: {chapter_id}，返回404状态码")
+    return web.Response(status=404, text="Preview image not found", content_type="text/plain")
+
+# 标记章节完成（两种路由共用）
+async def complete_chapter_response(request, chapter_id):
+    try:
+        record = await resolve_chapter(chapter_id)
+    except ValueError:
+        print(f"[LearningCenter] 章节ID格式错误: {chapter_id}")
+        return web.json_response({"error": "Invalid chapter ID format"}, status=400)
+    if record is None:
+        print(f"[LearningCenter] 未找到章节 {chapter_id}")
+        return web.json_response({"error": "Chapter not found"}, status=404)
+    
+    # 读取请求体
+    data = await request.json()
+    submitted_workflow = data.get("workflow")
+    
+    if not submitted_workflow:
+        return web.json_response({"error": "No workflow submitted"}, status=400)
+    
+    # 更新并保存用户进度
+    save_result = await run_io(save_chapter_completed, record, request_namespace(request))
+    if not save_result:
+        return web.json_response({"error": "Failed to save progress"}, status=500)
+    
+    return web.json_response({
+        "success": True,
+        "message": "章节已标记为完成"
+    })
+
+# 删除章节（两种路由共用）
+async def delete_chapter_response(request, chapter_id):
+    try:
+        record = await resolve_chapter(chapter_id)
+    except ValueError:
+        print(f"[LearningCenter] 章节ID格式错误: {chapter_id}")
+        return web.json_response({"error": "Invalid chapter ID format"}, status=400)
+    if record is None:
+        print(f"[LearningCenter] 未找到章节 {chapter_id}")
+        return web.json_response({"error": "Chapter not found"}, status=404)
+    
+    # 删除章节目录，更新章节索引和用户进度
+    save_result = await run_io(delete_chapter_files, record)
+    if not save_result:
+        return web.json_response({"error": "Failed to delete chapter"}, status=500)
+    
+    return web.json_response({
+        "success": True,
+        "message": "章节已成功删除"
+    })
+
 # API路由：获取章节详情
 @PromptServer.instance.routes.get("/api/learningcenter/chapters/{chapter_id}")
 async def get_chapter_details(request):
     try:
         chapter_id = request.match_info["chapter_id"]
-        templates_dir, _ = get_template_directories()
-        user_progress = load_user_progress()
-        
         print(f"[LearningCenter] 正在查找章节详情: {chapter_id}")
-        print(f"[LearningCenter] 模板目录: {templates_dir}")
-        
-        # 安全读取JSON文件的辅助函数
-        def safe_read_json(file_path):
-            try:
-                with open(file_path, "r", encoding="utf-8-sig") as f:
-                    return json.load(f)
-            except Exception as e:
-                print(f"[LearningCenter] 读取文件出错 {file_path}: {e}")
-                try:
-                    with open(file_path, "r", encoding="gbk") as f:
-                        return json.load(f)
-                except Exception as e2:
-                    print(f"[LearningCenter] 第二次尝试读取文件也失败 {file_path}: {e2}")
-                    return {}
-        
-        # 安全读取文本文件的辅助函数    
-        def safe_read_text(file_path):
-            try:
-                with open(file_path, "r", encoding="utf-8-sig") as f:
-                    return f.read()
-            except Exception as e:
-                print(f"[LearningCenter] 读取文件出错 {file_path}: {e}")
-                try:
-                    with open(file_path, "r", encoding="gbk") as f:
-                        return f.read()
-                except Exception as e2:
-                    print(f"[LearningCenter] 第二次尝试读取文件也失败 {file_path}: {e2}")
-                    return None
-        
-        # 处理新的目录结构格式
-        is_new_format = '/' in chapter_id
-        
-        print(f"[LearningCenter] 章节ID格式: {'新格式 (model/workflow)' if is_new_format else '旧格式 (chapterX)'}")
-        
-        if is_new_format:
-            # 新格式: model_name/workflow_type
-            path_parts = chapter_id.split('/')
-            print(f"[LearningCenter] 章节ID分割结果: {path_parts}, 部分数量: {len(path_parts)}")
-            
-            if len(path_parts) == 2:
-                model_name, workflow_type = path_parts
-                chapter_dir = os.path.join(templates_dir, model_name, workflow_type)
-                print(f"[LearningCenter] 解析为模型名称: {model_name}, 工作流类型: {workflow_type}")
-                print(f"[LearningCenter] 对应章节目录: {chapter_dir}")
-            else:
-                print(f"[LearningCenter] 章节ID格式错误: {chapter_id}, 应为'model/workflow'格式")
-                return web.json_response({"error": "Invalid chapter ID format"}, status=400)
-        else:
-            # 旧格式: chapter*
-            chapter_dir = os.path.join(templates_dir, chapter_id)
-            print(f"[LearningCenter] 对应章节目录: {chapter_dir}")
-        
-        # 检查目录是否存在
-        if not os.path.isdir(chapter_dir):
-            print(f"[LearningCenter] 未找到章节目录 {chapter_dir}, 当前存在的目录: {os.listdir(templates_dir)}")
-            
-            # 如果是新格式，检查模型目录是否存在
-            if is_new_format:
-                model_dir = os.path.join(templates_dir, model_name)
-                if os.path.isdir(model_dir):
-                    print(f"[LearningCenter] 模型目录存在: {model_dir}, 内容: {os.listdir(model_dir)}")
-                else:
-                    print(f"[LearningCenter] 模型目录不存在: {model_dir}")
-            
-            return web.json_response({"error": "Chapter not found"}, status=404)
-        
-        # 元数据文件
-        metadata_path = os.path.join(chapter_dir, "metadata.json")
-        print(f"[LearningCenter] 检查元数据文件: {metadata_path}")
-        
-        if not os.path.exists(metadata_path):
-            print(f"[LearningCenter] 未找到章节元数据: {metadata_path}")
-            return web.json_response({"error": "Chapter metadata not found"}, status=404)
-        
-        # 读取元数据
-        print(f"[LearningCenter] 开始读取元数据: {metadata_path}")
-        metadata = safe_read_json(metadata_path)
-        if not metadata:
-            print(f"[LearningCenter] 元数据读取失败或为空")
-            return web.json_response({"error": "Failed to read chapter metadata"}, status=500)
-        
-        print(f"[LearningCenter] 成功读取元数据: {metadata}")
-        
-        # 练习工作流
-        exercise_path = os.path.join(chapter_dir, "exercise.json")
-        print(f"[LearningCenter] 检查练习工作流: {exercise_path}, 存在: {os.path.exists(exercise_path)}")
-        exercise_workflow = safe_read_text(exercise_path) if os.path.exists(exercise_path) else None
-        
-        # 答案工作流（只有已完成的章节或请求预览时才提供）
-        answer_path = os.path.join(chapter_dir, "answer.json")
-        
-        # 检查请求参数是否包含preview_answer=true
-        show_answer = request.query.get("preview_answer") == "true"
-        is_completed = user_progress.get("completed_chapters", {}).get(chapter_id, False)
-        
-        answer_workflow = None
-        if (show_answer or is_completed) and os.path.exists(answer_path):
-            answer_workflow = safe_read_text(answer_path)
-        
-        # 补充元数据
-        metadata.update({
-            "id": chapter_id,
-            "has_exercise": exercise_workflow is not None,
-            "has_answer": os.path.exists(answer_path),
-            "has_preview": os.path.exists(os.path.join(chapter_dir, "preview.png")),
-            "completed": is_completed
-        })
-        
-        # 如果是新格式且元数据中没有指定模型，添加模型信息
-        if is_new_format and "model" not in metadata:
-            metadata["model"] = path_parts[0]
-        
-        response = {
-            "metadata": metadata,
-            "exercise_workflow": exercise_workflow,
-            "answer_workflow": answer_workflow
-        }
-        
-        return web.json_response(response)
+        return await chapter_details_response(request, chapter_id)
     except Exception as e:
         print(f"[LearningCenter] 获取章节详情错误: {e}")
         import traceback
@@ -450,183 +520,7 @@ async def get_chapter_details(request):
 async def get_preview(request):
     try:
         chapter_id = request.match_info["chapter_id"]
-        templates_dir, _ = get_template_directories()
-        
-        print(f"[LearningCenter] 请求章节预览 {chapter_id}")
-        print(f"[LearningCenter] 请求路径: {request.path}")
-        print(f"[LearningCenter] 模板目录: {templates_dir}")
-        
-        # 尝试直接打印请求相关信息，帮助诊断
-        try:
-            print(f"[LearningCenter] 请求头: {dict(request.headers)}")
-            print(f"[LearningCenter] 请求查询参数: {dict(request.query)}")
-        except Exception as e:
-            print(f"[LearningCenter] 打印请求信息时出错: {e}")
-        
-        # 处理新的目录结构格式
-        is_new_format = '/' in chapter_id
-        
-        print(f"[LearningCenter] 章节ID格式: {'新格式 (model/workflow)' if is_new_format else '旧格式 (chapterX)'}")
-        
-        if is_new_format:
-            # 新格式: model_name/workflow_type
-            path_parts = chapter_id.split('/')
-            print(f"[LearningCenter] 章节ID分割结果: {path_parts}, 部分数量: {len(path_parts)}")
-            
-            if len(path_parts) == 2:
-                model_name, workflow_type = path_parts
-                chapter_dir = os.path.join(templates_dir, model_name, workflow_type)
-                print(f"[LearningCenter] 解析为模型名称: {model_name}, 工作流类型: {workflow_type}")
-                print(f"[LearningCenter] 对应章节目录: {chapter_dir}")
-            else:
-                print(f"[LearningCenter] 章节ID格式错误: {chapter_id}, 应为'model/workflow'格式")
-                return web.Response(
-                    status=400,
-                    text="Invalid chapter ID format",
-                    content_type="text/plain"
-                )
-        else:
-            # 旧格式: chapter*
-            chapter_dir = os.path.join(templates_dir, chapter_id)
-            print(f"[LearningCenter] 对应章节目录: {chapter_dir}")
-        
-        # 检查目录是否存在
-        if not os.path.exists(chapter_dir):
-            print(f"[LearningCenter] 未找到章节目录 {chapter_dir}")
-            # 如果是新格式，检查模型目录是否存在
-            if is_new_format:
-                model_dir = os.path.join(templates_dir, model_name)
-                if os.path.exists(model_dir):
-                    print(f"[LearningCenter] 模型目录存在: {model_dir}, 内容: {os.listdir(model_dir)}")
-                else:
-                    print(f"[LearningCenter] 模型目录不存在: {model_dir}")
-            
-            return web.Response(
-                status=404,
-                text=f"Chapter directory not found: {chapter_dir}",
-                content_type="text/plain"
-            )
-        
-        # 列出章节目录中的所有文件
-        print(f"[LearningCenter] 章节目录内容: {os.listdir(chapter_dir)}")
-        
-        preview_path = os.path.join(chapter_dir, "preview.png")
-        
-        # 检查预览图路径并打印详细信息
-        print(f"[LearningCenter] 检查预览图路径: {preview_path}")
-        print(f"[LearningCenter] 预览图存在: {os.path.exists(preview_path)}")
-        
-        # 检查文件属性
-        if os.path.exists(preview_path):
-            try:
-                file_size = os.path.getsize(preview_path)
-                file_time = os.path.getmtime(preview_path)
-                print(f"[LearningCenter] 预览图文件大小: {file_size} 字节")
-                print(f"[LearningCenter] 预览图修改时间: {time.ctime(file_time)}")
-                
-                # 尝试打开文件来验证是否可读
-                try:
-                    with open(preview_path, "rb") as f:
-                        first_bytes = f.read(16)
-                        print(f"[LearningCenter] 预览图文件前16字节: {first_bytes.hex()}")
-                except Exception as e:
-                    print(f"[LearningCenter] 尝试读取预览图时出错: {e}")
-                
-                print(f"[LearningCenter] 找到预览图，返回: {preview_path}")
-                # 设置缓存控制和内容类型
-                headers = {
-                    "Cache-Control": "max-age=3600",
-                    "Content-Type": "image/png"
-                }
-                
-                # 尝试使用aiohttp的构造器来创建响应，而不是直接使用FileResponse
-                try:
-                    with open(preview_path, "rb") as f:
-                        file_data = f.read()
-                        
-                    return web.Response(
-                        body=file_data,
-                        headers=headers,
-                        content_type="image/png"
-                    )
-                except Exception as e:
-                    print(f"[LearningCenter] 创建文件响应时出错: {e}")
-                    return web.FileResponse(preview_path, headers=headers)
-            except Exception as e:
-                print(f"[LearningCenter] 获取预览图文件信息时出错: {e}")
-        
-        # 如果没有预览图，尝试找其他图
-        print(f"[LearningCenter] 没有找到preview.png，尝试其他格式")
-        alt_exts = ['.jpg', '.jpeg', '.webp', '.gif']
-        
-        for ext in alt_exts:
-            alt_preview = os.path.join(chapter_dir, f"preview{ext}")
-            print(f"[LearningCenter] 检查替代预览图: {alt_preview}, 存在: {os.path.exists(alt_preview)}")
-            
-            if os.path.exists(alt_preview):
-                print(f"[LearningCenter] 找到替代预览图 {alt_preview}")
-                content_type = f"image/{ext[1:]}" if ext != '.jpg' else "image/jpeg"
-                headers = {
-                    "Cache-Control": "max-age=3600",
-                    "Content-Type": content_type
-                }
-                return web.FileResponse(alt_preview, headers=headers)
-        
-        # 尝试找目录中的第一张图
-        print(f"[LearningCenter] 尝试寻找目录中的任意图片作为预览")
-        image_exts = ['.png', '.jpg', '.jpeg', '.webp', '.gif']
-        
-        try:
-            for file in os.listdir(chapter_dir):
-                file_lower = file.lower()
-                print(f"[LearningCenter] 检查目录中的文件: {file}")
-                
-                if any(file_lower.endswith(ext) for ext in image_exts):
-                    img_path = os.path.join(chapter_dir, file)
-                    print(f"[LearningCenter] 使用目录中的图片作为预览: {img_path}")
-                    ext = os.path.splitext(file_lower)[1]
-                    content_type = f"image/{ext[1:]}" if ext != '.jpg' else "image/jpeg"
-                    headers = {
-                        "Cache-Control": "max-age=3600",
-                        "Content-Type": content_type
-                    }
-                    return web.FileResponse(img_path, headers=headers)
-        except Exception as e:
-            print(f"[LearningCenter] 查找目录中的图片时出错: {e}")
-        
-        # 如果没有找到任何预览图，尝试创建一个默认的预览图
-        try:
-            print(f"[LearningCenter] 尝试创建默认预览图")
-            from PIL import Image, ImageDraw, ImageFont
-            import io
-            
-            # 创建一个简单的图像，显示章节ID
-            img = Image.new('RGB', (400, 300), color=(73, 109, 137))
-            d = ImageDraw.Draw(img)
-            d.text((10, 10), f"Chapter: {chapter_id}", fill=(255, 255, 0))
-            d.text((10, 50), "No preview available", fill=(255, 255, 0))
-            
-            # 转换为字节
-            img_byte_arr = io.BytesIO()
-            img.save(img_byte_arr, format='PNG')
-            img_byte_arr.seek(0)
-            
-            print(f"[LearningCenter] 已创建默认预览图")
-            return web.Response(
-                body=img_byte_arr.getvalue(),
-                content_type="image/png",
-                headers={"Cache-Control": "max-age=60"}  # 短缓存时间
-            )
-        except Exception as e:
-            print(f"[LearningCenter] 创建默认预览图时出错: {e}")
-        
-        # 如果没有找到任何预览图
-        print(f"[LearningCenter] 未找到任何预览图且无法创建默认预览图: {chapter_id}，返回404状态码")
-        return web.Response(
-            status=404,
-            text="Preview image not found and failed to create default preview",
-            content_type="text/plain"
-        )
+        return await chapter_preview_response(request, chapter_id, allow_default=True)
     except Exception as e:
         print(f"[LearningCenter] 获取预览图错误: {e}")
         import traceback
@@ -642,61 +536,8 @@ async def get_preview(request):
 async def mark_chapter_completed(request):
     try:
         chapter_id = request.match_info["chapter_id"]
-        templates_dir, _ = get_template_directories()
-        
         print(f"[LearningCenter] 更新章节完成状态 {chapter_id}")
-        
-        # 处理新的目录结构格式
-        is_new_format = '/' in chapter_id
-        
-        if is_new_format:
-            # 新格式: model_name/workflow_type
-            path_parts = chapter_id.split('/')
-            if len(path_parts) == 2:
-                model_name, workflow_type = path_parts
-                chapter_dir = os.path.join(templates_dir, model_name, workflow_type)
-            else:
-                print(f"[LearningCenter] 章节ID格式错误: {chapter_id}")
-                return web.json_response({"error": "Invalid chapter ID format"}, status=400)
-        else:
-            # 旧格式: chapter*
-            chapter_dir = os.path.join(templates_dir, chapter_id)
-        
-        # 检查章节是否存在
-        if not os.path.isdir(chapter_dir):
-            print(f"[LearningCenter] 未找到章节 {chapter_id}")
-            return web.json_response({"error": "Chapter not found"}, status=404)
-        
-        # 读取请求体
-        data = await request.json()
-        submitted_workflow = data.get("workflow")
-        
-        if not submitted_workflow:
-            return web.json_response({"error": "No workflow submitted"}, status=400)
-        
-        # 读取用户进度
-        user_progress = load_user_progress()
-        
-        # 检查是否有答案文件
-        answer_path = os.path.join(chapter_dir, "answer.json")
-        has_answer = os.path.exists(answer_path)
-        
-        # 即使没有答案文件，也允许将章节标记为已完成
-        if not has_answer:
-            print(f"[LearningCenter] 章节没有答案文件 {chapter_id}，但仍允许标记为已完成")
-        
-        # 更新完成状态
-        user_progress.setdefault("completed_chapters", {})[chapter_id] = True
-        
-        # 保存用户进度
-        save_result = save_user_progress(user_progress)
-        if not save_result:
-            return web.json_response({"error": "Failed to save progress"}, status=500)
-        
-        return web.json_response({
-            "success": True,
-            "message": "章节已标记为完成"
-        })
+        return await complete_chapter_response(request, chapter_id)
     except Exception as e:
         print(f"[LearningCenter] 更新章节完成状态错误: {e}")
         import traceback
@@ -723,12 +564,8 @@ async def reset_user_progress(request):
                 "require_confirmation": True
             }, status=400)
         
-        # 读取当前进度，仅重置已完成章节
-        current_progress = load_user_progress()
-        current_progress["completed_chapters"] = {}
-        
-        # 保存修改后的进度
-        save_result = save_user_progress(current_progress)
+        # 仅重置当前用户的已完成章节
+        save_result = await run_io(record_progress_event, {"op": "reset"}, request_namespace(request))
         if not save_result:
             return web.json_response({"error": "保存进度失败"}, status=500)
         
@@ -748,47 +585,8 @@ async def reset_user_progress(request):
 async def delete_chapter(request):
     try:
         chapter_id = request.match_info["chapter_id"]
-        templates_dir, _ = get_template_directories()
-        
         print(f"[LearningCenter] 删除章节 {chapter_id}")
-        
-        # 处理新的目录结构格式
-        is_new_format = '/' in chapter_id
-        
-        if is_new_format:
-            # 新格式: model_name/workflow_type
-            path_parts = chapter_id.split('/')
-            if len(path_parts) == 2:
-                model_name, workflow_type = path_parts
-                chapter_dir = os.path.join(templates_dir, model_name, workflow_type)
-            else:
-                print(f"[LearningCenter] 章节ID格式错误: {chapter_id}")
-                return web.json_response({"error": "Invalid chapter ID format"}, status=400)
-        else:
-            # 旧格式: chapter*
-            chapter_dir = os.path.join(templates_dir, chapter_id)
-        
-        # 检查章节是否存在
-        if not os.path.isdir(chapter_dir):
-            print(f"[LearningCenter] 未找到章节 {chapter_id}")
-            return web.json_response({"error": "Chapter not found"}, status=404)
-        
-        # 删除章节目录及其所有内容
-        shutil.rmtree(chapter_dir)
-        
-        # 更新用户进度
-        user_progress = load_user_progress()
-        user_progress["completed_chapters"].pop(chapter_id, None)
-        
-        # 保存用户进度
-        save_result = save_user_progress(user_progress)
-        if not save_result:
-            return web.json_response({"error": "Failed to delete chapter"}, status=500)
-        
-        return web.json_response({
-            "success": True,
-            "message": "章节已成功删除"
-        })
+        return await delete_chapter_response(request, chapter_id)
     except Exception as e:
         print(f"[LearningCenter] 删除章节错误: {e}")
         import traceback
@@ -799,113 +597,9 @@ async def delete_chapter(request):
 @PromptServer.instance.routes.get("/api/learningcenter/chapters/{model_name}/{workflow_type}")
 async def get_model_chapter_details(request):
     try:
-        model_name = request.match_info["model_name"]
-        workflow_type = request.match_info["workflow_type"]
-        chapter_id = f"{model_name}/{workflow_type}"
-        
+        chapter_id = f"{request.match_info['model_name']}/{request.match_info['workflow_type']}"
         print(f"[LearningCenter] 使用新路由处理模型章节请求: {chapter_id}")
-        print(f"[LearningCenter] 模型名称: {model_name}, 工作流类型: {workflow_type}")
-        
-        templates_dir, _ = get_template_directories()
-        user_progress = load_user_progress()
-        
-        chapter_dir = os.path.join(templates_dir, model_name, workflow_type)
-        print(f"[LearningCenter] 对应章节目录: {chapter_dir}")
-        
-        # 安全读取JSON文件的辅助函数
-        def safe_read_json(file_path):
-            try:
-                with open(file_path, "r", encoding="utf-8-sig") as f:
-                    return json.load(f)
-            except Exception as e:
-                print(f"[LearningCenter] 读取文件出错 {file_path}: {e}")
-                try:
-                    with open(file_path, "r", encoding="gbk") as f:
-                        return json.load(f)
-                except Exception as e2:
-                    print(f"[LearningCenter] 第二次尝试读取文件也失败 {file_path}: {e2}")
-                    return {}
-        
-        # 安全读取文本文件的辅助函数    
-        def safe_read_text(file_path):
-            try:
-                with open(file_path, "r", encoding="utf-8-sig") as f:
-                    return f.read()
-            except Exception as e:
-                print(f"[LearningCenter] 读取文件出错 {file_path}: {e}")
-                try:
-                    with open(file_path, "r", encoding="gbk") as f:
-                        return f.read()
-                except Exception as e2:
-                    print(f"[LearningCenter] 第二次尝试读取文件也失败 {file_path}: {e2}")
-                    return None
-        
-        # 检查目录是否存在
-        if not os.path.isdir(chapter_dir):
-            print(f"[LearningCenter] 未找到章节目录 {chapter_dir}")
-            
-            # 检查模型目录是否存在
-            model_dir = os.path.join(templates_dir, model_name)
-            if os.path.isdir(model_dir):
-                print(f"[LearningCenter] 模型目录存在: {model_dir}, 内容: {os.listdir(model_dir)}")
-            else:
-                print(f"[LearningCenter] 模型目录不存在: {model_dir}")
-            
-            return web.json_response({"error": "Chapter not found"}, status=404)
-        
-        # 元数据文件
-        metadata_path = os.path.join(chapter_dir, "metadata.json")
-        print(f"[LearningCenter] 检查元数据文件: {metadata_path}")
-        
-        if not os.path.exists(metadata_path):
-            print(f"[LearningCenter] 未找到章节元数据: {metadata_path}")
-            return web.json_response({"error": "Chapter metadata not found"}, status=404)
-        
-        # 读取元数据
-        print(f"[LearningCenter] 开始读取元数据: {metadata_path}")
-        metadata = safe_read_json(metadata_path)
-        if not metadata:
-            print(f"[LearningCenter] 元数据读取失败或为空")
-            return web.json_response({"error": "Failed to read chapter metadata"}, status=500)
-        
-        print(f"[LearningCenter] 成功读取元数据: {metadata}")
-        
-        # 练习工作流
-        exercise_path = os.path.join(chapter_dir, "exercise.json")
-        print(f"[LearningCenter] 检查练习工作流: {exercise_path}, 存在: {os.path.exists(exercise_path)}")
-        exercise_workflow = safe_read_text(exercise_path) if os.path.exists(exercise_path) else None
-        
-        # 答案工作流（只有已完成的章节或请求预览时才提供）
-        answer_path = os.path.join(chapter_dir, "answer.json")
-        
-        # 检查请求参数是否包含preview_answer=true
-        show_answer = request.query.get("preview_answer") == "true"
-        is_completed = user_progress.get("completed_chapters", {}).get(chapter_id, False)
-        
-        answer_workflow = None
-        if (show_answer or is_completed) and os.path.exists(answer_path):
-            answer_workflow = safe_read_text(answer_path)
-        
-        # 补充元数据
-        metadata.update({
-            "id": chapter_id,
-            "has_exercise": exercise_workflow is not None,
-            "has_answer": os.path.exists(answer_path),
-            "has_preview": os.path.exists(os.path.join(chapter_dir, "preview.png")),
-            "completed": is_completed
-        })
-        
-        # 如果元数据中没有指定模型，添加模型信息
-        if "model" not in metadata:
-            metadata["model"] = model_name
-        
-        response = {
-            "metadata": metadata,
-            "exercise_workflow": exercise_workflow,
-            "answer_workflow": answer_workflow
-        }
-        
-        return web.json_response(response)
+        return await chapter_details_response(request, chapter_id)
     except Exception as e:
         print(f"[LearningCenter] 获取模型章节详情错误: {e}")
         import traceback
@@ -916,85 +610,8 @@ async def get_model_chapter_details(request):
 @PromptServer.instance.routes.get("/api/learningcenter/chapters/{model_name}/{workflow_type}/preview")
 async def get_model_chapter_preview(request):
     try:
-        model_name = request.match_info["model_name"]
-        workflow_type = request.match_info["workflow_type"]
-        chapter_id = f"{model_name}/{workflow_type}"
-        
-        print(f"[LearningCenter] 使用新路由处理模型章节预览请求: {chapter_id}")
-        print(f"[LearningCenter] 模型名称: {model_name}, 工作流类型: {workflow_type}")
-        
-        templates_dir, _ = get_template_directories()
-        chapter_dir = os.path.join(templates_dir, model_name, workflow_type)
-        
-        print(f"[LearningCenter] 对应章节目录: {chapter_dir}")
-        print(f"[LearningCenter] 检查目录是否存在: {os.path.exists(chapter_dir)}")
-        
-        if not os.path.isdir(chapter_dir):
-            print(f"[LearningCenter] 未找到章节目录: {chapter_dir}")
-            return web.Response(
-                status=404,
-                text="Chapter directory not found",
-                content_type="text/plain"
-            )
-        
-        preview_path = os.path.join(chapter_dir, "preview.png")
-        
-        # 检查预览图路径并打印详细信息
-        print(f"[LearningCenter] 检查预览图路径: {preview_path}")
-        print(f"[LearningCenter] 预览图存在: {os.path.exists(preview_path)}")
-        
-        if os.path.exists(preview_path):
-            print(f"[LearningCenter] 找到预览图，返回: {preview_path}")
-            # 设置缓存控制和内容类型
-            headers = {
-                "Cache-Control": "max-age=3600",
-                "Content-Type": "image/png"
-            }
-            return web.FileResponse(preview_path, headers=headers)
-        
-        # 如果没有预览图，尝试找其他图
-        print(f"[LearningCenter] 未找到预览图，尝试其他格式")
-        for ext in ['.jpg', '.jpeg', '.webp', '.gif']:
-            alt_preview = os.path.join(chapter_dir, f"preview{ext}")
-            print(f"[LearningCenter] 检查替代预览图: {alt_preview}, 存在: {os.path.exists(alt_preview)}")
-            if os.path.exists(alt_preview):
-                print(f"[LearningCenter] 找到替代预览图 {alt_preview}")
-                content_type = f"image/{ext[1:]}" if ext != '.jpg' else "image/jpeg"
-                headers = {
-                    "Cache-Control": "max-age=3600",
-                    "Content-Type": content_type
-                }
-                return web.FileResponse(alt_preview, headers=headers)
-        
-        # 尝试找目录中的第一张图
-        print(f"[LearningCenter] 尝试寻找目录中的任意图片作为预览")
-        image_exts = ['.png', '.jpg', '.jpeg', '.webp', '.gif']
-        try:
-            dir_contents = os.listdir(chapter_dir)
-            print(f"[LearningCenter] 目录内容: {dir_contents}")
-            
-            for file in dir_contents:
-                file_lower = file.lower()
-                if any(file_lower.endswith(ext) for ext in image_exts):
-                    img_path = os.path.join(chapter_dir, file)
-                    print(f"[LearningCenter] 使用目录中的图片作为预览: {img_path}")
-                    ext = os.path.splitext(file_lower)[1]
-                    content_type = f"image/{ext[1:]}" if ext != '.jpg' else "image/jpeg"
-                    headers = {
-                        "Cache-Control": "max-age=3600",
-                        "Content-Type": content_type
-                    }
-                    return web.FileResponse(img_path, headers=headers)
-        except Exception as e:
-            print(f"[LearningCenter] 查找目录中的图片时出错: {e}")
-        
-        # 如果没有找到任何预览图
-        print(f"[LearningCenter] 未找到任何预览图: {chapter_id}，返回404状态码")
-        return web.Response(
-            status=404,
-            text="Preview image not found",
-            content_type="text/plain"
-        )
+        chapter_id = f"{request.match_info['model_name']}/{request.match_info['workflow_type']}"
+        return await chapter_preview_response(request, chapter_id)
     except Exception as e:
         print(f"[LearningCenter] 获取模型章节预览错误: {e}")
         import traceback
@@ -1009,51 +626,9 @@ async def get_model_chapter_preview(request):
 @PromptServer.instance.routes.post("/api/learningcenter/chapters/{model_name}/{workflow_type}/complete")
 async def mark_model_chapter_completed(request):
     try:
-        model_name = request.match_info["model_name"]
-        workflow_type = request.match_info["workflow_type"]
-        chapter_id = f"{model_name}/{workflow_type}"
-        
+        chapter_id = f"{request.match_info['model_name']}/{request.match_info['workflow_type']}"
         print(f"[LearningCenter] 使用新路由更新模型章节完成状态: {chapter_id}")
-        print(f"[LearningCenter] 模型名称: {model_name}, 工作流类型: {workflow_type}")
-        
-        templates_dir, _ = get_template_directories()
-        chapter_dir = os.path.join(templates_dir, model_name, workflow_type)
-        
-        # 检查章节是否存在
-        if not os.path.isdir(chapter_dir):
-            print(f"[LearningCenter] 未找到章节目录: {chapter_dir}")
-            return web.json_response({"error": "Chapter not found"}, status=404)
-        
-        # 读取请求体
-        data = await request.json()
-        submitted_workflow = data.get("workflow")
-        
-        if not submitted_workflow:
-            return web.json_response({"error": "No workflow submitted"}, status=400)
-        
-        # 读取用户进度
-        user_progress = load_user_progress()
-        
-        # 检查是否有答案文件
-        answer_path = os.path.join(chapter_dir, "answer.json")
-        has_answer = os.path.exists(answer_path)
-        
-        # 即使没有答案文件，也允许将章节标记为已完成
-        if not has_answer:
-            print(f"[LearningCenter] 章节没有答案文件 {chapter_id}，但仍允许标记为已完成")
-        
-        # 更新完成状态
-        user_progress.setdefault("completed_chapters", {})[chapter_id] = True
-        
-        # 保存用户进度
-        save_result = save_user_progress(user_progress)
-        if not save_result:
-            return web.json_response({"error": "Failed to save progress"}, status=500)
-        
-        return web.json_response({
-            "success": True,
-            "message": "章节已标记为完成"
-        })
+        return await complete_chapter_response(request, chapter_id)
     except Exception as e:
         print(f"[LearningCenter] 更新模型章节完成状态错误: {e}")
         import traceback
@@ -1064,39 +639,162 @@ async def mark_model_chapter_completed(request):
 @PromptServer.instance.routes.post("/api/learningcenter/chapters/{model_name}/{workflow_type}/delete")
 async def delete_model_chapter(request):
     try:
-        model_name = request.match_info["model_name"]
-        workflow_type = request.match_info["workflow_type"]
-        chapter_id = f"{model_name}/{workflow_type}"
-        
+        chapter_id = f"{request.match_info['model_name']}/{request.match_info['workflow_type']}"
         print(f"[LearningCenter] 使用新路由删除模型章节: {chapter_id}")
-        print(f"[LearningCenter] 模型名称: {model_name}, 工作流类型: {workflow_type}")
-        
-        templates_dir, _ = get_template_directories()
-        chapter_dir = os.path.join(templates_dir, model_name, workflow_type)
-        
-        # 检查章节是否存在
-        if not os.path.isdir(chapter_dir):
-            print(f"[LearningCenter] 未找到章节目录: {chapter_dir}")
-            return web.json_response({"error": "Chapter not found"}, status=404)
-        
-        # 删除章节目录及其所有内容
-        shutil.rmtree(chapter_dir)
-        
-        # 更新用户进度
-        user_progress = load_user_progress()
-        user_progress["completed_chapters"].pop(chapter_id, None)
-        
-        # 保存用户进度
-        save_result = save_user_progress(user_progress)
-        if not save_result:
-            return web.json_response({"error": "Failed to delete chapter"}, status=500)
-        
-        return web.json_response({
-            "success": True,
-            "message": "章节已成功删除"
-        })
+        return await delete_chapter_response(request, chapter_id)
     except Exception as e:
         print(f"[LearningCenter] 删除模型章节错误: {e}")
         import traceback
         traceback.print_exc()
         return web.json_response({"error": str(e)}, status=500) 
+
+
+# 精灵图默认的图块宽度
+SPRITE_DEFAULT_WIDTH = 256
+
+# API路由：把多个章节的预览图拼成一张精灵图，返回图片地址和每个章节的图块位置
+# 例如 /api/learningcenter/previews/sprite?ids=flux/flux_dev,sd3/sd3_basic&w=256&h=192
+@PromptServer.instance.routes.get("/api/learningcenter/previews/sprite")
+async def get_preview_sprite(request):
+    try:
+        chapter_ids = [cid.strip() for value in request.query.getall("ids", []) for cid in value.split(",") if cid.strip()]
+        chapter_ids = list(dict.fromkeys(chapter_ids))
+        if not chapter_ids:
+            return web.json_response({"error": "No chapter ids"}, status=400)
+        if len(chapter_ids) > SPRITE_MAX_TILES:
+            return web.json_response({"error": f"Too many chapter ids (max {SPRITE_MAX_TILES})"}, status=400)
+        
+        # 图块尺寸：宽度与预览图的 ?w= 相同，高度默认为宽度的3/4
+        try:
+            tile_width = parse_thumbnail_width(request.query) or SPRITE_DEFAULT_WIDTH
+            tile_height = int(request.query.get("h", tile_width * 3 // 4))
+            if not 16 <= tile_height <= 2048:
+                raise ValueError(f"Invalid tile height: {tile_height}")
+        except ValueError as e:
+            return web.json_response({"error": str(e)}, status=400)
+        
+        # 没有预览图或不存在的章节放在missing中，由前端自行处理
+        store = get_chapter_store()
+        previews = []
+        missing = []
+        for chapter_id in chapter_ids:
+            try:
+                record = await resolve_chapter(chapter_id)
+            except ValueError:
+                record = None
+            preview = store.preview_file(record) if record is not None else None
+            if preview is None:
+                missing.append(chapter_id)
+            else:
+                previews.append((chapter_id, preview))
+        
+        result = {
+            "url": None,
+            "width": 0,
+            "height": 0,
+            "tile_width": tile_width,
+            "tile_height": tile_height,
+            "tiles": {},
+            "missing": missing
+        }
+        if previews:
+            fmt = negotiate_format(request.headers.get("Accept"))
+            sprite = await preview_cache.sprite(previews, tile_width, tile_height, fmt)
+            result.update({
+                "url": f"/api/learningcenter/previews/sprite/{sprite['name']}",
+                "width": sprite["width"],
+                "height": sprite["height"],
+                "tiles": sprite["tiles"]
+            })
+        return web.json_response(result, headers={"Cache-Control": "no-cache", "Vary": "Accept"})
+    except Exception as e:
+        print(f"[LearningCenter] 生成预览精灵图错误: {e}")
+        import traceback
+        traceback.print_exc()
+        return web.json_response({"error": str(e)}, status=500)
+
+# API路由：获取已生成的精灵图，文件名由内容决定，可以长期缓存
+@PromptServer.instance.routes.get("/api/learningcenter/previews/sprite/{name}")
+async def get_preview_sprite_image(request):
+    try:
+        await preview_cache.ensure_loaded()
+        sprite = preview_cache.sprite_file(request.match_info["name"])
+        if sprite is None:
+            return web.Response(status=404, text="Sprite not found", content_type="text/plain")
+        path, content_type = sprite
+        return web.FileResponse(path, headers={
+            "Cache-Control": "public, max-age=31536000, immutable",
+            "Content-Type": content_type
+        })
+    except Exception as e:
+        print(f"[LearningCenter] 获取预览精灵图错误: {e}")
+        return web.Response(status=500, text=f"Error loading sprite: {str(e)}", content_type="text/plain")
+
+# API路由：批量标记章节完成（例如从LMS导入进度）
+# 请求体：{"chapter_ids": [...], "strict": false, "user": "可选，默认使用请求头中的用户"}
+@PromptServer.instance.routes.post("/api/learningcenter/progress/bulk-complete")
+async def bulk_complete_chapters(request):
+    try:
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.json_response({"error": "Invalid JSON body"}, status=400)
+        chapter_ids = data.get("chapter_ids") if isinstance(data, dict) else None
+        if not isinstance(chapter_ids, list) or not all(isinstance(cid, str) for cid in chapter_ids):
+            return web.json_response({"error": "chapter_ids must be a list of chapter IDs"}, status=400)
+        if len(chapter_ids) > MAX_BULK_CHAPTERS:
+            return web.json_response({"error": f"Too many chapters (max {MAX_BULK_CHAPTERS})"}, status=400)
+        user = data.get("user")
+        if user is not None and not isinstance(user, str):
+            return web.json_response({"error": "user must be a string"}, status=400)
+        namespace = normalize_namespace(user) if user else request_namespace(request)
+        # 只接受JSON布尔值，字符串"false"等不能当作True
+        strict = data.get("strict")
+        if strict is None:
+            strict = False
+        elif not isinstance(strict, bool):
+            return web.json_response({"error": "strict must be a boolean"}, status=400)
+        
+        try:
+            result = await run_io(complete_chapters_bulk, chapter_ids, namespace, strict)
+        except ValueError as e:
+            return web.json_response({"error": str(e)}, status=400)
+        
+        if strict and result["missing"]:
+            return web.json_response(dict(result, success=False, error="Chapter not found"), status=404)
+        print(f"[LearningCenter] 批量完成章节 {len(result['completed'])} 个，已完成 {len(result['already_completed'])} 个，不存在 {len(result['missing'])} 个")
+        return web.json_response(dict(result, success=True))
+    except Exception as e:
+        print(f"[LearningCenter] 批量完成章节错误: {e}")
+        import traceback
+        traceback.print_exc()
+        return web.json_response({"error": str(e)}, status=500)
+
+# API路由：立即写入延迟保存的用户进度
+@PromptServer.instance.routes.post("/api/learningcenter/progress/flush")
+async def flush_progress(request):
+    try:
+        flushed = await run_io(flush_user_progress)
+        return web.json_response({"success": True, "flushed": flushed})
+    except Exception as e:
+        print(f"[LearningCenter] 写入用户进度出错: {e}")
+        return web.json_response({"success": False, "error": str(e)}, status=500)
+
+# API路由：获取学习中心缓存状态
+@PromptServer.instance.routes.get("/api/learningcenter/cache_status")
+async def learningcenter_cache_status(request):
+    try:
+        catalog = get_chapter_catalog()
+        return web.json_response({
+            "success": True,
+            "generation": get_generation(),
+            "chapters": len(catalog),
+            "response_cache": response_cache.stats(),
+            "io_executor": io_executor.stats(),
+            "preview_cache": preview_cache.stats(),
+            "placeholder_cache": placeholder_cache.stats(),
+            "user_progress": get_user_registry().stats()
+        })
+    except Exception as e:
+        print(f"[LearningCenter] 获取缓存状态出错: {e}")
+        return web.json_response({"success": False, "error": str(e)}, status=500)
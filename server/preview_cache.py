@@ -0,0 +1,480 @@
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from .io_executor import IOExecutor
+from .response_cache import parse_accept
+
+# 缩略图磁盘缓存目录，默认在插件目录下的cache/previews
+PREVIEW_CACHE_DIR = os.environ.get(
+    "LEARNINGCENTER_PREVIEW_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cache", "previews")
+)
+# 缩略图磁盘缓存的容量上限
+PREVIEW_CACHE_MAX_BYTES = int(float(os.environ.get("LEARNINGCENTER_PREVIEW_CACHE_MB", "256")) * 1024 * 1024)
+# 生成缩略图的线程数（Pillow缩放属于CPU密集任务，与文件I/O线程池分开）
+IMAGE_MAX_WORKERS = int(os.environ.get("LEARNINGCENTER_IMAGE_WORKERS", "2"))
+
+# 可用的缩略图宽度，请求的宽度向上取到最近的一档，避免任意宽度撑满缓存
+THUMBNAIL_WIDTHS = (64, 128, 256, 384, 512, 768, 1024)
+# ?size= 支持的预设名称
+THUMBNAIL_PRESETS = {"small": 128, "medium": 256, "large": 512}
+THUMBNAIL_JPEG_QUALITY = 85
+
+# 默认预览图使用的字体文件（为空时使用Pillow内置字体）和缓存的数量上限
+PLACEHOLDER_FONT = os.environ.get("LEARNINGCENTER_PLACEHOLDER_FONT", "")
+PLACEHOLDER_CACHE_ENTRIES = int(os.environ.get("LEARNINGCENTER_PLACEHOLDER_CACHE_ENTRIES", "256"))
+
+# 精灵图（多个章节预览图拼成一张）最多包含的章节数和每行的图块数
+SPRITE_MAX_TILES = 100
+SPRITE_COLUMNS = 10
+
+# 按Accept协商的预览图格式，按优先顺序排列；设为空字符串可关闭转码
+PREVIEW_FORMATS = [f.strip().lower() for f in os.environ.get("LEARNINGCENTER_PREVIEW_FORMATS", "avif,webp").split(",") if f.strip()]
+# WebP/AVIF转码质量（0-100）
+PREVIEW_QUALITY = int(os.environ.get("LEARNINGCENTER_PREVIEW_QUALITY", "80"))
+
+CONTENT_TYPES = {
+    "jpg": "image/jpeg",
+    "png": "image/png",
+    "webp": "image/webp",
+    "avif": "image/avif",
+}
+
+
+def parse_thumbnail_width(query):
+    """从 ?w= 或 ?size= 中解析缩略图宽度，没有指定时返回None；取值错误时抛出ValueError"""
+    value = query.get("w") or query.get("size")
+    if not value:
+        return None
+    value = value.strip().lower()
+    if value in THUMBNAIL_PRESETS:
+        return THUMBNAIL_PRESETS[value]
+    try:
+        width = int(value)
+    except ValueError:
+        raise ValueError(f"Invalid thumbnail size: {value}")
+    if width <= 0:
+        raise ValueError(f"Invalid thumbnail size: {value}")
+    for bucket in THUMBNAIL_WIDTHS:
+        if width <= bucket:
+            return bucket
+    return THUMBNAIL_WIDTHS[-1]
+
+
+def sprite_layout(count, tile_width, tile_height, columns=SPRITE_COLUMNS):
+    """计算精灵图的尺寸和每个图块的位置，返回 (宽, 高, [(x, y), ...])"""
+    columns = max(1, min(count, columns))
+    rows = max(1, -(-count // columns))
+    offsets = [((i % columns) * tile_width, (i // columns) * tile_height) for i in range(count)]
+    return columns * tile_width, rows * tile_height, offsets
+
+
+def _has_alpha(img):
+    return img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+
+
+_supported_formats = None
+
+
+def supported_formats():
+    """当前Pillow能够写出的转码格式（AVIF需要Pillow 11.2+或pillow-avif-plugin）"""
+    global _supported_formats
+    if _supported_formats is None:
+        from PIL import Image
+        try:
+            import pillow_avif  # noqa: F401
+        except ImportError:
+            pass
+        Image.init()
+        _supported_formats = [fmt for fmt in PREVIEW_FORMATS if fmt.upper() in Image.SAVE and fmt in CONTENT_TYPES]
+    return _supported_formats
+
+
+def negotiate_format(accept, content_type=None):
+    """根据Accept选择图片的转码格式，不需要转码时返回None
+
+    只接受明确列出的类型（image/*不算），GIF动图和已经是该格式的图片不转码。
+    """
+    if not PREVIEW_FORMATS or content_type == "image/gif":
+        return None
+    accepted = parse_accept(accept)
+    for fmt in supported_formats():
+        if CONTENT_TYPES[fmt] in accepted:
+            return None if CONTENT_TYPES[fmt] == content_type else fmt
+    return None
+
+
+class PreviewCache:
+    """预览图缩略图和WebP/AVIF变体的磁盘缓存
+
+    缓存文件名由源文件路径、大小、mtime和缩略图参数的哈希组成，源文件变化后
+    自动使用新的文件名；总大小超过上限时按最近使用时间淘汰。
+    """
+
+    def __init__(self, cache_dir=PREVIEW_CACHE_DIR, max_bytes=PREVIEW_CACHE_MAX_BYTES, executor=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.executor = executor or IOExecutor(IMAGE_MAX_WORKERS, name="LearningCenterImage")
+        self._lock = threading.Lock()
+        # 缓存文件名 -> 文件大小，按最近使用顺序排列
+        self._entries = OrderedDict()
+        self._size = 0
+        self._loaded = False
+        # 正在生成的缓存文件名 -> Future，同一缩略图的并发请求只生成一次
+        self._pending = {}
+        # 源图比请求的宽度还小时直接使用原图
+        self._passthrough = set()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _load_index(self):
+        """首次使用时扫描缓存目录，按访问时间恢复LRU顺序"""
+        with self._lock:
+            if self._loaded:
+                return
+            entries = []
+            try:
+                with os.scandir(self.cache_dir) as it:
+                    for entry in it:
+                        if entry.is_file() and not entry.name.endswith(".tmp"):
+                            st = entry.stat()
+                            entries.append((st.st_atime, entry.name, st.st_size))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"[LearningCenter] 读取缩略图缓存目录出错: {e}")
+            for _, name, size in sorted(entries):
+                self._entries[name] = size
+                self._size += size
+            self._loaded = True
+        self._evict()
+
+    @staticmethod
+    def cache_name(preview, kind):
+        """根据源文件和变体参数生成缓存文件名（不含扩展名）"""
+        key = f"{preview['path']}|{preview['size']}|{preview['etag']}|{kind}"
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def _cached(self, base, exts):
+        """在索引中查找缓存文件，返回 (文件名, 文件大小)，没有时返回None"""
+        with self._lock:
+            for ext in exts:
+                name = f"{base}.{ext}"
+                if name in self._entries:
+                    self._entries.move_to_end(name)
+                    return name, self._entries[name]
+        return None
+
+    def _add(self, name, size):
+        with self._lock:
+            old = self._entries.pop(name, None)
+            if old is not None:
+                self._size -= old
+            self._entries[name] = size
+            self._size += size
+        self._evict()
+
+    def _evict(self):
+        removed = []
+        with self._lock:
+            # 最新加入的文件即将被返回，至少保留它
+            while len(self._entries) > 1 and self._size > self.max_bytes:
+                name, size = self._entries.popitem(last=False)
+                self._size -= size
+                self.evictions += 1
+                removed.append(name)
+        for name in removed:
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except OSError:
+                pass
+
+    def _write(self, name, img, fmt, mtime_ns, **params):
+        """把图像写入缓存目录（先写临时文件再重命名），返回文件大小
+
+        缓存文件的mtime设为源文件的mtime，Last-Modified和ETag随源文件变化。
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = os.path.join(self.cache_dir, name)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        img.save(tmp_path, format=fmt, **params)
+        os.utime(tmp_path, ns=(time.time_ns(), mtime_ns))
+        os.replace(tmp_path, path)
+        return os.path.getsize(path)
+
+    def _render(self, preview, width, fmt, base):
+        """生成缩略图或转码后的图片（在图像线程池中执行），返回 (文件名, 文件大小)
+
+        不需要缩放也不需要转码时返回None。没有指定格式时，带透明通道的图片保存为
+        PNG，其余保存为JPEG。
+        """
+        from PIL import Image
+
+        with Image.open(preview["path"]) as img:
+            resize = width is not None and img.width > width
+            if not resize and fmt is None:
+                return None
+            if resize:
+                height = max(1, round(img.height * width / img.width))
+                img.draft("RGB", (width, height))
+            out = img.convert("RGBA" if _has_alpha(img) else "RGB")
+            if resize:
+                out = out.resize((width, height), Image.LANCZOS)
+        if fmt is not None:
+            name = f"{base}.{fmt}"
+            size = self._write(name, out, fmt.upper(), preview["mtime_ns"], quality=PREVIEW_QUALITY)
+        elif out.mode == "RGBA":
+            name = f"{base}.png"
+            size = self._write(name, out, "PNG", preview["mtime_ns"], optimize=True)
+        else:
+            name = f"{base}.jpg"
+            size = self._write(name, out, "JPEG", preview["mtime_ns"], quality=THUMBNAIL_JPEG_QUALITY, optimize=True)
+        self._add(name, size)
+        return name, size
+
+    def _submit(self, base, func, *args):
+        """在图像线程池中生成缓存文件，合并同一文件的并发请求，返回Future"""
+        with self._lock:
+            future = self._pending.get(base)
+            if future is not None:
+                return future
+            future = self.executor.submit(func, *args)
+            self._pending[base] = future
+        # 在锁外注册回调：任务已经完成时回调会在当前线程立即执行
+        future.add_done_callback(lambda f: self._on_done(base, f))
+        return future
+
+    def _on_done(self, base, future):
+        error = future.exception()
+        with self._lock:
+            self._pending.pop(base, None)
+            # 不需要生成（源图足够小）的变体之后直接使用原图；生成失败时只记录日志，
+            # 下一次请求会重新尝试（例如磁盘暂时写满或源图正在被替换）
+            if error is None and future.result() is None:
+                self._passthrough.add(base)
+        if error is not None:
+            print(f"[LearningCenter] 生成预览图缓存出错: {error}")
+
+    def _describe(self, preview, name, size):
+        """生成缓存文件的描述，ETag与aiohttp FileResponse的格式一致"""
+        result = dict(preview)
+        result["path"] = os.path.join(self.cache_dir, name)
+        result["size"] = size
+        result["etag"] = f'"{preview["mtime_ns"]:x}-{size:x}"'
+        result["content_type"] = CONTENT_TYPES[name.rsplit(".", 1)[1]]
+        return result
+
+    async def ensure_loaded(self):
+        """确保缓存目录的索引已经加载"""
+        if not self._loaded:
+            await asyncio.wrap_future(self.executor.submit(self._load_index))
+
+    def _variant_key(self, preview, width, fmt):
+        """返回变体的缓存文件名（不含扩展名）和可能的扩展名"""
+        kind = "-".join(part for part in (f"w{width}" if width else None, fmt) if part)
+        return self.cache_name(preview, kind), (fmt,) if fmt else ("jpg", "png")
+
+    async def _variant(self, preview, width, fmt, wait):
+        """查找或生成一个变体；wait为False时只在后台生成，本次返回None"""
+        await self.ensure_loaded()
+        base, exts = self._variant_key(preview, width, fmt)
+        if base in self._passthrough:
+            return preview
+        cached = self._cached(base, exts)
+        if cached is not None:
+            self.hits += 1
+            return self._describe(preview, *cached)
+        self.misses += 1
+        future = self._submit(base, self._render, preview, width, fmt, base)
+        if not wait:
+            return None
+        cached = await asyncio.wrap_future(future)
+        if cached is None:
+            return preview
+        return self._describe(preview, *cached)
+
+    async def variant(self, preview, width=None, fmt=None):
+        """返回要发送的图片描述（与ChapterStore.preview_file结构相同）
+
+        缩略图在第一次请求时同步生成；WebP/AVIF转码在后台生成，完成前先返回
+        未转码的图片，已缓存的变体只查内存索引，不访问磁盘。
+        """
+        if fmt is not None:
+            result = await self._variant(preview, width, fmt, wait=False)
+            if result is not None:
+                return result
+        if width:
+            return await self._variant(preview, width, None, wait=True)
+        return preview
+
+    def _render_sprite(self, paths, tile_width, tile_height, fmt, mtime_ns, base):
+        """把缩略图按网格拼成一张精灵图（在图像线程池中执行），返回 (文件名, 文件大小)
+
+        每个图块按比例缩放并居中裁剪到固定大小。
+        """
+        from PIL import Image, ImageOps
+
+        width, height, offsets = sprite_layout(len(paths), tile_width, tile_height)
+        sheet = Image.new("RGB", (width, height), (40, 40, 40))
+        for path, offset in zip(paths, offsets):
+            with Image.open(path) as img:
+                tile = ImageOps.fit(img.convert("RGB"), (tile_width, tile_height), Image.LANCZOS)
+            sheet.paste(tile, offset)
+        if fmt is not None:
+            name = f"{base}.{fmt}"
+            size = self._write(name, sheet, fmt.upper(), mtime_ns, quality=PREVIEW_QUALITY)
+        else:
+            name = f"{base}.jpg"
+            size = self._write(name, sheet, "JPEG", mtime_ns, quality=THUMBNAIL_JPEG_QUALITY, optimize=True)
+        self._add(name, size)
+        return name, size
+
+    def prebuild(self, preview, width=None, fmt=None):
+        """提交一个变体的生成任务（预热时调用），已缓存或不需要生成时返回None，否则返回Future"""
+        self._load_index()
+        base, exts = self._variant_key(preview, width, fmt)
+        if base in self._passthrough or self._cached(base, exts) is not None:
+            return None
+        return self._submit(base, self._render, preview, width, fmt, base)
+
+    async def sprite(self, previews, tile_width, tile_height, fmt=None):
+        """用缓存的缩略图生成精灵图
+
+        previews为 [(chapter_id, 预览图描述)]，返回精灵图文件名、尺寸和每个章节的
+        图块位置。相同的章节、预览图和尺寸只生成一次。
+        """
+        thumbs = await asyncio.gather(*(self.variant(preview, tile_width) for _, preview in previews))
+        key = "|".join([f"sprite-{tile_width}x{tile_height}-{fmt}"] + [f"{cid}:{p['etag']}" for cid, p in previews])
+        base = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        cached = self._cached(base, (fmt or "jpg",))
+        if cached is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            mtime_ns = max(p["mtime_ns"] for _, p in previews)
+            paths = [thumb["path"] for thumb in thumbs]
+            cached = await asyncio.wrap_future(
+                self._submit(base, self._render_sprite, paths, tile_width, tile_height, fmt, mtime_ns, base)
+            )
+        width, height, offsets = sprite_layout(len(previews), tile_width, tile_height)
+        return {
+            "name": cached[0],
+            "size": cached[1],
+            "width": width,
+            "height": height,
+            "tiles": {cid: {"x": x, "y": y, "w": tile_width, "h": tile_height}
+                      for (cid, _), (x, y) in zip(previews, offsets)},
+        }
+
+    def sprite_file(self, name):
+        """按文件名查找已生成的精灵图，返回 (路径, Content-Type)，不存在（或已被淘汰）时返回None"""
+        base, _, ext = name.partition(".")
+        if len(base) != 40 or ext not in CONTENT_TYPES or self._cached(base, (ext,)) is None:
+            return None
+        return os.path.join(self.cache_dir, name), CONTENT_TYPES[ext]
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "size": self._size,
+                "max_size": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "executor": self.executor.stats(),
+            }
+
+
+class PlaceholderCache:
+    """没有预览图的章节使用的默认预览图
+
+    按 (章节ID, 字体) 缓存编码好的PNG，超过数量上限时按LRU淘汰。
+    """
+
+    def __init__(self, max_entries=PLACEHOLDER_CACHE_ENTRIES, font_path=PLACEHOLDER_FONT):
+        self.max_entries = max_entries
+        self.font_path = font_path
+        self._font = None
+        self._lock = threading.Lock()
+        # (章节ID, 字体) -> (PNG字节, ETag)
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _load_font(self):
+        from PIL import ImageFont
+
+        if self._font is None:
+            font = None
+            if self.font_path:
+                try:
+                    font = ImageFont.truetype(self.font_path, 20)
+                except Exception as e:
+                    print(f"[LearningCenter] 加载默认预览图字体出错 {self.font_path}: {e}")
+            self._font = font or ImageFont.load_default()
+        return self._font
+
+    def lookup(self, chapter_id):
+        """查找已生成的默认预览图，返回 (PNG字节, ETag)，没有时返回None"""
+        with self._lock:
+            entry = self._entries.get((chapter_id, self.font_path))
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end((chapter_id, self.font_path))
+            self.hits += 1
+            return entry
+
+    def render(self, chapter_id):
+        """生成（并缓存）默认预览图，返回 (PNG字节, ETag)"""
+        from PIL import Image, ImageDraw
+        import io
+
+        key = (chapter_id, self.font_path)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None:
+            return entry
+
+        # 创建一个简单的图像，显示章节ID
+        font = self._load_font()
+        img = Image.new('RGB', (400, 300), color=(73, 109, 137))
+        d = ImageDraw.Draw(img)
+        d.text((10, 10), f"Chapter: {chapter_id}", fill=(255, 255, 0), font=font)
+        d.text((10, 50), "No preview available", fill=(255, 255, 0), font=font)
+
+        # 转换为字节
+        img_byte_arr = io.BytesIO()
+        img.save(img_byte_arr, format='PNG')
+        body = img_byte_arr.getvalue()
+        entry = (body, f'"{hashlib.sha1(body).hexdigest()[:16]}"')
+
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+# 预览图接口共用的缩略图缓存
+preview_cache = PreviewCache()
+# 默认预览图缓存
+placeholder_cache = PlaceholderCache()
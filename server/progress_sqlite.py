@@ -0,0 +1,297 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from .progress_store import DEFAULT_ACHIEVEMENTS, chapter_model
+
+# 连接池中保留的连接数
+SQLITE_POOL_SIZE = int(os.environ.get("LEARNINGCENTER_SQLITE_POOL", "4"))
+# 数据库被锁时的等待时间（毫秒）
+SQLITE_BUSY_TIMEOUT_MS = 5000
+
+# namespace为用户标识，默认用户为空字符串；completed_at只在完成章节时记录，
+# 从JSON导入或整体保存时新增的章节没有真实的完成时间，为NULL
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS completed_chapters (
+    namespace TEXT NOT NULL DEFAULT '',
+    chapter_id TEXT NOT NULL,
+    model TEXT,
+    completed_at REAL,
+    PRIMARY KEY (namespace, chapter_id)
+);
+CREATE INDEX IF NOT EXISTS idx_completed_model ON completed_chapters (namespace, model);
+CREATE TABLE IF NOT EXISTS progress_fields (
+    namespace TEXT NOT NULL DEFAULT '',
+    name TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (namespace, name)
+);
+CREATE TABLE IF NOT EXISTS achievements (
+    namespace TEXT NOT NULL DEFAULT '',
+    data TEXT NOT NULL,
+    PRIMARY KEY (namespace)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class SQLiteDatabase:
+    """一个SQLite数据库文件及其连接池，所有用户的进度存储共用"""
+
+    def __init__(self, db_file, pool_size=SQLITE_POOL_SIZE):
+        self.db_file = db_file
+        self._pool = queue.LifoQueue(maxsize=max(1, pool_size))
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_file, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000,
+                               isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """从连接池取出一个连接，用完放回；池满时关闭多余的连接"""
+        self.ensure_schema()
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            yield conn
+        except BaseException:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            try:
+                self._pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    @contextmanager
+    def transaction(self):
+        """写事务，BEGIN IMMEDIATE避免多个写入者之间的死锁"""
+        with self.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            yield conn
+            conn.execute("COMMIT")
+
+    def ensure_schema(self):
+        if self._schema_ready:
+            return
+        with self._schema_lock:
+            if self._schema_ready:
+                return
+            os.makedirs(os.path.dirname(self.db_file), exist_ok=True)
+            conn = self._connect()
+            try:
+                conn.executescript(SCHEMA)
+            finally:
+                conn.close()
+            self._schema_ready = True
+
+    def close(self):
+        """关闭连接池中的所有连接"""
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+# 每个数据库文件只创建一个连接池
+_databases = {}
+_databases_lock = threading.Lock()
+
+
+def get_database(db_file, pool_size=SQLITE_POOL_SIZE):
+    with _databases_lock:
+        db = _databases.get(db_file)
+        if db is None:
+            db = _databases[db_file] = SQLiteDatabase(db_file, pool_size)
+        return db
+
+
+class SQLiteProgressStore:
+    """基于SQLite的用户进度存储，接口与ProgressStore一致
+
+    数据库使用WAL模式，读取不会被写入阻塞；连接放在连接池中复用。已完成章节
+    每章一行，完成、取消完成等事件只修改受影响的行，并保留每个章节的完成时间；
+    完成数量、某个模型下的完成章节等查询走索引，不需要读出全部进度。
+    首次启动时自动导入已有的progress.json和hidden_achievements.json。
+    每个用户对应一个namespace，共用同一个数据库和连接池。
+    """
+
+    backend = "sqlite"
+
+    def __init__(self, db_file, json_store=None, namespace="", pool_size=SQLITE_POOL_SIZE):
+        self.db_file = db_file
+        self.json_store = json_store
+        self.namespace = namespace
+        self._db = get_database(db_file, pool_size)
+        self._connection = self._db.connection
+        self._transaction = self._db.transaction
+
+    def _import_marker(self):
+        return f"json_imported:{self.namespace}" if self.namespace else "json_imported"
+
+    def initialize(self, create=True):
+        """首次访问时调用：导入该用户JSON文件中的进度（只导入一次）
+
+        create为False时，没有JSON文件的用户不写入任何内容。
+        """
+        with self._connection() as conn:
+            imported = conn.execute("SELECT value FROM meta WHERE name = ?", (self._import_marker(),)).fetchone()
+        if imported is None and (create or self._has_json()):
+            self.import_json()
+
+    def _has_json(self):
+        store = self.json_store
+        return store is not None and any(
+            os.path.exists(path) for path in (store.progress_file, store.journal_file, store.achievements_file))
+
+    def import_json(self):
+        """一次性导入progress.json（含未合并的日志）和hidden_achievements.json
+
+        原JSON文件保留不动，可以随时切换回json后端。
+        """
+        progress = {"completed_chapters": {}, "favorites": []}
+        achievements = None
+        if self.json_store is not None:
+            progress = self.json_store.load()
+            progress.setdefault("favorites", [])
+            if os.path.exists(self.json_store.achievements_file):
+                try:
+                    achievements = self.json_store.load_achievements()
+                except Exception as e:
+                    print(f"[LearningCenter] 导入隐藏成就记录失败: {e}")
+        with self._transaction() as conn:
+            self._write_progress(conn, progress)
+            if achievements is not None:
+                self._write_achievements(conn, achievements)
+            conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)",
+                         (self._import_marker(), str(time.time())))
+        user = f"用户 {self.namespace} 的" if self.namespace else ""
+        print(f"[LearningCenter] 已将{user} {len(progress['completed_chapters'])} 个已完成章节导入SQLite进度库: {self.db_file}")
+
+    def _write_progress(self, conn, progress):
+        """按差异写入进度：只删除和插入发生变化的章节，已有章节保留原来的完成时间"""
+        ns = self.namespace
+        completed = {chapter_id for chapter_id, done in progress.get("completed_chapters", {}).items() if done}
+        stored = {row[0] for row in conn.execute(
+            "SELECT chapter_id FROM completed_chapters WHERE namespace = ?", (ns,))}
+        conn.executemany("DELETE FROM completed_chapters WHERE namespace = ? AND chapter_id = ?",
+                         [(ns, chapter_id) for chapter_id in stored - completed])
+        conn.executemany(
+            "INSERT OR IGNORE INTO completed_chapters (namespace, chapter_id, model, completed_at) VALUES (?, ?, ?, NULL)",
+            [(ns, chapter_id, chapter_model(chapter_id)) for chapter_id in sorted(completed - stored)])
+        conn.execute("DELETE FROM progress_fields WHERE namespace = ?", (ns,))
+        conn.executemany(
+            "INSERT INTO progress_fields (namespace, name, value) VALUES (?, ?, ?)",
+            [(ns, name, json.dumps(value, ensure_ascii=False))
+             for name, value in progress.items() if name != "completed_chapters"])
+
+    def _write_achievements(self, conn, data):
+        conn.execute("INSERT OR REPLACE INTO achievements (namespace, data) VALUES (?, ?)",
+                     (self.namespace, json.dumps(data, ensure_ascii=False)))
+
+    def load(self):
+        """返回完整的进度字典，格式与progress.json相同"""
+        with self._connection() as conn:
+            rows = conn.execute("SELECT chapter_id FROM completed_chapters WHERE namespace = ?",
+                                (self.namespace,)).fetchall()
+            fields = conn.execute("SELECT name, value FROM progress_fields WHERE namespace = ?",
+                                  (self.namespace,)).fetchall()
+        progress = {name: json.loads(value) for name, value in fields}
+        progress["completed_chapters"] = {row[0]: True for row in rows}
+        return progress
+
+    def save(self, progress):
+        """整体替换进度"""
+        with self._transaction() as conn:
+            self._write_progress(conn, progress)
+
+    def append(self, event):
+        """应用一条进度事件，只修改受影响的行"""
+        self.append_many([event])
+
+    def append_many(self, events):
+        """在一个事务中依次应用多条进度事件；完成时间使用事件中的ts（没有时为当前时间）"""
+        if not events:
+            return
+        ns = self.namespace
+        now = time.time()
+        with self._transaction() as conn:
+            for event in events:
+                op = event.get("op")
+                completed_at = event.get("ts", now)
+                if op == "complete":
+                    chapter_id = event["chapter_id"]
+                    conn.execute(
+                        "INSERT OR REPLACE INTO completed_chapters (namespace, chapter_id, model, completed_at) "
+                        "VALUES (?, ?, ?, ?)", (ns, chapter_id, chapter_model(chapter_id), completed_at))
+                elif op == "complete_many":
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO completed_chapters (namespace, chapter_id, model, completed_at) "
+                        "VALUES (?, ?, ?, ?)", [(ns, chapter_id, chapter_model(chapter_id), completed_at)
+                                                for chapter_id in event["chapter_ids"]])
+                elif op == "uncomplete":
+                    conn.execute("DELETE FROM completed_chapters WHERE namespace = ? AND chapter_id = ?",
+                                 (ns, event["chapter_id"]))
+                elif op == "reset":
+                    conn.execute("DELETE FROM completed_chapters WHERE namespace = ?", (ns,))
+                else:
+                    raise ValueError(f"Unknown progress event: {op}")
+
+    def compact(self):
+        """把WAL合并回数据库文件"""
+        with self._connection() as conn:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def journal_size(self):
+        return 0
+
+    def completed_count(self):
+        """已完成的章节数，走主键索引，不读出全部进度"""
+        with self._connection() as conn:
+            return conn.execute("SELECT COUNT(*) FROM completed_chapters WHERE namespace = ?",
+                                (self.namespace,)).fetchone()[0]
+
+    def completed_in_model(self, model):
+        """某个模型目录下已完成的章节ID列表，走(namespace, model)索引"""
+        with self._connection() as conn:
+            rows = conn.execute(
+                "SELECT chapter_id FROM completed_chapters WHERE namespace = ? AND model IS ? ORDER BY chapter_id",
+                (self.namespace, model)).fetchall()
+        return [row[0] for row in rows]
+
+    def load_achievements(self):
+        """读取隐藏成就记录"""
+        with self._connection() as conn:
+            row = conn.execute("SELECT data FROM achievements WHERE namespace = ?", (self.namespace,)).fetchone()
+        return json.loads(row[0] if row else json.dumps(DEFAULT_ACHIEVEMENTS))
+
+    def save_achievements(self, data):
+        """保存隐藏成就记录"""
+        with self._transaction() as conn:
+            self._write_achievements(conn, data)
+
+    def namespaces(self):
+        """数据库中有进度记录的所有用户"""
+        with self._connection() as conn:
+            rows = conn.execute("SELECT DISTINCT namespace FROM completed_chapters").fetchall()
+        return sorted({self.namespace, ""} | {row[0] for row in rows})
+
+    def close(self):
+        self._db.close()
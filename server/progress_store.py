@@ -0,0 +1,256 @@
+import json
+import os
+import threading
+import time
+
+# 日志条目超过该数量时合并到progress.json
+PROGRESS_JOURNAL_MAX_ENTRIES = int(os.environ.get("LEARNINGCENTER_JOURNAL_COMPACT", "200"))
+# 进度存储后端: json(默认) / sqlite
+PROGRESS_BACKEND = os.environ.get("LEARNINGCENTER_PROGRESS_BACKEND", "json").lower()
+
+# 非默认用户的进度文件所在的子目录
+USERS_DIR_NAME = "users"
+
+# 隐藏成就记录的默认内容
+DEFAULT_ACHIEVEMENTS = {"opai_styles_used": [], "unlocked_achievements": []}
+
+
+def _fsync_dir(directory):
+    """同步目录项，保证重命名在断电后仍然有效（Windows上不支持，直接跳过）"""
+    if os.name != "posix":
+        return
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def atomic_write_json(file_path, data, encoding="utf-8"):
+    """原子地写入JSON文件：先写临时文件并fsync，再重命名覆盖原文件
+
+    写入过程中崩溃时原文件保持不变。
+    """
+    directory = os.path.dirname(file_path)
+    tmp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "w", encoding=encoding) as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    _fsync_dir(directory)
+
+
+def chapter_model(chapter_id):
+    """章节所属的模型目录，旧式章节返回None"""
+    model, sep, _ = chapter_id.partition("/")
+    return model if sep else None
+
+
+def apply_progress_event(progress, event):
+    """把一条日志事件应用到进度字典上
+
+    事件只包含"设置/删除/清空"三种操作，对已经包含这些事件的进度重复应用
+    结果不变，因此合并过程中崩溃也不会出错。complete_many在一条事件中完成
+    多个章节，整条事件要么全部生效要么全部不生效。
+    """
+    op = event.get("op")
+    completed = progress.setdefault("completed_chapters", {})
+    if op == "complete":
+        completed[event["chapter_id"]] = True
+    elif op == "complete_many":
+        for chapter_id in event["chapter_ids"]:
+            completed[chapter_id] = True
+    elif op == "uncomplete":
+        completed.pop(event["chapter_id"], None)
+    elif op == "reset":
+        completed.clear()
+    else:
+        raise ValueError(f"Unknown progress event: {op}")
+    return progress
+
+
+class ProgressStore:
+    """用户进度的持久化存储
+
+    progress.json保存快照，每次整体写入都通过临时文件+fsync+重命名完成；
+    完成章节等小改动只向progress.journal追加一行，读取时在快照上重放日志，
+    日志条目过多时合并到快照中。
+    """
+
+    backend = "json"
+
+    def __init__(self, progress_file, journal_max_entries=PROGRESS_JOURNAL_MAX_ENTRIES, namespace=""):
+        self.progress_file = progress_file
+        self.namespace = namespace
+        self.journal_file = os.path.join(os.path.dirname(progress_file), "progress.journal")
+        self.achievements_file = os.path.join(os.path.dirname(progress_file), "hidden_achievements.json")
+        self.journal_max_entries = journal_max_entries
+        self._lock = threading.RLock()
+        self._journal_entries = None
+
+    def initialize(self, create=True):
+        """首次访问时调用：创建进度文件（create为True时），或把上次运行留下的日志合并到进度文件"""
+        progress = self.load()
+        if not os.path.exists(self.progress_file):
+            if not create:
+                return
+            os.makedirs(os.path.dirname(self.progress_file), exist_ok=True)
+            progress.setdefault("favorites", [])
+            self.save(progress)
+            print(f"[LearningCenter] 创建用户进度文件: {self.progress_file}")
+        elif self.journal_size():
+            self.save(progress)
+
+    def _read_snapshot(self):
+        if not os.path.exists(self.progress_file):
+            return {"completed_chapters": {}}
+        try:
+            with open(self.progress_file, "r", encoding="utf-8-sig") as f:
+                progress = json.load(f)
+            if not isinstance(progress, dict):
+                raise ValueError("progress is not an object")
+            return progress
+        except Exception as e:
+            # 不直接覆盖损坏的文件，改名保留以便手工恢复
+            backup = f"{self.progress_file}.corrupt-{time.strftime('%Y%m%d%H%M%S')}"
+            print(f"[LearningCenter] 警告: 用户进度文件损坏 ({e})，已备份为 {backup}")
+            try:
+                os.replace(self.progress_file, backup)
+            except OSError as e2:
+                print(f"[LearningCenter] 备份损坏的用户进度文件失败: {e2}")
+            return {"completed_chapters": {}}
+
+    def _read_journal(self):
+        events = []
+        if not os.path.exists(self.journal_file):
+            return events
+        with open(self.journal_file, "r", encoding="utf-8") as f:
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    # 追加时崩溃可能留下不完整的最后一行
+                    print(f"[LearningCenter] 忽略进度日志第 {line_no} 行的不完整记录")
+        return events
+
+    def load(self):
+        """读取快照并重放日志，返回完整的进度字典"""
+        with self._lock:
+            progress = self._read_snapshot()
+            events = self._read_journal()
+            for event in events:
+                try:
+                    apply_progress_event(progress, event)
+                except (KeyError, ValueError) as e:
+                    print(f"[LearningCenter] 忽略无效的进度日志记录 {event}: {e}")
+            self._journal_entries = len(events)
+            progress.setdefault("completed_chapters", {})
+            return progress
+
+    def save(self, progress):
+        """整体写入进度快照，并清空已经包含在快照中的日志"""
+        with self._lock:
+            os.makedirs(os.path.dirname(self.progress_file), exist_ok=True)
+            atomic_write_json(self.progress_file, progress, encoding="utf-8-sig")
+            if os.path.exists(self.journal_file):
+                os.remove(self.journal_file)
+            self._journal_entries = 0
+
+    def append(self, event):
+        """向日志追加一条事件（O(1)），日志过长时合并到快照"""
+        self.append_many([event])
+
+    def append_many(self, events):
+        """一次写入多条事件（只fsync一次），事件中没有ts时使用当前时间"""
+        if not events:
+            return
+        with self._lock:
+            os.makedirs(os.path.dirname(self.journal_file), exist_ok=True)
+            now = time.time()
+            lines = "".join(json.dumps(dict({"ts": now}, **event), ensure_ascii=False) + "\n" for event in events)
+            with open(self.journal_file, "a", encoding="utf-8") as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+            if self._journal_entries is None:
+                self._journal_entries = len(self._read_journal())
+            else:
+                self._journal_entries += len(events)
+            if self._journal_entries >= self.journal_max_entries:
+                self.compact()
+
+    def compact(self):
+        """把日志合并到快照中"""
+        with self._lock:
+            self.save(self.load())
+
+    def journal_size(self):
+        with self._lock:
+            if self._journal_entries is None:
+                self._journal_entries = len(self._read_journal())
+            return self._journal_entries
+
+    def completed_count(self):
+        """已完成的章节数"""
+        return len(self.load()["completed_chapters"])
+
+    def completed_in_model(self, model):
+        """某个模型目录下已完成的章节ID列表"""
+        return sorted(cid for cid in self.load()["completed_chapters"] if chapter_model(cid) == model)
+
+    def load_achievements(self):
+        """读取隐藏成就记录"""
+        with self._lock:
+            if not os.path.exists(self.achievements_file):
+                return json.loads(json.dumps(DEFAULT_ACHIEVEMENTS))
+            with open(self.achievements_file, "r", encoding="utf-8") as f:
+                return json.load(f)
+
+    def save_achievements(self, data):
+        """保存隐藏成就记录"""
+        with self._lock:
+            os.makedirs(os.path.dirname(self.achievements_file), exist_ok=True)
+            atomic_write_json(self.achievements_file, data)
+
+    def namespaces(self):
+        """磁盘上有进度文件的所有用户（默认用户为空字符串）"""
+        users_dir = os.path.join(os.path.dirname(self.progress_file), USERS_DIR_NAME)
+        if self.namespace or not os.path.isdir(users_dir):
+            return [""]
+        return [""] + sorted(name for name in os.listdir(users_dir) if os.path.isdir(os.path.join(users_dir, name)))
+
+    def close(self):
+        pass
+
+
+def create_progress_store(progress_dir, backend=None, namespace=""):
+    """按配置创建某个用户的进度存储，sqlite后端首次访问时会导入该用户已有的JSON进度
+
+    默认用户使用progress_dir下的文件，其他用户的JSON文件放在 users/<用户>/ 子目录，
+    sqlite后端所有用户共用progress.db。
+    """
+    backend = (backend or PROGRESS_BACKEND).lower()
+    user_dir = os.path.join(progress_dir, USERS_DIR_NAME, namespace) if namespace else progress_dir
+    json_store = ProgressStore(os.path.join(user_dir, "progress.json"), namespace=namespace)
+    if backend == "sqlite":
+        from .progress_sqlite import SQLiteProgressStore
+        return SQLiteProgressStore(os.path.join(progress_dir, "progress.db"), json_store=json_store, namespace=namespace)
+    if backend != "json":
+        print(f"[LearningCenter] 未知的进度存储后端 {backend}，使用json")
+    return json_store
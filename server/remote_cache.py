@@ -0,0 +1,315 @@
+import atexit
+import hashlib
+import json
+import os
+import threading
+import time
+
+from .progress_store import atomic_write_json
+
+# 远程图像缓存的容量上限
+REMOTE_CACHE_MAX_BYTES = int(float(os.environ.get("LEARNINGCENTER_REMOTE_CACHE_MB", "512")) * 1024 * 1024)
+# 淘汰策略: lru（最久未使用）/ lfu（使用次数最少）
+REMOTE_CACHE_POLICY = os.environ.get("LEARNINGCENTER_REMOTE_CACHE_POLICY", "lru").lower()
+# 索引文件在内存中修改后，最多延迟多久写盘（秒）
+INDEX_SAVE_INTERVAL = 5
+INDEX_FILE_NAME = "index.json"
+INDEX_VERSION = 1
+
+
+def cache_key(url):
+    """URL对应的缓存键（与早期版本的缓存文件名一致）"""
+    return hashlib.md5(url.encode()).hexdigest()
+
+
+class RemoteImageCache:
+    """远程图像的磁盘缓存
+
+    缓存文件的信息（URL、大小、最近访问时间、访问次数、ETag、Last-Modified、
+    Content-Type、源站的max-age）保存在内存索引中，并定期写入index.json；查询缓存
+    状态时不再遍历和stat缓存目录。总大小超过上限时按LRU或LFU淘汰。
+    """
+
+    def __init__(self, cache_dir, max_bytes=REMOTE_CACHE_MAX_BYTES, policy=REMOTE_CACHE_POLICY):
+        if policy not in ("lru", "lfu"):
+            print(f"[RemoteImageLoader] 未知的缓存淘汰策略 {policy}，使用lru")
+            policy = "lru"
+        self.cache_dir = cache_dir
+        self.index_file = os.path.join(cache_dir, INDEX_FILE_NAME)
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self._entries = None
+        self._size = 0
+        self._lock = threading.RLock()
+        self._dirty = False
+        self._last_save = 0.0
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "revalidated": 0}
+
+    def _load_locked(self, keep_file=None):
+        """首次使用时读取索引，并与缓存目录对齐（只在启动后执行一次）
+
+        keep_file为正在放入缓存的临时文件，不会被当作残留的临时文件删除。
+        """
+        if self._entries is not None:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        entries = {}
+        try:
+            with open(self.index_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == INDEX_VERSION:
+                entries = data.get("entries", {})
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"[RemoteImageLoader] 缓存索引损坏，重新建立: {e}")
+
+        files = {name for name in os.listdir(self.cache_dir) if name != INDEX_FILE_NAME}
+        # 删除文件已经不存在的索引项
+        entries = {key: entry for key, entry in entries.items() if entry.get("file") in files}
+        # 收录没有索引的缓存文件（例如早期版本留下的 <md5>.png）；临时文件直接删除
+        indexed = {entry["file"] for entry in entries.values()}
+        for name in files - indexed:
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith(".tmp"):
+                if name == keep_file:
+                    continue
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            key = os.path.splitext(name)[0]
+            entries[key] = {
+                "url": None, "file": name, "size": st.st_size, "content_type": None,
+                "etag": None, "last_modified": None, "max_age": None,
+                "fetched_at": st.st_mtime, "last_access": st.st_mtime, "hits": 0,
+            }
+            self._dirty = True
+        self._entries = entries
+        self._size = sum(entry["size"] for entry in entries.values())
+        self._evict_locked()
+
+    def _save_locked(self, force=False):
+        if not self._dirty:
+            return
+        now = time.time()
+        if not force and now - self._last_save < INDEX_SAVE_INTERVAL:
+            return
+        try:
+            atomic_write_json(self.index_file, {"version": INDEX_VERSION, "entries": self._entries})
+            self._dirty = False
+            self._last_save = now
+        except Exception as e:
+            print(f"[RemoteImageLoader] 写入缓存索引出错: {e}")
+
+    def save(self):
+        """把索引的修改写入磁盘"""
+        with self._lock:
+            if self._entries is not None:
+                self._save_locked(force=True)
+
+    def file_path(self, url, ext):
+        return os.path.join(self.cache_dir, f"{cache_key(url)}{ext}")
+
+    def get(self, url):
+        """返回URL的缓存项（副本，包含文件路径），没有缓存时返回None
+
+        查询本身不计入命中统计：缓存项可能已过期需要重新下载，由调用方在确定
+        是否使用缓存后调用record_hit()或record_miss()。
+        """
+        key = cache_key(url)
+        with self._lock:
+            self._load_locked()
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry["url"] is None:
+                entry["url"] = url
+                self._dirty = True
+            return dict(entry, key=key, path=os.path.join(self.cache_dir, entry["file"]))
+
+    def record_hit(self, url):
+        """缓存项被直接使用（没有重新下载）时调用，记录访问时间和访问次数"""
+        key = cache_key(url)
+        with self._lock:
+            self._load_locked()
+            self._stats["hits"] += 1
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry["last_access"] = time.time()
+                entry["hits"] += 1
+                self._dirty = True
+                self._save_locked()
+
+    def record_miss(self):
+        """没有可用的缓存、需要从源站下载时调用"""
+        with self._lock:
+            self._stats["misses"] += 1
+
+    def is_fresh(self, entry, timeout):
+        """缓存项是否仍在有效期内
+
+        源站通过Cache-Control给出了max-age时以它为准，否则使用节点的cache_timeout；
+        cache_timeout为0时总是重新验证。
+        """
+        if timeout <= 0:
+            return False
+        lifetime = entry.get("max_age")
+        if lifetime is None:
+            lifetime = timeout
+        return time.time() - entry["fetched_at"] < lifetime
+
+    def can_revalidate(self, entry):
+        """缓存项是否带有可用于条件请求的ETag或Last-Modified"""
+        return bool(entry.get("etag") or entry.get("last_modified"))
+
+    def refresh(self, url, etag=None, last_modified=None, max_age=None):
+        """源站返回304时调用：缓存内容不变，重新开始计算有效期
+
+        304响应没有带Cache-Control时保留原来的max-age。
+        """
+        key = cache_key(url)
+        with self._lock:
+            self._load_locked()
+            entry = self._entries.get(key)
+            if entry is None:
+                return False
+            entry["fetched_at"] = time.time()
+            if max_age is not None:
+                entry["max_age"] = max_age
+            if etag:
+                entry["etag"] = etag
+            if last_modified:
+                entry["last_modified"] = last_modified
+            self._stats["revalidated"] += 1
+            self._dirty = True
+            self._save_locked()
+            return True
+
+    def put(self, url, tmp_path, ext, content_type=None, etag=None, last_modified=None, max_age=None):
+        """把已写好的临时文件放入缓存，并记录到索引中，返回缓存文件路径"""
+        key = cache_key(url)
+        file_name = f"{key}{ext}"
+        path = os.path.join(self.cache_dir, file_name)
+        size = os.path.getsize(tmp_path)
+        with self._lock:
+            self._load_locked(keep_file=os.path.basename(tmp_path))
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= old["size"]
+                if old["file"] != file_name:
+                    self._remove_file(old["file"])
+            os.replace(tmp_path, path)
+            now = time.time()
+            self._entries[key] = {
+                "url": url, "file": file_name, "size": size, "content_type": content_type,
+                "etag": etag, "last_modified": last_modified, "max_age": max_age,
+                "fetched_at": now, "last_access": now, "hits": old["hits"] if old else 0,
+            }
+            self._size += size
+            self._dirty = True
+            self._evict_locked(keep=key)
+            self._save_locked()
+        return path
+
+    def remove(self, url):
+        """删除URL的缓存（例如缓存文件损坏时）"""
+        key = cache_key(url)
+        with self._lock:
+            self._load_locked()
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._size -= entry["size"]
+                self._remove_file(entry["file"])
+                self._dirty = True
+                self._save_locked()
+
+    def clear(self):
+        """删除所有缓存文件，返回删除的文件数"""
+        with self._lock:
+            self._load_locked()
+            count = 0
+            for entry in self._entries.values():
+                if self._remove_file(entry["file"]):
+                    count += 1
+            self._entries.clear()
+            self._size = 0
+            self._dirty = True
+            self._save_locked(force=True)
+            return count
+
+    def _remove_file(self, file_name):
+        try:
+            os.remove(os.path.join(self.cache_dir, file_name))
+            return True
+        except OSError:
+            return False
+
+    def _victim_locked(self, keep):
+        candidates = [(key, entry) for key, entry in self._entries.items() if key != keep]
+        if not candidates:
+            return None
+        if self.policy == "lfu":
+            return min(candidates, key=lambda item: (item[1]["hits"], item[1]["last_access"]))[0]
+        return min(candidates, key=lambda item: item[1]["last_access"])[0]
+
+    def _evict_locked(self, keep=None):
+        # 至少保留刚加入的缓存项
+        while self._size > self.max_bytes:
+            key = self._victim_locked(keep)
+            if key is None:
+                break
+            entry = self._entries.pop(key)
+            self._size -= entry["size"]
+            self._remove_file(entry["file"])
+            self._stats["evictions"] += 1
+            self._dirty = True
+
+    def entries(self, limit=100):
+        """按最近访问时间倒序返回缓存项"""
+        with self._lock:
+            self._load_locked()
+            items = sorted(self._entries.values(), key=lambda entry: entry["last_access"], reverse=True)
+            return [dict(entry) for entry in items[:limit]]
+
+    def stats(self):
+        with self._lock:
+            self._load_locked()
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return dict(
+                self._stats,
+                entries=len(self._entries),
+                size=self._size,
+                max_size=self.max_bytes,
+                policy=self.policy,
+                hit_rate=round(self._stats["hits"] / lookups, 3) if lookups else 0.0,
+            )
+
+
+# 每个缓存目录只创建一个缓存管理器
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_remote_cache(cache_dir):
+    with _caches_lock:
+        cache = _caches.get(cache_dir)
+        if cache is None:
+            cache = _caches[cache_dir] = RemoteImageCache(cache_dir)
+        return cache
+
+
+def _save_all():
+    with _caches_lock:
+        caches = list(_caches.values())
+    for cache in caches:
+        cache.save()
+
+
+# 退出时写入尚未保存的索引
+atexit.register(_save_all)
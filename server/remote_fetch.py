@@ -0,0 +1,140 @@
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# 连接池缓存的主机数
+REMOTE_POOL_HOSTS = int(os.environ.get("LEARNINGCENTER_REMOTE_POOL_HOSTS", "16"))
+# 每个主机最多同时保持的连接数，超出的请求等待空闲连接
+REMOTE_POOL_PER_HOST = int(os.environ.get("LEARNINGCENTER_REMOTE_POOL_PER_HOST", "4"))
+# 连接和读取超时（秒）
+REMOTE_TIMEOUT = float(os.environ.get("LEARNINGCENTER_REMOTE_TIMEOUT", "10"))
+# 建立连接失败时的重试次数
+REMOTE_CONNECT_RETRIES = 2
+
+DEFAULT_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+
+
+def parse_max_age(headers):
+    """从Cache-Control中解析缓存有效期（秒）
+
+    no-cache/no-store视为0（每次都需要重新验证），没有max-age时返回None。
+    """
+    value = headers.get("Cache-Control")
+    if not value:
+        return None
+    max_age = None
+    for directive in value.lower().split(","):
+        name, _, arg = directive.strip().partition("=")
+        if name in ("no-cache", "no-store"):
+            return 0
+        if name == "max-age":
+            try:
+                max_age = max(0, int(arg.strip().strip('"')))
+            except ValueError:
+                pass
+    return max_age
+
+
+class FetchResult:
+    """一次下载的结果：状态码、响应体和响应头"""
+
+    __slots__ = ("url", "status", "content", "headers")
+
+    def __init__(self, url, status, content, headers):
+        self.url = url
+        self.status = status
+        self.content = content
+        self.headers = headers
+
+
+class RemoteFetcher:
+    """共享的HTTP客户端
+
+    所有下载共用一个requests.Session，连接按主机放在连接池中复用（keep-alive），
+    每个主机的并发连接数有上限。同一URL（相同请求头）的并发请求只下载一次，
+    其他调用方等待并共享同一个结果。
+    """
+
+    def __init__(self, pool_hosts=REMOTE_POOL_HOSTS, pool_per_host=REMOTE_POOL_PER_HOST):
+        self._pool_hosts = pool_hosts
+        self._pool_per_host = pool_per_host
+        self._session = None
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._stats = {"requests": 0, "shared": 0, "errors": 0, "bytes": 0, "seconds": 0.0}
+
+    def session(self):
+        with self._lock:
+            if self._session is None:
+                session = requests.Session()
+                retry = Retry(total=REMOTE_CONNECT_RETRIES, connect=REMOTE_CONNECT_RETRIES, read=0, status=0,
+                              backoff_factor=0.2, allowed_methods=["GET"])
+                adapter = HTTPAdapter(pool_connections=self._pool_hosts, pool_maxsize=self._pool_per_host,
+                                      pool_block=True, max_retries=retry)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                session.headers["User-Agent"] = DEFAULT_USER_AGENT
+                self._session = session
+            return self._session
+
+    def _download(self, url, headers, timeout):
+        start = time.time()
+        response = self.session().get(url, headers=headers, timeout=timeout)
+        try:
+            response.raise_for_status()
+            result = FetchResult(response.url, response.status_code, response.content, response.headers)
+        finally:
+            response.close()
+        with self._lock:
+            self._stats["bytes"] += len(result.content)
+            self._stats["seconds"] += time.time() - start
+        return result
+
+    def fetch(self, url, headers=None, timeout=REMOTE_TIMEOUT):
+        """下载URL，返回FetchResult；HTTP错误和网络错误抛出requests.RequestException
+
+        条件请求（If-None-Match/If-Modified-Since）命中时返回状态码304、响应体为空的结果。
+        """
+        headers = dict(headers or {})
+        key = (url, tuple(sorted(headers.items())))
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+                self._stats["requests"] += 1
+            else:
+                self._stats["shared"] += 1
+        if not owner:
+            # 已有相同的下载在进行，等待它的结果
+            return future.result()
+
+        try:
+            result = self._download(url, headers, timeout)
+        except BaseException as e:
+            with self._lock:
+                self._stats["errors"] += 1
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, inflight=len(self._inflight),
+                         pool_hosts=self._pool_hosts, pool_per_host=self._pool_per_host)
+        stats["seconds"] = round(stats["seconds"], 3)
+        return stats
+
+
+# 进程内共享的HTTP客户端
+remote_fetcher = RemoteFetcher()
@@ -2,16 +2,30 @@ import os
 import folder_paths
 import requests
 import urllib.parse
-import hashlib
+import threading
 import time
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw, ImageFont, ImageOps
 import io
-import json
 import aiohttp
 import asyncio
 from server import PromptServer
 import numpy as np
 import torch
+from concurrent.futures import ThreadPoolExecutor
+
+from .remote_fetch import parse_max_age, remote_fetcher
+from .remote_cache import get_remote_cache
+
+
+# 缓存文件的扩展名，按下载内容的实际格式确定
+IMAGE_EXTENSIONS = {"JPEG": ".jpg", "PNG": ".png", "WEBP": ".webp", "GIF": ".gif", "BMP": ".bmp", "TIFF": ".tif"}
+
+
+def image_extension(fmt):
+    """PIL图像格式对应的文件扩展名"""
+    if not fmt:
+        return ".img"
+    return IMAGE_EXTENSIONS.get(fmt, "." + fmt.lower())
 
 
 class RemoteImageLoader:
@@ -39,22 +53,8 @@ class RemoteImageLoader:
         self.output_dir = folder_paths.get_temp_directory()
         self.cache_dir = os.path.join(self.output_dir, "remote_cache")
         os.makedirs(self.cache_dir, exist_ok=True)
-    
-    def get_cache_path(self, url):
-        """获取URL对应的缓存路径"""
-        # 使用URL的MD5哈希作为文件名
-        url_hash = hashlib.md5(url.encode()).hexdigest()
-        return os.path.join(self.cache_dir, f"{url_hash}.png")
-    
-    def is_cache_valid(self, cache_path, timeout):
-        """检查缓存是否有效"""
-        if not os.path.exists(cache_path):
-            return False
-        
-        # 检查文件修改时间
-        file_time = os.path.getmtime(cache_path)
-        current_time = time.time()
-        return (current_time - file_time) < timeout
+        # 带索引和容量上限的缓存管理器，同一目录的所有节点共用
+        self.cache = get_remote_cache(self.cache_dir)
     
     def create_error_image(self, error_message):
         """创建表示错误的图像"""
@@ -95,70 +95,228 @@ class RemoteImageLoader:
         img_tensor = torch.from_numpy(img_np)[None,]
         return img_tensor
     
-    def load_image(self, url, cache_timeout=3600, api_key=""):
-        try:
-            # 清理URL
-            url = url.strip()
-            if not url.startswith(('http://', 'https://')):
-                raise ValueError("URL必须以http://或https://开头")
-            
-            # 获取缓存路径
-            cache_path = self.get_cache_path(url)
-            
-            # 检查缓存
-            if self.is_cache_valid(cache_path, cache_timeout):
+    def image_to_tensor(self, img):
+        """把RGB图像转换为ComfyUI格式的张量 [1,H,W,3]"""
+        img_np = np.array(img).astype(np.float32) / 255.0
+        return torch.from_numpy(img_np)[None,]
+    
+    def fetch_image(self, url, cache_timeout=3600, api_key=""):
+        """获取远程图像（缓存有效时直接读取缓存），返回RGB模式的PIL图像
+        
+        URL格式错误时抛出ValueError，网络错误抛出requests.RequestException。
+        """
+        # 清理URL
+        url = url.strip()
+        if not url.startswith(('http://', 'https://')):
+            raise ValueError("URL必须以http://或https://开头")
+        
+        # 检查缓存（缓存信息来自内存索引，不访问磁盘）
+        entry = self.cache.get(url)
+        if entry is not None and self.cache.is_fresh(entry, cache_timeout):
+            img = self._open_cached(url, entry)
+            if img is not None:
+                self.cache.record_hit(url)
                 print(f"[RemoteImageLoader] 从缓存加载图像: {url}")
-                img = Image.open(cache_path)
-                img = img.convert("RGB")
-                img_np = np.array(img).astype(np.float32) / 255.0
-                img_tensor = torch.from_numpy(img_np)[None,]
-                return (img_tensor, )
-            
-            # 设置请求头
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-            }
-            if api_key:
-                headers["Authorization"] = f"Bearer {api_key}"
-            
-            # 下载图像
+                return img
+            entry = None
+        
+        # 设置请求头（User-Agent由共享的HTTP客户端设置）
+        headers = {}
+        if api_key:
+            headers["Authorization"] = f"Bearer {api_key}"
+        
+        # 缓存已过期但有ETag/Last-Modified时发送条件请求，内容未变化时源站只返回304
+        response = None
+        if entry is not None and self.cache.can_revalidate(entry):
+            conditional = dict(headers)
+            if entry.get("etag"):
+                conditional["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                conditional["If-Modified-Since"] = entry["last_modified"]
+            print(f"[RemoteImageLoader] 重新验证远程图像: {url}")
+            response = remote_fetcher.fetch(url, conditional)
+            if response.status == 304:
+                self.cache.refresh(url, response.headers.get("ETag"), response.headers.get("Last-Modified"),
+                                   parse_max_age(response.headers))
+                img = self._open_cached(url, entry)
+                if img is not None:
+                    self.cache.record_hit(url)
+                    print(f"[RemoteImageLoader] 远程图像未变化，继续使用缓存: {url}")
+                    return img
+                # 缓存文件已不可用，下面重新完整下载
+                response = None
+        
+        # 下载图像：复用连接池中的连接，同一URL的并发请求只下载一次
+        if response is None:
             print(f"[RemoteImageLoader] 下载远程图像: {url}")
-            response = requests.get(url, headers=headers, stream=True, timeout=10)
-            response.raise_for_status()
-            
-            # 从响应中读取图像
-            img = Image.open(io.BytesIO(response.content))
-            
-            # 保存到缓存
-            img.save(cache_path, "PNG")
-            
-            # 转换为RGB模式
-            img = img.convert("RGB")
-            
-            # 转换为ComfyUI格式的张量
-            img_np = np.array(img).astype(np.float32) / 255.0
-            img_tensor = torch.from_numpy(img_np)[None,]
-            
-            return (img_tensor, )
+            response = remote_fetcher.fetch(url, headers)
+        
+        # 使用了源站返回的新内容，记为缓存未命中
+        self.cache.record_miss()
+        
+        # 识别图像格式（只读取文件头），不是图像时抛出OSError，不写入缓存
+        img = Image.open(io.BytesIO(response.content))
         
-        except requests.RequestException as e:
+        # 原样保存下载的字节，不重新编码（先写临时文件再放入缓存，共享同一次下载的并发调用不会写坏缓存文件）
+        tmp_path = self.cache.file_path(url, f".{threading.get_ident()}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(response.content)
+        content_type = Image.MIME.get(img.format) or response.headers.get("Content-Type")
+        self.cache.put(url, tmp_path, image_extension(img.format), content_type=content_type,
+                       etag=response.headers.get("ETag"), last_modified=response.headers.get("Last-Modified"),
+                       max_age=parse_max_age(response.headers))
+        
+        # 解码并转换为RGB模式
+        return img.convert("RGB")
+    
+    def _open_cached(self, url, entry):
+        """读取缓存文件，文件丢失或损坏时删除该缓存项并返回None"""
+        try:
+            img = Image.open(entry["path"])
+            return img.convert("RGB")
+        except OSError as e:
+            print(f"[RemoteImageLoader] 缓存文件无法读取，重新下载: {e}")
+            self.cache.remove(url)
+            return None
+    
+    def describe_error(self, e):
+        """打印错误日志并返回显示在错误图像上的消息"""
+        if isinstance(e, requests.RequestException):
             print(f"[RemoteImageLoader] 网络请求错误: {e}")
             if hasattr(e, 'response') and e.response is not None:
                 status_code = e.response.status_code
-                error_msg = f"网络错误 ({status_code}): {str(e)}"
-            else:
-                error_msg = f"网络错误: {str(e)}"
-            return (self.create_error_image(error_msg), )
-            
-        except ValueError as e:
+                return f"网络错误 ({status_code}): {str(e)}"
+            return f"网络错误: {str(e)}"
+        if isinstance(e, ValueError):
             print(f"[RemoteImageLoader] URL格式错误: {e}")
-            return (self.create_error_image(f"URL格式错误: {str(e)}"), )
+            return f"URL格式错误: {str(e)}"
+        print(f"[RemoteImageLoader] 加载远程图像出错: {e}")
+        import traceback
+        traceback.print_exception(type(e), e, e.__traceback__)
+        return f"未知错误: {str(e)}"
+    
+    def load_image(self, url, cache_timeout=3600, api_key=""):
+        try:
+            img = self.fetch_image(url, cache_timeout, api_key)
             
+            # 转换为ComfyUI格式的张量
+            return (self.image_to_tensor(img), )
+        
         except Exception as e:
-            print(f"[RemoteImageLoader] 加载远程图像出错: {e}")
-            import traceback
-            traceback.print_exc()
-            return (self.create_error_image(f"未知错误: {str(e)}"), )
+            return (self.create_error_image(self.describe_error(e)), )
+
+
+# 批量加载时同时下载的图像数
+REMOTE_BATCH_WORKERS = int(os.environ.get("LEARNINGCENTER_REMOTE_BATCH_WORKERS", "8"))
+# 单个批次最多加载的图像数
+REMOTE_BATCH_MAX_IMAGES = 256
+
+# 批量加载共用的下载线程池，限制同时进行的下载数
+_batch_executor = None
+_batch_executor_lock = threading.Lock()
+
+
+def get_batch_executor():
+    global _batch_executor
+    with _batch_executor_lock:
+        if _batch_executor is None:
+            _batch_executor = ThreadPoolExecutor(max_workers=max(1, REMOTE_BATCH_WORKERS),
+                                                 thread_name_prefix="LearningCenterRemoteImage")
+        return _batch_executor
+
+
+def parse_url_list(text):
+    """解析每行一个的URL列表，忽略空行和以#开头的注释行"""
+    urls = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line and not line.startswith("#"):
+            urls.append(line)
+    return urls
+
+
+def fit_image(img, width, height, fit):
+    """把图像调整到指定尺寸
+    
+    resize: 直接拉伸；pad: 保持比例缩放后居中，四周填充黑色；crop: 保持比例缩放后居中裁剪。
+    """
+    if img.size == (width, height):
+        return img
+    if fit == "resize":
+        return img.resize((width, height), Image.LANCZOS)
+    if fit == "crop":
+        return ImageOps.fit(img, (width, height), Image.LANCZOS)
+    scale = min(width / img.width, height / img.height)
+    resized = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.LANCZOS)
+    canvas = Image.new("RGB", (width, height), (0, 0, 0))
+    canvas.paste(resized, ((width - resized.width) // 2, (height - resized.height) // 2))
+    return canvas
+
+
+class RemoteImageBatchLoader(RemoteImageLoader):
+    """批量加载远程图像的节点，每行一个URL，输出一个批次的图像"""
+    
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "urls": ("STRING", {"default": "https://example.com/image1.jpg\nhttps://example.com/image2.jpg", "multiline": True}),
+                "fit": (["pad", "resize", "crop"], {"default": "pad", "description": "尺寸不一致时的处理方式：pad填充、resize拉伸、crop裁剪"}),
+            },
+            "optional": {
+                "width": ("INT", {"default": 0, "min": 0, "max": 8192, "step": 8, "description": "输出宽度，0表示使用第一张图像的尺寸"}),
+                "height": ("INT", {"default": 0, "min": 0, "max": 8192, "step": 8, "description": "输出高度，0表示使用第一张图像的尺寸"}),
+                "cache_timeout": ("INT", {"default": 3600, "min": 0, "max": 86400, "step": 60}),
+                "api_key": ("STRING", {"default": ""}),
+            }
+        }
+    
+    RETURN_TYPES = ("IMAGE", )
+    RETURN_NAMES = ("images", )
+    OUTPUT_NODE = True
+    FUNCTION = "load_images"
+    CATEGORY = "学习中心"
+    
+    def _fetch_or_error(self, url, cache_timeout, api_key):
+        try:
+            return self.fetch_image(url, cache_timeout, api_key), None
+        except Exception as e:
+            return None, self.describe_error(e)
+    
+    def load_images(self, urls, fit="pad", width=0, height=0, cache_timeout=3600, api_key=""):
+        url_list = parse_url_list(urls)
+        if not url_list:
+            return (self.create_error_image("URL列表为空"), )
+        if len(url_list) > REMOTE_BATCH_MAX_IMAGES:
+            return (self.create_error_image(f"URL数量超过上限 {REMOTE_BATCH_MAX_IMAGES}"), )
+        
+        # 并行下载，同时进行的下载数受线程池大小限制；结果保持输入顺序
+        start = time.time()
+        executor = get_batch_executor()
+        futures = [executor.submit(self._fetch_or_error, url, cache_timeout, api_key) for url in url_list]
+        results = [future.result() for future in futures]
+        
+        # 输出尺寸：未指定时使用第一张成功加载的图像的尺寸，只指定一边时按其比例计算另一边
+        first = next((img for img, _ in results if img is not None), None)
+        base_w, base_h = first.size if first is not None else (480, 240)
+        if not width and not height:
+            width, height = base_w, base_h
+        elif not width:
+            width = max(1, round(base_w * height / base_h))
+        elif not height:
+            height = max(1, round(base_h * width / base_w))
+        
+        # 加载失败的URL在对应位置放置错误图像，批次大小与URL数量一致
+        images = []
+        failed = 0
+        for img, error in results:
+            if img is None:
+                failed += 1
+                img = Image.fromarray((self.create_error_image(error)[0].numpy() * 255).astype(np.uint8))
+            images.append(np.array(fit_image(img, width, height, fit)).astype(np.float32) / 255.0)
+        
+        print(f"[RemoteImageLoader] 批量加载 {len(url_list)} 张图像（失败 {failed} 张），输出尺寸 {width}x{height}，耗时 {time.time() - start:.2f}s")
+        return (torch.from_numpy(np.stack(images)), )
 
 
 class ProgressIndicator:
@@ -388,15 +546,18 @@ class ChapterInfoDisplay:
     def get_chapter_info(self, chapter_id):
         """获取并显示章节信息"""
         try:
-            # 获取当前模块路径
-            current_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+            from .chapter_store import get_chapter_store
+            from .learningcenter import load_user_progress
             
-            # 模板目录
-            templates_dir = os.path.join(current_dir, "templates")
-            chapter_dir = os.path.join(templates_dir, chapter_id)
+            # 通过章节解析层获取章节记录，与学习中心接口共用同一份缓存
+            store = get_chapter_store()
+            try:
+                record = store.resolve(chapter_id)
+            except ValueError:
+                record = None
             
-            # 检查目录是否存在
-            if not os.path.isdir(chapter_dir):
+            # 检查章节是否存在
+            if record is None:
                 error_msg = f"找不到章节: {chapter_id}"
                 print(f"[ChapterInfoDisplay] {error_msg}")
                 error_image = self.generate_info_image(
@@ -407,47 +568,9 @@ class ChapterInfoDisplay:
                 )
                 return (error_image, "错误")
             
-            # 读取元数据
-            metadata_path = os.path.join(chapter_dir, "metadata.json")
-            if not os.path.exists(metadata_path):
-                error_msg = f"章节缺少元数据文件: {chapter_id}"
-                print(f"[ChapterInfoDisplay] {error_msg}")
-                error_image = self.generate_info_image(
-                    "元数据错误", 
-                    error_msg, 
-                    "unknown", 
-                    False
-                )
-                return (error_image, "元数据错误")
-            
-            # 安全读取JSON文件的辅助函数
-            def safe_read_json(file_path):
-                try:
-                    with open(file_path, "r", encoding="utf-8-sig") as f:
-                        return json.load(f)
-                except Exception as e:
-                    print(f"[ChapterInfoDisplay] 读取文件出错 {file_path}: {e}")
-                    try:
-                        with open(file_path, "r", encoding="gbk") as f:
-                            return json.load(f)
-                    except Exception as e2:
-                        print(f"[ChapterInfoDisplay] 第二次尝试读取文件也失败 {file_path}: {e2}")
-                        return None
-
-            try:
-                metadata = safe_read_json(metadata_path)
-                if metadata is None:
-                    error_msg = "无法读取元数据文件"
-                    print(f"[ChapterInfoDisplay] {error_msg}")
-                    error_image = self.generate_info_image(
-                        "元数据读取错误", 
-                        error_msg, 
-                        "unknown", 
-                        False
-                    )
-                    return (error_image, "元数据读取错误")
-            except Exception as e:
-                error_msg = f"读取元数据出错: {str(e)}"
+            metadata = record["metadata"]
+            if not metadata:
+                error_msg = "无法读取元数据文件"
                 print(f"[ChapterInfoDisplay] {error_msg}")
                 error_image = self.generate_info_image(
                     "元数据读取错误", 
@@ -458,14 +581,7 @@ class ChapterInfoDisplay:
                 return (error_image, "元数据读取错误")
             
             # 检查用户进度
-            user_progress_dir = os.path.join(current_dir, "user_progress")
-            progress_file = os.path.join(user_progress_dir, "progress.json")
-            completed = False
-            
-            if os.path.exists(progress_file):
-                progress = safe_read_json(progress_file)
-                if progress:
-                    completed = progress.get("completed_chapters", {}).get(chapter_id, False)
+            completed = store.is_completed(record, load_user_progress())
             
             # 提取信息
             title = metadata.get("title", "未知标题")
@@ -473,10 +589,8 @@ class ChapterInfoDisplay:
             difficulty = metadata.get("difficulty", "beginner")
             
             # 章节统计信息
-            exercise_path = os.path.join(chapter_dir, "exercise.json")
-            answer_path = os.path.join(chapter_dir, "answer.json")
-            has_exercise = os.path.exists(exercise_path)
-            has_answer = os.path.exists(answer_path)
+            has_exercise = record["has_exercise"]
+            has_answer = record["has_answer"]
             
             stats = f"练习: {'有' if has_exercise else '无'} | 答案: {'有' if has_answer else '无'}"
             if "estimated_time" in metadata:
@@ -511,14 +625,9 @@ class ChapterInfoDisplay:
 async def clear_cache(request):
     try:
         loader = RemoteImageLoader()
-        cache_dir = loader.cache_dir
         
-        # 统计删除的文件数
-        count = 0
-        for file in os.listdir(cache_dir):
-            if file.endswith(".png"):
-                os.remove(os.path.join(cache_dir, file))
-                count += 1
+        # 删除缓存文件并清空索引，返回删除的文件数
+        count = loader.cache.clear()
         
         return aiohttp.web.json_response({"success": True, "message": f"已清除{count}个缓存文件"})
     
@@ -532,36 +641,28 @@ async def clear_cache(request):
 async def cache_status(request):
     try:
         loader = RemoteImageLoader()
-        cache_dir = loader.cache_dir
-        
-        # 统计缓存文件
-        files = []
-        total_size = 0
-        
-        for file in os.listdir(cache_dir):
-            if file.endswith(".png"):
-                file_path = os.path.join(cache_dir, file)
-                file_size = os.path.getsize(file_path)
-                file_time = os.path.getmtime(file_path)
-                
-                files.append({
-                    "file": file,
-                    "size": file_size,
-                    "time": file_time,
-                    "time_str": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(file_time))
-                })
-                
-                total_size += file_size
-        
-        # 按时间排序
-        files.sort(key=lambda x: x["time"], reverse=True)
+        cache = loader.cache
+        
+        # 缓存文件信息直接来自索引，不遍历缓存目录；按最近访问时间排序
+        stats = cache.stats()
+        files = [{
+            "file": entry["file"],
+            "url": entry["url"],
+            "size": entry["size"],
+            "content_type": entry["content_type"],
+            "hits": entry["hits"],
+            "time": entry["last_access"],
+            "time_str": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry["last_access"]))
+        } for entry in cache.entries(100)]  # 只返回最近的100个文件
         
         return aiohttp.web.json_response({
             "success": True,
-            "cache_count": len(files),
-            "cache_size": total_size,
-            "cache_size_mb": round(total_size / (1024 * 1024), 2),
-            "files": files[:100]  # 只返回最近的100个文件
+            "cache_count": stats["entries"],
+            "cache_size": stats["size"],
+            "cache_size_mb": round(stats["size"] / (1024 * 1024), 2),
+            "cache": stats,
+            "files": files,
+            "http": remote_fetcher.stats()
         })
     
     except Exception as e:
@@ -572,6 +673,7 @@ async def cache_status(request):
 # 注册节点
 NODE_CLASS_MAPPINGS = {
     "RemoteImageLoader": RemoteImageLoader,
+    "RemoteImageBatchLoader": RemoteImageBatchLoader,
     "ProgressIndicator": ProgressIndicator,
     "ChapterInfoDisplay": ChapterInfoDisplay
 }
@@ -579,6 +681,7 @@ NODE_CLASS_MAPPINGS = {
 # 节点显示名称
 NODE_DISPLAY_NAME_MAPPINGS = {
     "RemoteImageLoader": "远程图像加载器",
+    "RemoteImageBatchLoader": "远程图像批量加载器",
     "ProgressIndicator": "进度指示器",
     "ChapterInfoDisplay": "章节信息显示"
 } 
\ No newline at end of file
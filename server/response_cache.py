@@ -0,0 +1,202 @@
+import gzip
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from aiohttp import web
+
+from .io_executor import run_io
+
+# 尝试导入brotli，如果失败则只提供gzip压缩
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    brotli = None
+    BROTLI_AVAILABLE = False
+
+# 响应缓存的容量上限
+RESPONSE_CACHE_MAX_BYTES = int(float(os.environ.get("LEARNINGCENTER_RESPONSE_CACHE_MB", "64")) * 1024 * 1024)
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("LEARNINGCENTER_RESPONSE_CACHE_ENTRIES", "512"))
+# 小于该大小的响应不压缩
+MIN_COMPRESS_SIZE = 1024
+
+
+def parse_accept(header):
+    """解析Accept/Accept-Encoding这类请求头，返回客户端可接受（q>0）的取值集合"""
+    accepted = set()
+    for part in (header or "").split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            accepted.add(name)
+    return accepted
+
+
+class EncodedResponse(web.Response):
+    """响应体已经是压缩后的字节
+
+    ComfyUI开启响应压缩（--enable-compress-response-body）时，中间件会对JSON响应
+    调用enable_compression()，aiohttp会再压缩一次并覆盖Content-Encoding，这里忽略该调用。
+    """
+
+    def enable_compression(self, force=None, strategy=None):
+        pass
+
+
+class _CachedBody:
+    """一份序列化后的响应体及其压缩版本"""
+
+    __slots__ = ("key", "generation", "body", "variants")
+
+    def __init__(self, key, generation, body):
+        self.key = key
+        self.generation = generation
+        self.body = body
+        # 编码 -> 压缩后的字节
+        self.variants = {}
+
+    @property
+    def size(self):
+        return len(self.body) + sum(len(v) for v in self.variants.values())
+
+
+class ResponseCache:
+    """按 (接口, 规范化的查询参数, 目录版本号) 缓存序列化后的JSON响应
+
+    同时缓存gzip和brotli压缩结果，按Accept-Encoding选择；超过容量时按LRU淘汰。
+    put()和首次压缩比较耗时，路由中通过I/O线程池调用，不在事件循环中执行。
+    """
+
+    def __init__(self, max_bytes=RESPONSE_CACHE_MAX_BYTES, max_entries=RESPONSE_CACHE_MAX_ENTRIES):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._size = 0
+        self._generation = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, generation, data):
+        """序列化并缓存数据，返回缓存条目"""
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        entry = _CachedBody(key, generation, body)
+        with self._lock:
+            # 版本号变化后旧条目不会再被命中，直接清理
+            if self._generation != generation:
+                self._drop_locked(lambda e: e.generation != generation)
+                self._generation = generation
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= old.size
+            if entry.size <= self.max_bytes:
+                self._entries[key] = entry
+                self._size += entry.size
+                self._evict_locked()
+        return entry
+
+    def variant(self, entry, encoding):
+        """获取指定编码的响应体，首次请求时压缩并缓存"""
+        if encoding == "identity":
+            return entry.body
+        data = entry.variants.get(encoding)
+        if data is not None:
+            return data
+        if encoding == "br":
+            data = brotli.compress(entry.body, quality=5)
+        else:
+            data = gzip.compress(entry.body, compresslevel=6)
+        with self._lock:
+            if encoding not in entry.variants:
+                entry.variants[encoding] = data
+                if self._entries.get(entry.key) is entry:
+                    self._size += len(data)
+                    self._evict_locked()
+        return data
+
+    def _drop_locked(self, predicate):
+        for key in [k for k, e in self._entries.items() if predicate(e)]:
+            self._size -= self._entries.pop(key).size
+
+    def _evict_locked(self):
+        while self._entries and (self._size > self.max_bytes or len(self._entries) > self.max_entries):
+            _, entry = self._entries.popitem(last=False)
+            self._size -= entry.size
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "size": self._size,
+                "max_size": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "brotli": BROTLI_AVAILABLE,
+            }
+
+    async def respond(self, request, entry, headers=None):
+        """按Accept-Encoding选择压缩版本并构造响应，尚未压缩过时在I/O线程池中压缩
+
+        压缩后的版本与原始JSON的字节不同，ETag改为弱ETag。
+        """
+        headers = dict(headers or {})
+        headers["Vary"] = "Accept-Encoding"
+        encoding = "identity"
+        if len(entry.body) >= MIN_COMPRESS_SIZE:
+            accepted = parse_accept(request.headers.get("Accept-Encoding"))
+            if BROTLI_AVAILABLE and "br" in accepted:
+                encoding = "br"
+            elif "gzip" in accepted:
+                encoding = "gzip"
+        if encoding == "identity":
+            return web.Response(body=entry.body, content_type="application/json", charset="utf-8", headers=headers)
+        
+        body = entry.variants.get(encoding)
+        if body is None:
+            body = await run_io(self.variant, entry, encoding)
+        headers["Content-Encoding"] = encoding
+        etag = headers.get("ETag")
+        if etag and not etag.startswith("W/"):
+            headers["ETag"] = "W/" + etag
+        return EncodedResponse(body=body, content_type="application/json", charset="utf-8", headers=headers)
+
+
+# 章节接口共用的响应缓存
+response_cache = ResponseCache()
+
+
+def cache_key(endpoint, request, generation, *extra):
+    """生成缓存键：接口名 + 排序后的查询参数 + 目录版本号"""
+    return (endpoint, tuple(sorted(request.query.items())), generation) + extra
@@ -0,0 +1,303 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+from .progress_store import apply_progress_event, chapter_model
+
+# 标识用户的请求头，ComfyUI多用户模式下前端会发送comfy-user
+USER_HEADER = os.environ.get("LEARNINGCENTER_USER_HEADER", "comfy-user")
+# 内存中最多保留的用户数，超出后淘汰最久未访问的用户（默认用户始终保留）
+USER_CACHE_SIZE = int(os.environ.get("LEARNINGCENTER_USER_CACHE_SIZE", "64"))
+# 进度修改后延迟写盘的时间（秒），期间的多次修改合并为一次写入；0表示每次修改立即写入
+PROGRESS_FLUSH_DELAY = float(os.environ.get("LEARNINGCENTER_PROGRESS_FLUSH_DELAY", "1"))
+
+# 默认用户的namespace，对应原来的全局进度文件
+DEFAULT_NAMESPACE = ""
+# ComfyUI单用户模式下的用户名也视为默认用户
+_DEFAULT_USERS = ("", "default")
+_SAFE_NAMESPACE = re.compile(r"^[A-Za-z0-9_-][A-Za-z0-9_.-]{0,63}$")
+
+
+def normalize_namespace(user):
+    """把用户标识转换为可以作为目录名的namespace，不安全的标识使用其哈希值"""
+    user = (user or "").strip()
+    if user in _DEFAULT_USERS:
+        return DEFAULT_NAMESPACE
+    if _SAFE_NAMESPACE.match(user):
+        return user
+    return "u-" + hashlib.sha1(user.encode("utf-8")).hexdigest()[:16]
+
+
+def request_namespace(request):
+    """从请求头中获取用户的namespace，没有该请求头时为默认用户"""
+    return normalize_namespace(request.headers.get(USER_HEADER))
+
+
+class UserProgress:
+    """单个用户的进度和隐藏成就
+
+    首次访问时从存储中加载，之后的读取都在内存中完成，不再访问磁盘。修改时用新的
+    字典替换内存中的进度（写时复制），读取方拿到的字典不会被其他线程修改。
+
+    设置了on_dirty时采用延迟写入：修改只更新内存并通知on_dirty，事件暂存在
+    内存中，由flush()一次性追加到存储（只写入变化的部分）。没有设置on_dirty时
+    每次修改立即写入存储。
+
+    所有修改都在该用户的锁内完成"读取-修改-替换"，同一用户的并发修改（多个
+    浏览器标签页、节点执行线程）不会互相覆盖；每次修改后version加一。
+    """
+
+    def __init__(self, namespace, store, on_dirty=None):
+        self.namespace = namespace
+        self.store = store
+        self._progress = None
+        self._achievements = None
+        self._progress_dirty = False
+        # 尚未写入存储的进度事件，flush()时一次性追加到存储
+        self._pending_events = []
+        self._achievements_dirty = False
+        self._on_dirty = on_dirty
+        self._lock = threading.RLock()
+        self.version = 0
+
+    @property
+    def lock(self):
+        """该用户的可重入锁，需要把判断和修改放在一起时使用"""
+        return self._lock
+
+    @property
+    def loaded(self):
+        return self._progress is not None
+
+    @property
+    def dirty(self):
+        return self._progress_dirty or self._achievements_dirty
+
+    def progress(self):
+        """返回进度字典，调用方不能修改返回值"""
+        progress = self._progress
+        if progress is None:
+            with self._lock:
+                if self._progress is None:
+                    self._progress = self.store.load()
+                progress = self._progress
+        return progress
+
+    def apply(self, event):
+        """应用一条进度事件（complete/uncomplete/reset）"""
+        with self._lock:
+            progress = dict(self.progress())
+            progress["completed_chapters"] = dict(progress.get("completed_chapters", {}))
+            apply_progress_event(progress, event)
+            if self._on_dirty is None:
+                self.store.append(event)
+            else:
+                # 记录事件发生的时间，延迟写入时仍保留真实的完成时间
+                self._pending_events.append(dict(event, ts=time.time()))
+                self._progress_dirty = True
+            self._progress = progress
+            self.version += 1
+        self._notify_dirty()
+
+    def completed_count(self):
+        """已完成的章节数；进度还没有加载时直接查询存储，不加载整个进度"""
+        with self._lock:
+            if self._progress is None:
+                return self.store.completed_count()
+            return len(self._progress.get("completed_chapters", {}))
+
+    def completed_in_model(self, model):
+        """某个模型目录下已完成的章节ID列表；进度还没有加载时直接查询存储"""
+        with self._lock:
+            if self._progress is None:
+                return self.store.completed_in_model(model)
+            return sorted(cid for cid in self._progress.get("completed_chapters", {})
+                          if chapter_model(cid) == model)
+
+    def achievements(self):
+        """返回隐藏成就记录的副本"""
+        with self._lock:
+            if self._achievements is None:
+                self._achievements = self.store.load_achievements()
+            return {key: list(value) if isinstance(value, list) else value
+                    for key, value in self._achievements.items()}
+
+    def update_achievements(self, mutator):
+        """在锁内对隐藏成就记录的副本调用mutator并保存，返回修改后的记录
+
+        隐藏成就在节点执行线程中更新，整个读取-修改-保存过程持有该用户的锁。
+        """
+        with self._lock:
+            current = self.achievements()
+            data = json.loads(json.dumps(current))
+            mutator(data)
+            if data != current:
+                self.save_achievements(data)
+            return data
+
+    def save_achievements(self, data):
+        with self._lock:
+            if self._on_dirty is None:
+                self.store.save_achievements(data)
+            else:
+                self._achievements_dirty = True
+            self._achievements = data
+        self._notify_dirty()
+
+    def _notify_dirty(self):
+        if self._on_dirty is not None and self.dirty:
+            self._on_dirty(self)
+
+    def flush(self):
+        """把尚未写入的修改写入存储，返回是否有写入"""
+        with self._lock:
+            if not self.dirty:
+                return False
+            if self._progress_dirty:
+                self.store.append_many(self._pending_events)
+                self._pending_events = []
+                self._progress_dirty = False
+            if self._achievements_dirty:
+                self.store.save_achievements(self._achievements)
+                self._achievements_dirty = False
+            return True
+
+
+class UserProgressRegistry:
+    """按namespace管理用户进度，按LRU在内存中保留最近访问的用户
+
+    flush_delay大于0时，修改后的用户由后台线程在flush_delay秒后统一写盘，
+    这段时间内的多次修改只写一次；有未写入修改的用户不会被淘汰。
+    """
+
+    def __init__(self, store_factory, max_users=USER_CACHE_SIZE, flush_delay=PROGRESS_FLUSH_DELAY):
+        self._store_factory = store_factory
+        self._max_users = max(1, max_users)
+        self._flush_delay = flush_delay
+        self._users = OrderedDict()
+        # 已被LRU淘汰但仍被其他线程引用的用户，再次访问时复用同一个对象，避免同一用户出现两份进度
+        self._live = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+        self._create_lock = threading.Lock()
+        self._flush_cond = threading.Condition(self._lock)
+        self._dirty_users = {}
+        self._flush_thread = None
+        self._evictions = 0
+        self._flushes = 0
+        self._flush_errors = 0
+
+    def _lookup_locked(self, namespace):
+        user = self._users.get(namespace)
+        if user is None:
+            user = self._live.get(namespace)
+            if user is None:
+                return None
+            self._users[namespace] = user
+            self._evict_locked()
+        self._users.move_to_end(namespace)
+        return user
+
+    def get(self, namespace=DEFAULT_NAMESPACE):
+        with self._lock:
+            user = self._lookup_locked(namespace)
+            if user is not None:
+                return user
+
+        # 创建和初始化存储可能需要读写磁盘，不持有LRU的锁；同一时间只创建一个用户，
+        # 保证每个用户只初始化一次
+        with self._create_lock:
+            with self._lock:
+                user = self._lookup_locked(namespace)
+                if user is not None:
+                    return user
+            store = self._store_factory(namespace)
+            store.initialize(create=namespace == DEFAULT_NAMESPACE)
+            on_dirty = self._mark_dirty if self._flush_delay > 0 else None
+            user = UserProgress(namespace, store, on_dirty)
+            with self._lock:
+                self._users[namespace] = user
+                self._live[namespace] = user
+                self._evict_locked()
+            return user
+
+    def peek(self, namespace=DEFAULT_NAMESPACE):
+        """返回已在内存中的用户进度，不存在时返回None（不访问磁盘）"""
+        with self._lock:
+            return self._users.get(namespace)
+
+    def _evict_locked(self):
+        while len(self._users) > self._max_users:
+            victim = next((ns for ns, user in self._users.items()
+                           if ns != DEFAULT_NAMESPACE and not user.dirty and ns not in self._dirty_users), None)
+            if victim is None:
+                break
+            del self._users[victim]
+            self._evictions += 1
+
+    def _mark_dirty(self, user):
+        with self._flush_cond:
+            self._dirty_users[user.namespace] = user
+            if self._flush_thread is None:
+                self._flush_thread = threading.Thread(target=self._flush_loop, name="LearningCenterProgressFlush", daemon=True)
+                self._flush_thread.start()
+            self._flush_cond.notify()
+
+    def _flush_loop(self):
+        while True:
+            with self._flush_cond:
+                while not self._dirty_users:
+                    self._flush_cond.wait()
+            # 等待一段时间，把这期间的修改合并为一次写入
+            time.sleep(self._flush_delay)
+            self.flush()
+
+    def flush(self):
+        """立即写入所有未保存的修改，返回写入的用户数；写入失败的用户稍后重试"""
+        with self._flush_cond:
+            users = list(self._dirty_users.values())
+            self._dirty_users.clear()
+        flushed = 0
+        for user in users:
+            try:
+                if user.flush():
+                    flushed += 1
+            except Exception as e:
+                print(f"[LearningCenter] 写入用户进度出错 {user.namespace or 'default'}: {e}")
+                with self._flush_cond:
+                    self._flush_errors += 1
+                    self._dirty_users.setdefault(user.namespace, user)
+        with self._flush_cond:
+            self._flushes += flushed
+        return flushed
+
+    def namespaces(self):
+        """有进度记录的所有用户：存储中已有的用户，加上只在内存中、尚未写入的用户"""
+        stored = self.get(DEFAULT_NAMESPACE).store.namespaces()
+        with self._lock:
+            in_memory = set(self._users) | set(self._live.keys()) | set(self._dirty_users)
+        return sorted(set(stored) | in_memory)
+
+    def forget_chapter(self, chapter_id):
+        """章节被删除后，从所有用户的进度中移除该章节"""
+        for namespace in self.namespaces():
+            user = self.get(namespace)
+            if chapter_id in user.progress().get("completed_chapters", {}):
+                user.apply({"op": "uncomplete", "chapter_id": chapter_id})
+
+    def stats(self):
+        with self._lock:
+            return {
+                "users": len(self._users),
+                "max_users": self._max_users,
+                "evictions": self._evictions,
+                "header": USER_HEADER,
+                "flush_delay": self._flush_delay,
+                "pending": len(self._dirty_users),
+                "flushes": self._flushes,
+                "flush_errors": self._flush_errors
+            }
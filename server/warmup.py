@@ -0,0 +1,100 @@
+import os
+import threading
+import time
+
+from .preview_cache import parse_thumbnail_width, placeholder_cache, preview_cache, supported_formats
+
+
+def parse_warmup_widths(value):
+    """解析逗号分隔的缩略图宽度，按请求时相同的规则取到档位并去重"""
+    widths = []
+    for item in value.split(","):
+        if not item.strip():
+            continue
+        try:
+            width = parse_thumbnail_width({"w": item})
+        except ValueError as e:
+            print(f"[LearningCenter] 忽略无效的预热缩略图宽度: {e}")
+            continue
+        if width not in widths:
+            widths.append(width)
+    return widths
+
+
+# 启动预热模式: off(默认) / background（后台线程）/ block（初始化时同步完成，之后才开始接收请求）
+WARMUP_MODE = os.environ.get("LEARNINGCENTER_WARMUP", "off").lower()
+# 需要预先生成的缩略图宽度（与请求中的 ?w= 一样取到最近的档位）
+WARMUP_WIDTHS = parse_warmup_widths(os.environ.get("LEARNINGCENTER_WARMUP_WIDTHS", "256"))
+# 打印进度的间隔（章节数）
+WARMUP_LOG_EVERY = 10
+
+
+def warm_up(store, widths=None):
+    """遍历所有章节，预先生成缩略图、WebP/AVIF变体、默认预览图并读取工作流
+
+    返回各项统计；单个章节出错时记录日志并继续。
+    """
+    widths = WARMUP_WIDTHS if widths is None else widths
+    start = time.time()
+    catalog = store.catalog
+    catalog.refresh(force=True)
+    chapter_ids = [chapter["id"] for chapter in catalog.list_chapters()]
+    formats = supported_formats()
+    total = len(chapter_ids)
+    stats = {"chapters": total, "thumbnails": 0, "variants": 0, "placeholders": 0, "errors": 0}
+    print(f"[LearningCenter] 开始预热 {total} 个章节，缩略图宽度: {widths}，转码格式: {formats or '无'}")
+
+    for index, chapter_id in enumerate(chapter_ids, 1):
+        try:
+            record = catalog.get(chapter_id)
+            if record is None:
+                continue
+            store.read_workflow(record, "exercise.json")
+            preview = store.preview_file(record)
+            if preview is None:
+                placeholder_cache.render(chapter_id)
+                stats["placeholders"] += 1
+            else:
+                # 同一章节的所有变体一起提交，由图像线程池并行生成
+                tasks = [("thumbnails", preview_cache.prebuild(preview, width)) for width in widths]
+                tasks += [("variants", preview_cache.prebuild(preview, width, fmt))
+                          for fmt in formats for width in [None] + widths]
+                for kind, future in tasks:
+                    if future is not None and future.result() is not None:
+                        stats[kind] += 1
+        except Exception as e:
+            stats["errors"] += 1
+            print(f"[LearningCenter] 预热章节出错 {chapter_id}: {e}")
+        if index % WARMUP_LOG_EVERY == 0 or index == total:
+            print(f"[LearningCenter] 预热进度 {index}/{total}，已用时 {time.time() - start:.1f}s")
+
+    stats["seconds"] = round(time.time() - start, 3)
+    print(f"[LearningCenter] 预热完成，新生成缩略图 {stats['thumbnails']} 个、转码图片 {stats['variants']} 个、"
+          f"默认预览图 {stats['placeholders']} 个，出错 {stats['errors']} 个，耗时 {stats['seconds']:.1f}s")
+    return stats
+
+
+# 进程内只预热一次
+_warmup_thread = None
+_warmup_lock = threading.Lock()
+
+
+def start_warmup(store, mode=None):
+    """按配置启动预热，mode为off时不预热；返回是否启动"""
+    global _warmup_thread
+    mode = (mode or WARMUP_MODE).lower()
+    if mode in ("off", "0", "false", "no", ""):
+        return False
+    with _warmup_lock:
+        if _warmup_thread is not None:
+            return False
+        if mode == "block":
+            _warmup_thread = threading.current_thread()
+        else:
+            if mode != "background":
+                print(f"[LearningCenter] 未知的预热模式 {mode}，使用background")
+            _warmup_thread = threading.Thread(target=warm_up, args=(store,), name="LearningCenterWarmup", daemon=True)
+            _warmup_thread.start()
+            return True
+    warm_up(store)
+    return True
@@ -0,0 +1,13 @@
+import os
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_collect_directory(path, parent):
+    # 插件根目录的__init__.py会注册ComfyUI节点，测试时不作为包导入；
+    # 测试只导入server包中不依赖ComfyUI的模块
+    if str(path) == ROOT_DIR:
+        return pytest.Dir.from_parent(parent, path=path)
@@ -0,0 +1,135 @@
+import json
+import os
+import threading
+
+import pytest
+
+from server.chapter_catalog import ChapterCatalog, decode_cursor, encode_cursor
+
+
+def make_chapter(path, **metadata):
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, "metadata.json"), "w", encoding="utf-8") as f:
+        json.dump(dict({"title": os.path.basename(path)}, **metadata), f)
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    make_chapter(tmp_path / "chapter1_intro")
+    make_chapter(tmp_path / "m1" / "txt2img")
+    make_chapter(tmp_path / "m2" / "inpaint")
+    catalog = ChapterCatalog(str(tmp_path))
+    catalog.build()
+    return catalog
+
+
+def forbid_full_rescan(catalog, monkeypatch):
+    def fail():
+        raise AssertionError("unexpected full rescan")
+    monkeypatch.setattr(catalog, "_refresh_locked", fail)
+
+
+def test_build_indexes_both_layouts(catalog):
+    assert sorted(catalog._records) == ["chapter1_intro", "m1/txt2img", "m2/inpaint"]
+
+
+def test_new_workflows_refresh_only_model_dir(catalog, tmp_path, monkeypatch):
+    forbid_full_rescan(catalog, monkeypatch)
+    for i in range(5):
+        make_chapter(tmp_path / "m1" / f"wf{i}")
+        assert catalog.apply_change(str(tmp_path / "m1"))
+        catalog.apply_change(str(tmp_path / "m1" / f"wf{i}"))
+    assert len([cid for cid in catalog._records if cid.startswith("m1/")]) == 6
+
+
+def test_new_and_removed_top_dir_without_full_rescan(catalog, tmp_path, monkeypatch):
+    forbid_full_rescan(catalog, monkeypatch)
+    make_chapter(tmp_path / "m3" / "upscale")
+    assert catalog.apply_change(str(tmp_path / "m3"))
+    assert catalog.get("m3/upscale") is not None
+
+    for name in ("metadata.json",):
+        os.remove(tmp_path / "m2" / "inpaint" / name)
+    os.rmdir(tmp_path / "m2" / "inpaint")
+    os.rmdir(tmp_path / "m2")
+    assert catalog.apply_change(str(tmp_path / "m2"))
+    assert catalog.get("m2/inpaint") is None
+    assert catalog.get("m1/txt2img") is not None
+
+
+def test_templates_root_event_rescans(catalog, tmp_path):
+    make_chapter(tmp_path / "chapter2_next")
+    assert catalog.apply_change(str(tmp_path))
+    assert catalog.get("chapter2_next") is not None
+
+
+@pytest.mark.parametrize("sort", ["order", "-order", "created_at", "difficulty", "relevance"])
+def test_cursor_round_trip(catalog, sort):
+    scores = {"m1/txt2img": 2.0, "m2/inpaint": 1.5}
+    ids = list(catalog._records)
+    base = sort.lstrip("-")
+    page, last_key, has_more = catalog.page_ids(ids, base, sort.startswith("-"), scores, limit=1)
+    cursor_sort, after = decode_cursor(encode_cursor(sort, last_key))
+    assert cursor_sort == sort
+    rest, _, _ = catalog.page_ids(ids, base, sort.startswith("-"), scores, limit=10, after=after)
+    assert has_more and sorted(page + rest) == sorted(ids)
+
+
+@pytest.mark.parametrize("sort, key", [
+    ("order", ["a"]),
+    ("order", [1, 0]),
+    ("order", ["1", 0, "m1/txt2img"]),
+    ("order", [True, 0, "m1/txt2img"]),
+    ("difficulty", [0, 1, "m1/txt2img"]),
+    ("created_at", ["now", 1, 0, "m1/txt2img"]),
+    ("unknown", [1, 0, "m1/txt2img"]),
+])
+def test_cursor_with_wrong_key_is_rejected(sort, key):
+    with pytest.raises(ValueError):
+        decode_cursor(encode_cursor(sort, key))
+
+
+def test_malformed_cursor_is_rejected():
+    for cursor in ("not-base64!", encode_cursor("order", [1, 0, "x"])[:-3], "bnVsbA"):
+        with pytest.raises(ValueError):
+            decode_cursor(cursor)
+
+
+def test_get_chapter_catalog_builds_once(tmp_path, monkeypatch):
+    from server import chapter_catalog
+
+    make_chapter(tmp_path / "m1" / "txt2img")
+    monkeypatch.setattr(chapter_catalog, "_catalog", None)
+    builds = []
+    original = ChapterCatalog.build
+    monkeypatch.setattr(ChapterCatalog, "build", lambda self: builds.append(1) or original(self))
+    first = chapter_catalog.get_chapter_catalog(str(tmp_path))
+    assert chapter_catalog.get_chapter_catalog(str(tmp_path)) is first
+    assert builds == [1] and first.get("m1/txt2img") is not None
+
+
+def test_reads_do_not_wait_for_writer(catalog, tmp_path, monkeypatch):
+    make_chapter(tmp_path / "m1" / "upscale", difficulty="advanced")
+    parsing, release = threading.Event(), threading.Event()
+    original = catalog._load_record
+
+    def slow_load(*args, **kwargs):
+        parsing.set()
+        release.wait(5)
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(catalog, "_load_record", slow_load)
+    writer = threading.Thread(target=catalog.reload, args=("m1/upscale",))
+    writer.start()
+    try:
+        assert parsing.wait(5)
+        # 写入方持有锁并卡在解析中，读取方仍然立即拿到旧快照
+        assert catalog.get("m1/txt2img") is not None
+        assert catalog.get("m1/upscale") is None
+        assert len(catalog.list_chapters()) == 3
+        assert catalog.filter_ids({"difficulty": "advanced"}) == []
+    finally:
+        release.set()
+        writer.join(5)
+    assert catalog.get("m1/upscale") is not None
+    assert catalog.filter_ids({"difficulty": "advanced"}) == ["m1/upscale"]
@@ -0,0 +1,34 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from server.preview_cache import PreviewCache
+
+
+def submit_and_wait(cache, base, func):
+    cache._submit(base, func).exception()
+    # 完成回调在工作线程中执行，可能晚于exception()返回
+    deadline = time.time() + 5
+    while base in cache._pending and time.time() < deadline:
+        time.sleep(0.01)
+    assert base not in cache._pending
+
+
+def test_failed_render_is_retried(tmp_path):
+    with ThreadPoolExecutor(1) as executor:
+        cache = PreviewCache(str(tmp_path), executor=executor)
+
+        def fail():
+            raise OSError("disk full")
+
+        submit_and_wait(cache, "a", fail)
+        assert "a" not in cache._passthrough
+        calls = []
+        submit_and_wait(cache, "a", lambda: calls.append(1) or ("a.webp", 10))
+        assert calls == [1] and "a" not in cache._passthrough
+
+
+def test_source_smaller_than_width_uses_original(tmp_path):
+    with ThreadPoolExecutor(1) as executor:
+        cache = PreviewCache(str(tmp_path), executor=executor)
+        submit_and_wait(cache, "a", lambda: None)
+        assert "a" in cache._passthrough
@@ -0,0 +1,48 @@
+import json
+import sqlite3
+
+import pytest
+
+from server.progress_sqlite import SQLiteProgressStore
+from server.progress_store import create_progress_store
+
+
+def completed_at(db_file, namespace=""):
+    conn = sqlite3.connect(db_file)
+    try:
+        return dict(conn.execute("SELECT chapter_id, completed_at FROM completed_chapters WHERE namespace = ?",
+                                 (namespace,)).fetchall())
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def progress_dir(tmp_path):
+    with open(tmp_path / "progress.json", "w", encoding="utf-8") as f:
+        json.dump({"completed_chapters": {"m1/a": True, "m1/b": True}, "favorites": ["m1/a"]}, f)
+    return tmp_path
+
+
+def test_import_json_once_without_fake_timestamps(progress_dir):
+    store = create_progress_store(str(progress_dir), backend="sqlite")
+    store.initialize()
+    assert store.load() == {"completed_chapters": {"m1/a": True, "m1/b": True}, "favorites": ["m1/a"]}
+    assert completed_at(store.db_file) == {"m1/a": None, "m1/b": None}
+
+    # 再次初始化不会重复导入
+    store.append({"op": "uncomplete", "chapter_id": "m1/a"})
+    store.initialize()
+    assert store.load()["completed_chapters"] == {"m1/b": True}
+
+
+def test_save_keeps_existing_completion_times(progress_dir):
+    store = create_progress_store(str(progress_dir), backend="sqlite")
+    store.initialize()
+    store.append({"op": "complete", "chapter_id": "m2/c"})
+    before = completed_at(store.db_file)["m2/c"]
+    assert before is not None
+
+    store.save({"completed_chapters": {"m2/c": True, "m1/b": True, "m3/d": True}, "favorites": []})
+    rows = completed_at(store.db_file)
+    assert rows == {"m2/c": before, "m1/b": None, "m3/d": None}
+    assert store.load()["favorites"] == []
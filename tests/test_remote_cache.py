@@ -0,0 +1,88 @@
+import os
+import time
+
+import pytest
+
+from server.remote_cache import RemoteImageCache
+
+
+def put_bytes(cache, url, data, ext=".png", **kwargs):
+    tmp_path = cache.file_path(url, ".tmp")
+    os.makedirs(cache.cache_dir, exist_ok=True)
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    return cache.put(url, tmp_path, ext, **kwargs)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return RemoteImageCache(str(tmp_path / "remote_cache"), max_bytes=1000)
+
+
+def test_lookup_alone_is_not_a_hit(cache):
+    put_bytes(cache, "http://a/1", b"x" * 10)
+    assert cache.get("http://a/1")["size"] == 10
+    assert cache.get("http://a/2") is None
+    stats = cache.stats()
+    assert stats["hits"] == 0 and stats["misses"] == 0 and stats["hit_rate"] == 0.0
+
+    cache.record_hit("http://a/1")
+    cache.record_miss()
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 1 and stats["hit_rate"] == 0.5
+    assert cache.get("http://a/1")["hits"] == 1
+
+
+def test_lru_eviction_keeps_recently_used(cache):
+    for i in range(3):
+        put_bytes(cache, f"http://a/{i}", b"x" * 300)
+        time.sleep(0.01)
+    cache.record_hit("http://a/0")
+    put_bytes(cache, "http://a/3", b"x" * 300)
+    assert cache.get("http://a/0") is not None
+    assert cache.get("http://a/1") is None
+    assert cache.stats()["size"] <= 1000
+
+
+def test_index_is_reloaded_and_aligned_with_disk(cache, tmp_path):
+    put_bytes(cache, "http://a/1", b"x" * 10, etag='"v1"', max_age=60)
+    put_bytes(cache, "http://a/2", b"y" * 10)
+    os.remove(cache.get("http://a/2")["path"])
+    with open(os.path.join(cache.cache_dir, "orphan.png"), "wb") as f:
+        f.write(b"z" * 5)
+    with open(os.path.join(cache.cache_dir, "left.123.tmp"), "wb") as f:
+        f.write(b"t")
+    cache.save()
+
+    reloaded = RemoteImageCache(cache.cache_dir, max_bytes=1000)
+    entry = reloaded.get("http://a/1")
+    assert entry["etag"] == '"v1"' and entry["max_age"] == 60
+    assert reloaded.get("http://a/2") is None
+    assert reloaded.stats()["entries"] == 2
+    assert "left.123.tmp" not in os.listdir(cache.cache_dir)
+
+
+def test_is_fresh_prefers_origin_max_age(cache):
+    put_bytes(cache, "http://a/1", b"x", max_age=0)
+    put_bytes(cache, "http://a/2", b"x", max_age=3600)
+    put_bytes(cache, "http://a/3", b"x")
+    assert not cache.is_fresh(cache.get("http://a/1"), 3600)
+    assert cache.is_fresh(cache.get("http://a/2"), 1)
+    assert cache.is_fresh(cache.get("http://a/3"), 3600)
+    assert not cache.is_fresh(cache.get("http://a/3"), 0)
+
+
+def test_refresh_keeps_max_age_when_304_has_none(cache):
+    put_bytes(cache, "http://a/1", b"x", etag='"v1"', max_age=600)
+    fetched_at = cache.get("http://a/1")["fetched_at"]
+    time.sleep(0.01)
+    assert cache.refresh("http://a/1")
+    entry = cache.get("http://a/1")
+    assert entry["max_age"] == 600 and entry["etag"] == '"v1"'
+    assert entry["fetched_at"] > fetched_at
+
+    cache.refresh("http://a/1", etag='"v2"', max_age=5)
+    entry = cache.get("http://a/1")
+    assert entry["max_age"] == 5 and entry["etag"] == '"v2"'
+    assert cache.stats()["revalidated"] == 2
+    assert not cache.refresh("http://a/missing")
@@ -0,0 +1,122 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from server.remote_fetch import RemoteFetcher, parse_max_age
+
+
+class StandInServer:
+    """本地HTTP服务器，记录每个请求和客户端连接"""
+
+    def __init__(self, delay=0.0):
+        self.hits = []
+        self.connections = set()
+        self.delay = delay
+        self.routes = {}
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                server.hits.append((self.path, dict(self.headers)))
+                server.connections.add(self.client_address)
+                time.sleep(server.delay)
+                status, headers, body = server.routes.get(self.path, (404, {}, b""))
+                if callable(body):
+                    status, headers, body = body(self)
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def server():
+    server = StandInServer()
+    server.routes["/image"] = (200, {"Content-Type": "image/png", "ETag": '"v1"'}, b"image-bytes")
+    yield server
+    server.close()
+
+
+def test_sequential_fetches_reuse_one_connection(server):
+    fetcher = RemoteFetcher()
+    for _ in range(5):
+        result = fetcher.fetch(server.url + "/image")
+        assert result.status == 200 and result.content == b"image-bytes"
+    assert len(server.hits) == 5
+    assert len(server.connections) == 1
+    assert fetcher.stats()["bytes"] == 5 * len(b"image-bytes")
+
+
+def test_concurrent_fetches_of_one_url_are_deduplicated(server):
+    server.delay = 0.3
+    fetcher = RemoteFetcher()
+    with ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(lambda _: fetcher.fetch(server.url + "/image"), range(8)))
+    assert len(server.hits) == 1
+    assert all(result is results[0] for result in results)
+    stats = fetcher.stats()
+    assert stats["requests"] == 1 and stats["shared"] == 7 and stats["inflight"] == 0
+
+
+def test_different_headers_are_not_shared(server):
+    server.delay = 0.2
+    fetcher = RemoteFetcher()
+    with ThreadPoolExecutor(2) as executor:
+        list(executor.map(lambda key: fetcher.fetch(server.url + "/image", {"Authorization": key}), ("a", "b")))
+    assert len(server.hits) == 2
+
+
+def test_http_errors_raise_and_are_not_cached(server):
+    fetcher = RemoteFetcher()
+    with pytest.raises(requests.HTTPError):
+        fetcher.fetch(server.url + "/missing")
+    with pytest.raises(requests.HTTPError):
+        fetcher.fetch(server.url + "/missing")
+    assert len(server.hits) == 2
+    assert fetcher.stats()["errors"] == 2
+
+
+def test_conditional_request_returns_304(server):
+    def conditional(handler):
+        if handler.headers.get("If-None-Match") == '"v1"':
+            return 304, {"ETag": '"v1"', "Cache-Control": "max-age=60"}, b""
+        return 200, {"ETag": '"v1"'}, b"image-bytes"
+    server.routes["/conditional"] = (200, {}, conditional)
+    fetcher = RemoteFetcher()
+    result = fetcher.fetch(server.url + "/conditional", {"If-None-Match": '"v1"'})
+    assert result.status == 304 and result.content == b""
+    assert parse_max_age(result.headers) == 60
+
+
+@pytest.mark.parametrize("value, expected", [
+    (None, None),
+    ("public", None),
+    ("public, max-age=300", 300),
+    ('max-age="5", must-revalidate', 5),
+    ("max-age=-1", 0),
+    ("max-age=abc", None),
+    ("no-cache, max-age=300", 0),
+    ("no-store", 0),
+])
+def test_parse_max_age(value, expected):
+    assert parse_max_age({"Cache-Control": value} if value else {}) == expected
@@ -0,0 +1,64 @@
+import asyncio
+import gzip
+import json
+import threading
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from server import response_cache as response_cache_module
+from server.io_executor import run_io
+from server.response_cache import ResponseCache, parse_accept
+
+DATA = [{"id": f"m1/chapter{i}", "title": "教程" * 20} for i in range(50)]
+
+
+@web.middleware
+async def compress_body(request, handler):
+    # 与ComfyUI的--enable-compress-response-body一样，对JSON响应开启压缩
+    response = await handler(request)
+    if response.content_type == "application/json":
+        response.enable_compression()
+    return response
+
+
+def fetch(cache, accept_encoding, middlewares=()):
+    async def handler(request):
+        entry = await run_io(cache.put, "key", 1, DATA)
+        return await cache.respond(request, entry, {"ETag": '"chapters-1"'})
+
+    async def main():
+        app = web.Application(middlewares=list(middlewares))
+        app.router.add_get("/", handler)
+        async with TestClient(TestServer(app)) as client:
+            response = await client.get("/", headers={"Accept-Encoding": accept_encoding}, auto_decompress=False)
+            return response.status, response.headers.copy(), await response.read()
+
+    return asyncio.run(main())
+
+
+def test_parse_accept():
+    assert parse_accept("gzip;q=0, br, deflate;q=0.5") == {"br", "deflate"}
+
+
+def test_gzip_variant_is_not_compressed_twice():
+    status, headers, body = fetch(ResponseCache(), "gzip", [compress_body])
+    assert status == 200 and headers["Content-Encoding"] == "gzip"
+    assert json.loads(gzip.decompress(body)) == DATA
+
+
+def test_encoded_variants_use_weak_etag():
+    _, headers, body = fetch(ResponseCache(), "identity")
+    assert headers["ETag"] == '"chapters-1"' and "Content-Encoding" not in headers
+    assert json.loads(body) == DATA
+    _, headers, _ = fetch(ResponseCache(), "gzip")
+    assert headers["ETag"] == 'W/"chapters-1"'
+
+
+def test_serialization_and_compression_stay_off_the_event_loop(monkeypatch):
+    threads = []
+    original = gzip.compress
+    monkeypatch.setattr(response_cache_module.gzip, "compress",
+                        lambda *args, **kwargs: threads.append(threading.current_thread()) or original(*args, **kwargs))
+    fetch(ResponseCache(), "gzip")
+    assert threads and threading.main_thread() not in threads
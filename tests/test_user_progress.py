@@ -0,0 +1,96 @@
+import pytest
+
+from server.progress_store import create_progress_store
+from server.user_progress import UserProgressRegistry, normalize_namespace
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def make_registry(request, tmp_path):
+    def make(**kwargs):
+        return UserProgressRegistry(
+            lambda namespace: create_progress_store(str(tmp_path), backend=request.param, namespace=namespace), **kwargs)
+    return make
+
+
+def stored_chapters(registry, namespace):
+    return set(registry.get(namespace).store.load()["completed_chapters"])
+
+
+def test_normalize_namespace():
+    assert normalize_namespace("default") == normalize_namespace(None) == ""
+    assert normalize_namespace("alice") == "alice"
+    assert normalize_namespace("../etc").startswith("u-")
+
+
+def test_forget_chapter_reaches_users_not_yet_written(make_registry):
+    registry = make_registry(flush_delay=60)
+    registry.get("alice").apply({"op": "complete", "chapter_id": "m1/a"})
+    registry.get("alice").apply({"op": "complete", "chapter_id": "m1/b"})
+    assert "alice" not in registry.get("").store.namespaces()
+
+    registry.forget_chapter("m1/a")
+    assert set(registry.get("alice").progress()["completed_chapters"]) == {"m1/b"}
+    registry.flush()
+    assert stored_chapters(registry, "alice") == {"m1/b"}
+
+
+def test_eviction_keeps_unwritten_changes(make_registry):
+    registry = make_registry(max_users=2, flush_delay=60)
+    for name in ("u1", "u2", "u3"):
+        registry.get(name).apply({"op": "complete", "chapter_id": f"m1/{name}"})
+    assert registry.stats()["users"] <= 3
+    for name in ("u1", "u2", "u3"):
+        assert set(registry.get(name).progress()["completed_chapters"]) == {f"m1/{name}"}
+    assert registry.flush() == 3
+    assert stored_chapters(registry, "u1") == {"m1/u1"}
+
+
+def test_flush_appends_events_instead_of_rewriting(make_registry, monkeypatch):
+    registry = make_registry(flush_delay=60)
+    user = registry.get("")
+    user.apply({"op": "complete", "chapter_id": "m1/a"})
+    user.apply({"op": "complete_many", "chapter_ids": ["m1/b", "m1/c"]})
+    user.apply({"op": "uncomplete", "chapter_id": "m1/b"})
+
+    def fail(progress):
+        raise AssertionError("flush rewrote the whole progress")
+    monkeypatch.setattr(user.store, "save", fail)
+    assert registry.flush() == 1
+    assert stored_chapters(registry, "") == {"m1/a", "m1/c"}
+
+
+def test_sqlite_flush_keeps_completion_times(tmp_path):
+    import sqlite3
+    import time
+
+    registry = UserProgressRegistry(
+        lambda namespace: create_progress_store(str(tmp_path), backend="sqlite", namespace=namespace), flush_delay=60)
+    user = registry.get("")
+    user.apply({"op": "complete", "chapter_id": "m1/a"})
+    registry.flush()
+    time.sleep(0.01)
+    user.apply({"op": "complete", "chapter_id": "m1/b"})
+    registry.flush()
+    user.apply({"op": "complete", "chapter_id": "m1/c"})
+    registry.flush()
+
+    conn = sqlite3.connect(user.store.db_file)
+    rows = dict(conn.execute("SELECT chapter_id, completed_at FROM completed_chapters").fetchall())
+    conn.close()
+    assert rows["m1/a"] < rows["m1/b"] <= rows["m1/c"]
+
+
+def test_completed_queries_do_not_load_progress(make_registry):
+    writer = make_registry(flush_delay=60)
+    writer.get("alice").apply({"op": "complete_many", "chapter_ids": ["m1/a", "m1/b", "m2/c"]})
+    writer.flush()
+
+    user = make_registry(flush_delay=60).get("alice")
+    assert user.completed_count() == 3
+    assert user.completed_in_model("m1") == ["m1/a", "m1/b"]
+    assert not user.loaded
+
+    # 加载后使用内存中的进度，包含尚未写入的修改
+    user.apply({"op": "uncomplete", "chapter_id": "m1/a"})
+    assert user.completed_count() == 2
+    assert user.completed_in_model("m1") == ["m1/b"]
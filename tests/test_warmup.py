@@ -0,0 +1,14 @@
+from server.preview_cache import parse_thumbnail_width
+from server.warmup import parse_warmup_widths
+
+
+def test_widths_snap_to_served_buckets():
+    assert parse_warmup_widths("200") == [parse_thumbnail_width({"w": "200"})] == [256]
+
+
+def test_widths_are_deduplicated_and_accept_presets():
+    assert parse_warmup_widths("200, 256,small,100,2000") == [256, 128, 1024]
+
+
+def test_invalid_widths_are_skipped():
+    assert parse_warmup_widths("abc,-5,,64") == [64]